@@ -88,8 +88,8 @@
 
 import os
 import cv2
-from ultralytics import YOLO
-import matplotlib.pyplot as plt
+from ensemble import EnsembleEngine, draw_detections, load_thresholds
+from fusion import fuse_detections
 
 # ------------------------------ Config ------------------------------
 # Model paths
@@ -110,11 +110,11 @@ input_folder = 'test_images'
 output_folder = 'result_photos'
 os.makedirs(output_folder, exist_ok=True)
 
-# Confidence threshold
-CONF_THRESHOLD = 0.5
+# Per-class confidence thresholds (thresholds.json from tune_thresholds.py, else 0.5)
+thresholds = load_thresholds(class_names)
 
 # ------------------------------ Load Models ------------------------------
-models = [YOLO(path) for path in model_paths]
+engine = EnsembleEngine(dict(zip(class_names, model_paths)))
 
 # ------------------------------ Process All Images ------------------------------
 image_files = [f for f in os.listdir(input_folder) if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
@@ -124,30 +124,12 @@ print(f"\n📁 Found {len(image_files)} test images. Starting ensemble detection
 for img_name in image_files:
     img_path = os.path.join(input_folder, img_name)
     image = cv2.imread(img_path)
-    all_detections = []
-
-    for model, class_name in zip(models, class_names):
-        results = model(img_path)
-        for r in results:
-            if r.boxes is not None:
-                boxes = r.boxes.xyxy.cpu().numpy()
-                confs = r.boxes.conf.cpu().numpy()
-                for box, conf in zip(boxes, confs):
-                    if float(conf) > CONF_THRESHOLD:
-                        det = {
-                            'class': class_name,
-                            'conf': float(conf),
-                            'box': [float(x) for x in box]
-                        }
-                        all_detections.append(det)
+    dets = engine.predict(image, conf=float(thresholds['conf'].min()), iou=thresholds['nms_iou'])
+    dets = fuse_detections(dets, thresholds['fusion'], iou_thres=thresholds['fusion_iou'], agnostic=thresholds['agnostic'])
+    dets = dets.filter(thresholds['conf'])
 
     # Draw all detections
-    for det in all_detections:
-        x1, y1, x2, y2 = map(int, det['box'])
-        label = f"{det['class']} {det['conf']:.2f}"
-        color = color_map.get(det['class'], (255, 255, 0))
-        cv2.rectangle(image, (x1, y1), (x2, y2), color, 2)
-        cv2.putText(image, label, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, color, 2)
+    draw_detections(image, dets, class_names, color_map)
 
     # Save result image
     save_path = os.path.join(output_folder, img_name)
@@ -0,0 +1,92 @@
+"""Benchmark fusion.py against the old per-box ensemble merge.
+
+The old ensemble_evaluate.py walked every ultralytics ``Boxes`` entry in Python
+(``box.xywh[0].cpu().numpy()``), stacked the lists into a torch tensor and ran
+torch NMS. At ``conf=0.001`` each model returns hundreds of low-confidence
+boxes per image, so that loop dominated evaluation time. This script
+synthesizes such predictions (jittered copies around a few objects, plus
+background noise) and times both paths.
+
+Usage:
+    python benchmark_fusion.py --boxes 1000 3000 10000 --repeat 5
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+import torchvision
+from ultralytics.engine.results import Boxes
+
+from fusion import nms, soft_nms, weighted_boxes_fusion
+
+IMAGE_SHAPE = (1080, 1920)
+
+
+def synthetic_predictions(n_boxes, n_objects=12, n_classes=3, seed=0):
+    """(n_boxes, 6) [x1, y1, x2, y2, conf, cls] rows spread like low-confidence detector output."""
+    rng = np.random.default_rng(seed)
+    h, w = IMAGE_SHAPE
+    centers = rng.uniform([100, 100], [w - 100, h - 100], size=(n_objects, 2))
+    sizes = rng.uniform(40, 250, size=(n_objects, 2))
+    obj = rng.integers(0, n_objects, n_boxes)
+    noise = rng.random(n_boxes) < 0.3  # boxes not near any object
+    c = np.where(noise[:, None], rng.uniform([0, 0], [w, h], size=(n_boxes, 2)),
+                 centers[obj] + rng.normal(0, 8, size=(n_boxes, 2)))
+    s = np.where(noise[:, None], rng.uniform(10, 200, size=(n_boxes, 2)),
+                 sizes[obj] * rng.normal(1, 0.08, size=(n_boxes, 2)))
+    boxes = np.concatenate([c - s / 2, c + s / 2], axis=1).clip(0, [w, h, w, h])
+    conf = np.where(noise, rng.uniform(0.001, 0.05, n_boxes), rng.uniform(0.001, 0.95, n_boxes))
+    cls = np.where(noise, rng.integers(0, n_classes, n_boxes), obj % n_classes)
+    return np.column_stack([boxes, conf, cls]).astype(np.float32)
+
+
+def legacy_merge(preds, iou_thres=0.5):
+    """Old path: per-box Python loop over ultralytics Boxes, then torch NMS."""
+    all_preds = []
+    for box in Boxes(torch.from_numpy(preds), IMAGE_SHAPE):
+        x, y, w, h = box.xywh[0].cpu().numpy()
+        conf = box.conf[0].cpu().numpy()
+        cls = box.cls[0].cpu().numpy()
+        all_preds.append([cls, x, y, w, h, conf])
+    all_preds = np.array(all_preds)
+    xywh = torch.tensor(all_preds[:, 1:5], dtype=torch.float32)
+    xyxy = torch.cat([xywh[:, :2] - xywh[:, 2:] / 2, xywh[:, :2] + xywh[:, 2:] / 2], dim=1)
+    keep = torchvision.ops.nms(xyxy, torch.tensor(all_preds[:, 5], dtype=torch.float32), iou_thres)
+    return all_preds[keep.numpy()]
+
+
+def best_time(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn()
+        times.append(time.perf_counter() - start)
+    return min(times), out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark ensemble box fusion.")
+    parser.add_argument('--boxes', type=int, nargs='+', default=[1000, 3000, 10000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--iou', type=float, default=0.5)
+    args = parser.parse_args()
+
+    torch.set_num_threads(1)
+    methods = {
+        'legacy loop + torch nms': lambda p: legacy_merge(p, args.iou),
+        'fusion.nms': lambda p: nms(p, args.iou, agnostic=True),
+        'fusion.soft_nms': lambda p: soft_nms(p, args.iou, agnostic=True),
+        'fusion.wbf': lambda p: weighted_boxes_fusion(p, args.iou, agnostic=True),
+    }
+    print(f"{'boxes':>7} | {'method':<24} | {'ms':>9} | {'kept':>6}")
+    for n_boxes in args.boxes:
+        preds = synthetic_predictions(n_boxes)
+        for name, fn in methods.items():
+            elapsed, out = best_time(lambda: fn(preds), args.repeat)
+            print(f"{n_boxes:>7} | {name:<24} | {1000 * elapsed:9.2f} | {len(out):>6}")
+        # Sanity check: both NMS paths must keep the same boxes
+        legacy = legacy_merge(preds, args.iou)
+        ours = nms(preds, args.iou, agnostic=True)
+        match = len(legacy) == len(ours) and np.allclose(np.sort(legacy[:, 5]), np.sort(ours[:, 4]))
+        print(f"{'':>7} | {'legacy == fusion.nms':<24} | {'✅' if match else '❌':>9} |")
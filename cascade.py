@@ -0,0 +1,327 @@
+"""Cascade execution: one fast multi-class pass, the one-class specialists only where it is unsure.
+
+``CascadeEngine`` wraps an ``EnsembleEngine`` and has the same interface
+(``predict`` / ``predict_batch`` / ``class_names`` / ``fingerprint`` /
+``last_timings``), so the apps can swap it in. Per batch:
+
+1. ``multiclass5`` runs on every image at the lower edge of ``band``.
+2. Detections at or above the upper edge are confident and kept. The others
+   (the uncertain band) are escalated to the specialists. With
+   ``escalate='crop'`` (default) only padded crops around the uncertain boxes
+   go through; overlapping crops are merged. An image whose boxes are all
+   uncertain, or that has too many uncertain regions or crops covering most of
+   the frame, escalates on the full frame. An image where the fast pass finds
+   nothing, so no score inside the band, is done after one pass
+   (``escalate_empty=True`` sends it to the specialists anyway).
+3. The specialists' boxes replace the escalated fast-pass boxes. Callers fuse
+   and cut at the per-class thresholds as before, which also drops
+   duplicates between kept and escalated boxes.
+
+Escalation counts and pass timings are accumulated in ``engine.stats`` and
+logged every ``log_every`` images. ``python cascade.py`` compares cascade and
+plain ensemble on the test set: ms/image, escalation rates, and per-class
+recall and mAP at the tuned operating point.
+
+Usage:
+    python cascade.py
+    python cascade.py --band 0.2 0.7 --escalate frame
+    python cascade.py --escalate-empty
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from ensemble import (CLASS_NAMES, MODEL_PATHS, ROOT_DIR, Detections, EnsembleEngine, apply_threads,
+                      concat_detections, crop_to_frame, file_sha256, load_thresholds, scale_boxes)
+from evaluate_map import evaluate
+from fusion import fuse_detections
+
+FAST_MODEL_PATH = os.path.join(ROOT_DIR, 'runs', 'detect', 'multiclass5', 'weights', 'best.pt')
+CASCADE_BAND = (0.1, 0.6)  # fast-pass scores in [low, high) are uncertain
+CROP_CONTEXT = 0.5         # padding on each side of an uncertain box, as a fraction of its size
+MIN_CROP = 160             # crops are at least this many pixels wide and high
+MAX_CROPS = 4              # more regions than this escalate the whole frame
+MAX_CROP_AREA = 0.5        # so do crops covering more than this fraction of the frame
+LOG_EVERY = 500            # images between escalation log lines
+TEST_IMG_DIR = 'data/test/images'
+TEST_LABEL_DIR = 'data/test/labels'
+REPORT_PATH = os.path.join(ROOT_DIR, 'runs', 'detect', 'cascade_report.json')
+
+
+# ---------------- Regions ----------------
+def crop_regions(boxes, shape, context=CROP_CONTEXT, min_size=MIN_CROP):
+    """Padded, merged integer crops (x1, y1, x2, y2) around ``boxes`` inside an image of ``shape``."""
+    h, w = shape
+    size = boxes[:, 2:] - boxes[:, :2]
+    half = np.maximum(size * (0.5 + context), min_size / 2)
+    center = (boxes[:, :2] + boxes[:, 2:]) / 2
+    crops = np.concatenate([center - half, center + half], axis=1)
+    crops = np.clip(crops, 0, [w, h, w, h]).round().astype(np.int64).tolist()
+    # Merge overlapping crops until none overlap, so no region is run twice
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(crops)):
+            for j in range(i + 1, len(crops)):
+                a, b = crops[i], crops[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    crops[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                    del crops[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return crops
+
+
+# ---------------- Stats ----------------
+class CascadeStats:
+    """Escalation counters, safe to update from several request threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.images = self.frames = self.crop_images = self.crops = self.empty = 0
+        self.fast_s = self.specialist_s = 0.0
+
+    def record(self, images, frames, crop_images, crops, empty, fast_s, specialist_s):
+        with self._lock:
+            before = self.images
+            self.images += images
+            self.frames += frames
+            self.empty += empty
+            self.crop_images += crop_images
+            self.crops += crops
+            self.fast_s += fast_s
+            self.specialist_s += specialist_s
+            return before, self.images
+
+    def snapshot(self):
+        with self._lock:
+            n = max(self.images, 1)
+            return {
+                'images': self.images,
+                'escalated_frames': self.frames,
+                'escalated_crop_images': self.crop_images,
+                'crops': self.crops,
+                'empty_frames': self.empty,
+                'empty_rate': self.empty / n,
+                'escalation_rate': (self.frames + self.crop_images) / n,
+                'frame_rate': self.frames / n,
+                'crop_rate': self.crop_images / n,
+                'fast_ms_per_image': 1000 * self.fast_s / n,
+                'specialist_ms_per_image': 1000 * self.specialist_s / n,
+            }
+
+
+# ---------------- Engine ----------------
+class CascadeEngine:
+    """``multiclass5`` first; the wrapped EnsembleEngine only on uncertain regions or frames."""
+
+    def __init__(self, specialists, fast_model_path=FAST_MODEL_PATH, band=CASCADE_BAND, escalate='crop',
+                 escalate_empty=False, log_every=LOG_EVERY):
+        if escalate not in ('crop', 'frame'):
+            raise ValueError(f"escalate must be 'crop' or 'frame', got {escalate!r}")
+        from ultralytics import YOLO
+        self.specialists = specialists
+        self.class_names = specialists.class_names
+        self.imgsz = specialists.imgsz
+        self.band = tuple(float(b) for b in band)
+        self.escalate = escalate
+        self.escalate_empty = escalate_empty
+        self.log_every = log_every
+        self.fast_model_path = fast_model_path
+        self.fast = YOLO(fast_model_path, task='detect')
+        # Fast-model class id -> specialist class id, matched by name (-1: not a served class)
+        names = self.fast.names
+        self._class_map = np.array([self.class_names.index(names[i]) if names[i] in self.class_names else -1
+                                    for i in range(len(names))], dtype=np.int64)
+        self.models = {'cascade': self.fast, **specialists.models}
+        self.fingerprint = hashlib.sha256(
+            f"{specialists.fingerprint}:{file_sha256(fast_model_path)}:{self.band}:{escalate}:{escalate_empty}".encode()).hexdigest()
+        self.stats = CascadeStats()
+        self.last_timings = {}
+        self._lock = threading.Lock()
+
+    @property
+    def device(self):
+        return self.specialists.device
+
+    @property
+    def num_threads(self):
+        return self.specialists.num_threads
+
+    @num_threads.setter
+    def num_threads(self, value):
+        self.specialists.num_threads = value
+
+    def close(self):
+        self.specialists.close()
+
+    def _fast_pass(self, images, iou):
+        tensor, metas = self.specialists.preprocess(images)
+        with self._lock:
+            apply_threads(self.num_threads)
+            results = self.fast(tensor, conf=self.band[0], iou=iou, verbose=False)
+            apply_threads(self.num_threads)
+        out = []
+        for r, (ratio, pad, orig_shape) in zip(results, metas):
+            data = r.boxes.data.cpu().numpy() if r.boxes is not None else np.zeros((0, 6), np.float32)
+            class_ids = self._class_map[data[:, 5].astype(np.int64)]
+            keep = class_ids >= 0
+            out.append(Detections(scale_boxes(data[keep, :4].astype(np.float32), ratio, pad, orig_shape),
+                                  data[keep, 4].astype(np.float32), class_ids[keep]))
+        return out
+
+    def plan(self, dets, shape):
+        """('none' | 'crop' | 'frame', crops) for one image's fast-pass detections."""
+        if not len(dets):
+            # The fast pass runs at the band's lower edge, so an empty result has no uncertain score
+            return ('frame' if self.escalate_empty else 'none'), []
+        confident = dets.scores >= self.band[1]
+        if not confident.any():
+            return 'frame', []
+        if confident.all():
+            return 'none', []
+        if self.escalate == 'frame':
+            return 'frame', []
+        crops = crop_regions(dets.boxes[~confident], shape)
+        area = sum((x2 - x1) * (y2 - y1) for x1, y1, x2, y2 in crops)
+        if len(crops) > MAX_CROPS or area > MAX_CROP_AREA * shape[0] * shape[1]:
+            return 'frame', []
+        return 'crop', crops
+
+    def predict_batch(self, images, conf=0.25, iou=0.7):
+        """Detect on a list of BGR images; returns one Detections per image."""
+        if not images:
+            return []
+        start = time.perf_counter()
+        fast = self._fast_pass(images, iou)
+        fast_s = time.perf_counter() - start
+
+        # Everything that escalates goes to the specialists as one batch: full frames and crops alike
+        plans, inputs, owners = [], [], []
+        for i, (image, dets) in enumerate(zip(images, fast)):
+            kind, crops = self.plan(dets, image.shape[:2])
+            plans.append(kind)
+            if kind == 'frame':
+                inputs.append(image)
+                owners.append((i, None))
+            for crop in crops:
+                x1, y1, x2, y2 = crop
+                inputs.append(image[y1:y2, x1:x2])
+                owners.append((i, crop))
+        # Escalated images keep only their confident fast-pass boxes; the specialists redo the rest
+        parts = []
+        for dets, kind in zip(fast, plans):
+            keep = dets.scores >= self.band[1]
+            parts.append([Detections(dets.boxes[keep], dets.scores[keep], dets.class_ids[keep])])
+        specialist_s = 0.0
+        timings = {'cascade': fast_s}
+        if inputs:
+            start = time.perf_counter()
+            escalated = self.specialists.predict_batch(inputs, conf=conf, iou=iou)
+            specialist_s = time.perf_counter() - start
+            timings.update(self.specialists.last_timings)
+            for (i, crop), dets in zip(owners, escalated):
+                parts[i].append(dets if crop is None else crop_to_frame(dets, crop, images[i].shape[:2]))
+        self.last_timings = timings
+
+        frames = plans.count('frame')
+        crop_images = plans.count('crop')
+        empty = sum(not len(dets) for dets in fast)
+        before, after = self.stats.record(len(images), frames, crop_images, len(inputs) - frames, empty, fast_s,
+                                          specialist_s)
+        if self.log_every and before // self.log_every != after // self.log_every:
+            s = self.stats.snapshot()
+            print(f"🪜 Cascade: {s['images']} images, {100 * s['escalation_rate']:.1f}% escalated "
+                  f"({100 * s['frame_rate']:.1f}% full frame, {100 * s['crop_rate']:.1f}% crops, "
+                  f"{100 * s['empty_rate']:.1f}% empty), "
+                  f"fast {s['fast_ms_per_image']:.1f} ms + specialists {s['specialist_ms_per_image']:.1f} ms per image")
+        return [concat_detections(p) for p in parts]
+
+    def predict(self, image, conf=0.25, iou=0.7):
+        return self.predict_batch([image], conf=conf, iou=iou)[0]
+
+
+# ---------------- Benchmark ----------------
+def run_and_write(engine, images, image_ids, pred_dir, thresholds):
+    """Detect + fuse + cut at the operating point, like the backend. Returns ms per image."""
+    times = []
+    for image, image_id in zip(images, image_ids):
+        start = time.perf_counter()
+        dets = engine.predict(image, conf=float(thresholds['conf'].min()), iou=thresholds['nms_iou'])
+        dets = fuse_detections(dets, thresholds['fusion'], iou_thres=thresholds['fusion_iou'],
+                               agnostic=thresholds['agnostic']).filter(thresholds['conf'])
+        times.append(time.perf_counter() - start)
+        h, w = image.shape[:2]
+        xyxy = dets.boxes / np.array([w, h, w, h], dtype=np.float32)
+        xywh = np.concatenate([(xyxy[:, :2] + xyxy[:, 2:]) / 2, xyxy[:, 2:] - xyxy[:, :2]], axis=1)
+        with open(os.path.join(pred_dir, image_id + '.txt'), 'w') as f:
+            f.writelines(f"{cls} {x:.6f} {y:.6f} {bw:.6f} {bh:.6f} {conf:.6f}\n" for cls, (x, y, bw, bh), conf
+                         in zip(dets.class_ids.tolist(), xywh.tolist(), dets.scores.tolist()))
+    return 1000 * float(np.mean(times[1:] or times))  # the first call pays for lazy initialisation
+
+
+def compare(img_paths, label_dir, band, escalate, escalate_empty=False, device=None):
+    thresholds = load_thresholds()
+    specialists = EnsembleEngine(MODEL_PATHS, device=device)
+    cascade = CascadeEngine(specialists, band=band, escalate=escalate, escalate_empty=escalate_empty, log_every=0)
+    images = [cv2.imread(p) for p in img_paths]
+    image_ids = [os.path.splitext(os.path.basename(p))[0] for p in img_paths]
+    result = {'images': len(images), 'device': str(specialists.device), 'band': list(band), 'escalate': escalate,
+              'escalate_empty': escalate_empty}
+    for name, engine in (('ensemble', specialists), ('cascade', cascade)):
+        with tempfile.TemporaryDirectory() as pred_dir:
+            ms = run_and_write(engine, images, image_ids, pred_dir, thresholds)
+            metrics = evaluate(pred_dir, label_dir, CLASS_NAMES)
+        result[name] = {
+            'ms_per_image': ms,
+            'map50': metrics['map50'],
+            # Predictions are already cut at the operating point, so the end of the curve is its recall
+            'recall': {cls: float(metrics['r_curve'][c, 0]) for c, cls in enumerate(CLASS_NAMES)},
+        }
+    result['cascade'].update(cascade.stats.snapshot())
+    result['cascade']['speedup'] = result['ensemble']['ms_per_image'] / max(result['cascade']['ms_per_image'], 1e-9)
+    specialists.close()
+    return result
+
+
+def print_comparison(result):
+    print(f"\n{'Engine':<10} {'ms/img':>8} {'mAP50':>7} " + ' '.join(f"{'R ' + cls[:10]:>12}" for cls in CLASS_NAMES))
+    for name in ('ensemble', 'cascade'):
+        r = result[name]
+        print(f"{name:<10} {r['ms_per_image']:>8.1f} {r['map50']:>7.4f} "
+              + ' '.join(f"{r['recall'][cls]:>12.4f}" for cls in CLASS_NAMES))
+    c = result['cascade']
+    print(f"\n🪜 {100 * c['escalation_rate']:.1f}% of {result['images']} images escalated "
+          f"({100 * c['frame_rate']:.1f}% full frame, {100 * c['crop_rate']:.1f}% crops, {c['crops']} crops; "
+          f"{c['empty_frames']} empty after the fast pass), "
+          f"{c['speedup']:.2f}x faster than the ensemble on {result['device']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare cascade and full-ensemble inference on a labelled split.")
+    parser.add_argument('--images', default=TEST_IMG_DIR)
+    parser.add_argument('--labels', default=TEST_LABEL_DIR)
+    parser.add_argument('--band', type=float, nargs=2, default=CASCADE_BAND, metavar=('LOW', 'HIGH'))
+    parser.add_argument('--escalate', default='crop', choices=['crop', 'frame'])
+    parser.add_argument('--escalate-empty', action='store_true',
+                        help="also send images where the fast pass finds nothing to the specialists")
+    parser.add_argument('--device', default=None)
+    args = parser.parse_args()
+
+    img_paths = sorted(glob.glob(os.path.join(args.images, '*.png')))
+    result = compare(img_paths, args.labels, args.band, args.escalate, args.escalate_empty, args.device)
+    print_comparison(result)
+    os.makedirs(os.path.dirname(REPORT_PATH), exist_ok=True)
+    with open(REPORT_PATH, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f"🧾 Saved to {REPORT_PATH}")
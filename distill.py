@@ -0,0 +1,333 @@
+"""Distill the three one-class models into one multi-class student.
+
+Serving the ensemble costs three YOLOv8s forward passes per image. Here the
+ensemble is the teacher for a single multi-class student:
+
+1. ``labels``: the teacher's raw predictions over ``data/train/images`` and the
+   unlabelled frames in ``streamlit_app/data_collection/`` come from the
+   prediction store (prediction_store.py), so the teacher runs at most once per
+   weights + image set. They are fused and cut at the per-class thresholds
+   from thresholds.json (tune_thresholds.py) and written as YOLO pseudo-labels
+   to ``data/distill/train``. Images are linked, not copied (grouping.place_file).
+   ``--train-labels`` sets what the labelled images get: ``merge`` (default)
+   keeps the ground truth and adds teacher boxes that match no ground-truth box,
+   ``teacher`` uses the teacher only, and ``gt`` uses the ground truth only. An
+   unlabelled frame is left out when the teacher has a box between
+   ``--uncertain-conf`` and the class threshold. Such an object would be
+   taught as background. Collected frames are raw uploads and may be copies of
+   dataset images, so any whose bytes match a data/val or data/test image is
+   dropped too. Otherwise the test split would leak into training.
+2. ``train``: the student trains on ``data/distill/distill.yaml`` with
+   train_multiclass.TRAIN_ARGS, through the same image cache and throughput
+   trainer. The default model is yolov8s, the size of one teacher model.
+3. ``report``: teacher and student are scored on the test set with the same
+   evaluator (evaluate_map.py, conf 0.001) and the same per-model NMS IoU (the
+   tuned ``nms_iou``). Their latency is timed per image on the same device.
+   Results go to ``runs/detect/distill_report.json``.
+
+Usage:
+    python distill.py                                   # labels + train + report
+    python distill.py --steps labels --train-labels teacher
+    python distill.py --steps report --weights runs/detect/distill/weights/best.pt
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+import cv2
+import numpy as np
+import yaml
+from ultralytics import YOLO
+
+from ensemble import (CLASS_NAMES, MODEL_PATHS, ROOT_DIR, Detections, EnsembleEngine, box_iou,
+                      concat_detections, file_sha256, load_thresholds)
+from evaluate_map import evaluate, xywh_to_xyxy
+from fusion import fuse_detections
+from grouping import IMAGE_EXTENSIONS, place_file
+from image_cache import CachedDetectionTrainer, open_cache
+from label_index import open_index
+from prediction_store import open_or_build
+from train_metrics import instrumented
+from train_multiclass import TRAIN_ARGS
+
+TRAIN_IMG_DIR = 'data/train/images'
+TRAIN_LABEL_DIR = 'data/train/labels'
+VAL_IMG_DIR = 'data/val/images'
+TEST_IMG_DIR = 'data/test/images'
+TEST_LABEL_DIR = 'data/test/labels'
+COLLECTED_DIR = 'streamlit_app/data_collection'
+DISTILL_DIR = 'data/distill'
+DISTILL_YAML = os.path.join(DISTILL_DIR, 'distill.yaml')
+RUNS_DIR = os.path.join(ROOT_DIR, 'runs', 'detect')
+REPORT_PATH = os.path.join(RUNS_DIR, 'distill_report.json')
+STUDENT_MODEL = 'yolov8s.pt'
+UNCERTAIN_CONF = 0.1
+MATCH_IOU = 0.5     # a teacher box at or above this IoU with a ground-truth box is the same object
+COLLECTED_PREFIX = 'collected_'  # keeps frame names apart from data/train stems (and its image cache keys)
+
+
+def list_images(folder):
+    if not os.path.isdir(folder):
+        return []
+    return sorted(os.path.join(folder, f) for f in os.listdir(folder) if f.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def yolo_lines(dets, h, w, with_conf=False):
+    """``cls cx cy w h`` label lines (``+ conf`` for prediction files) of pixel-space Detections."""
+    xyxy = (dets.boxes / np.array([w, h, w, h], dtype=np.float32)).clip(0, 1)
+    xywh = np.concatenate([(xyxy[:, :2] + xyxy[:, 2:]) / 2, xyxy[:, 2:] - xyxy[:, :2]], axis=1)
+    if with_conf:
+        return [f"{cls} {x:.6f} {y:.6f} {bw:.6f} {bh:.6f} {conf:.6f}\n" for cls, (x, y, bw, bh), conf
+                in zip(dets.class_ids.tolist(), xywh.tolist(), dets.scores.tolist())]
+    return [f"{cls} {x:.6f} {y:.6f} {bw:.6f} {bh:.6f}\n" for cls, (x, y, bw, bh) in zip(dets.class_ids.tolist(), xywh.tolist())]
+
+
+def held_out_copies(paths, held_out_dirs=(VAL_IMG_DIR, TEST_IMG_DIR)):
+    """The paths whose content is byte-identical to an image in ``held_out_dirs``."""
+    held_out = [p for d in held_out_dirs for p in list_images(d)]
+    # Only files of equal size can match, so most images on either side are never hashed
+    common = {os.path.getsize(p) for p in paths} & {os.path.getsize(p) for p in held_out}
+    hashes = {file_sha256(p) for p in held_out if os.path.getsize(p) in common}
+    return {p for p in paths if os.path.getsize(p) in common and file_sha256(p) in hashes}
+
+
+def gt_detections(gt, h, w):
+    boxes = xywh_to_xyxy(gt[:, 1:5]) * np.array([w, h, w, h], dtype=np.float32)
+    return Detections(boxes.astype(np.float32), np.ones(len(gt), np.float32), gt[:, 0].astype(np.int64))
+
+
+# ---------------- Pseudo-labels ----------------
+def teacher_detections(store, thresholds, uncertain_conf=UNCERTAIN_CONF):
+    """Yields (image_id, (h, w), kept, uncertain) per stored image, at the tuned operating point.
+
+    ``uncertain`` counts the boxes above ``uncertain_conf`` that the class threshold drops.
+    """
+    for image_id, (h, w), dets in store:
+        dets = fuse_detections(dets, thresholds['fusion'], iou_thres=thresholds['fusion_iou'],
+                               agnostic=thresholds['agnostic'])
+        kept = dets.filter(thresholds['conf'])
+        uncertain = int((dets.scores > uncertain_conf).sum()) - len(kept)
+        yield image_id, (h, w), kept, uncertain
+
+
+def merge_labels(gt_dets, teacher):
+    """Ground truth plus the teacher boxes that overlap no ground-truth box of their class."""
+    if not len(gt_dets) or not len(teacher):
+        return concat_detections([gt_dets, teacher])
+    iou = box_iou(teacher.boxes, gt_dets.boxes)
+    iou[teacher.class_ids[:, None] != gt_dets.class_ids[None, :]] = 0
+    extra = iou.max(axis=1) < MATCH_IOU
+    return concat_detections([gt_dets, Detections(teacher.boxes[extra], teacher.scores[extra], teacher.class_ids[extra])])
+
+
+def build_dataset(train_labels='merge', collected=True, uncertain_conf=UNCERTAIN_CONF, mode='auto'):
+    """Write ``data/distill/train`` (links + pseudo-labels) and ``distill.yaml``. Returns counts."""
+    thresholds = load_thresholds()
+    if thresholds['source'] is None:
+        print("⚠️  No thresholds.json, cutting the teacher at 0.5 (run tune_thresholds.py first)")
+    image_dir, label_dir = os.path.join(DISTILL_DIR, 'train', 'images'), os.path.join(DISTILL_DIR, 'train', 'labels')
+    # Rebuilt from scratch: links are cheap and stale pseudo-labels must not survive a new teacher
+    shutil.rmtree(os.path.join(DISTILL_DIR, 'train'), ignore_errors=True)
+    os.makedirs(image_dir)
+    os.makedirs(label_dir)
+    counts = {'labelled': 0, 'collected': 0, 'collected_skipped': 0, 'collected_held_out': 0, 'teacher_boxes': 0,
+              'gt_boxes': 0}
+
+    train_paths = list_images(TRAIN_IMG_DIR)
+    by_stem = {os.path.splitext(os.path.basename(p))[0]: p for p in train_paths}
+    gt_index = open_index(TRAIN_LABEL_DIR)
+    store = open_or_build(train_paths, MODEL_PATHS, iou=thresholds['nms_iou'])
+    for image_id, (h, w), teacher, _ in teacher_detections(store, thresholds):
+        gt = gt_detections(gt_index.labels(image_id), h, w)
+        if train_labels == 'gt':
+            labels, n_gt = gt, len(gt)
+        elif train_labels == 'teacher':
+            labels, n_gt = teacher, 0
+        else:
+            labels, n_gt = merge_labels(gt, teacher), len(gt)
+        src = by_stem[image_id]
+        place_file(os.path.abspath(src), os.path.join(image_dir, os.path.basename(src)), mode)
+        with open(os.path.join(label_dir, image_id + '.txt'), 'w') as f:
+            f.writelines(yolo_lines(labels, h, w))
+        counts['labelled'] += 1
+        counts['gt_boxes'] += n_gt
+        counts['teacher_boxes'] += len(labels) - n_gt
+
+    collected_paths = list_images(COLLECTED_DIR) if collected else []
+    leaked = held_out_copies(collected_paths)
+    collected_paths = [p for p in collected_paths if p not in leaked]
+    counts['collected_held_out'] = len(leaked)
+    if collected_paths:
+        by_stem = {os.path.splitext(os.path.basename(p))[0]: p for p in collected_paths}
+        store = open_or_build(collected_paths, MODEL_PATHS, iou=thresholds['nms_iou'])
+        for image_id, (h, w), teacher, uncertain in teacher_detections(store, thresholds, uncertain_conf):
+            if uncertain:
+                counts['collected_skipped'] += 1
+                continue
+            src = by_stem[image_id]
+            name = COLLECTED_PREFIX + os.path.basename(src)
+            place_file(os.path.abspath(src), os.path.join(image_dir, name), mode)
+            with open(os.path.join(label_dir, COLLECTED_PREFIX + image_id + '.txt'), 'w') as f:
+                f.writelines(yolo_lines(teacher, h, w))
+            counts['collected'] += 1
+            counts['teacher_boxes'] += len(teacher)
+
+    data = {
+        'train': os.path.abspath(image_dir),
+        'val': os.path.abspath(VAL_IMG_DIR),
+        'test': os.path.abspath(TEST_IMG_DIR),
+        'nc': len(CLASS_NAMES),
+        'names': CLASS_NAMES,
+    }
+    with open(DISTILL_YAML, 'w') as f:
+        yaml.dump(data, f)
+    return counts
+
+
+# ---------------- Student ----------------
+def train_student(model=STUDENT_MODEL, epochs=None, device=None, name='distill', use_cache=True, metrics=True):
+    """Train the student on distill.yaml with TRAIN_ARGS. Returns its best.pt."""
+    trainer = None
+    if use_cache:
+        open_cache(imgsz=TRAIN_ARGS['imgsz'], verbose=True)
+        trainer = CachedDetectionTrainer
+    if metrics:
+        trainer = instrumented(trainer)
+    args = {**TRAIN_ARGS, 'model': model}
+    if epochs:
+        args['epochs'] = epochs
+    if device is not None:
+        args['device'] = device
+    student = YOLO(args.pop('model'))
+    student.train(data=DISTILL_YAML, **args, trainer=trainer, project=RUNS_DIR, name=name)
+    return os.path.join(str(student.trainer.save_dir), 'weights', 'best.pt')
+
+
+# ---------------- Report ----------------
+def write_predictions(pred_dir, image_id, dets, h, w):
+    with open(os.path.join(pred_dir, image_id + '.txt'), 'w') as f:
+        f.writelines(yolo_lines(dets, h, w, with_conf=True))
+
+
+def student_detections(model, image, iou, conf=0.001):
+    boxes = model(image, conf=conf, iou=iou, verbose=False)[0].boxes
+    data = boxes.data.cpu().numpy() if boxes is not None else np.zeros((0, 6), np.float32)
+    return Detections(data[:, :4].astype(np.float32), data[:, 4].astype(np.float32), data[:, 5].astype(np.int64))
+
+
+def score_teacher(img_paths, thresholds):
+    with tempfile.TemporaryDirectory() as pred_dir:
+        for image_id, (h, w), dets in open_or_build(img_paths, MODEL_PATHS, iou=thresholds['nms_iou']):
+            dets = fuse_detections(dets, thresholds['fusion'], iou_thres=thresholds['fusion_iou'],
+                                   agnostic=thresholds['agnostic'])
+            write_predictions(pred_dir, image_id, dets, h, w)
+        return evaluate(pred_dir, TEST_LABEL_DIR, CLASS_NAMES)
+
+
+def score_student(model, img_paths, iou):
+    with tempfile.TemporaryDirectory() as pred_dir:
+        for path in img_paths:
+            image = cv2.imread(path)
+            image_id = os.path.splitext(os.path.basename(path))[0]
+            write_predictions(pred_dir, image_id, student_detections(model, image, iou), *image.shape[:2])
+        return evaluate(pred_dir, TEST_LABEL_DIR, CLASS_NAMES)
+
+
+def time_per_image(run, images, warmup=3):
+    for image in images[:warmup]:
+        run(image)
+    times = []
+    for image in images:
+        start = time.perf_counter()
+        run(image)
+        times.append(time.perf_counter() - start)
+    return 1000 * statistics.median(times)
+
+
+def report(weights, n_latency=50, device=None):
+    """Test-set mAP and median ms/image of the teacher ensemble and the student.
+
+    Both run their models with NMS at the IoU the thresholds were tuned at, so
+    the mAP gap comes from the models and not from the postprocessing.
+    """
+    thresholds = load_thresholds()
+    iou = thresholds['nms_iou']
+    img_paths = list_images(TEST_IMG_DIR)
+    engine = EnsembleEngine(MODEL_PATHS, device=device)
+    student = YOLO(weights, task='detect')
+    device = str(engine.device)
+    images = [cv2.imread(p) for p in img_paths[:n_latency]]
+
+    def run_teacher(image):
+        dets = engine.predict(image, iou=iou)
+        fuse_detections(dets, thresholds['fusion'], iou_thres=thresholds['fusion_iou'], agnostic=thresholds['agnostic'])
+
+    teacher_ms = time_per_image(run_teacher, images)
+    student_ms = time_per_image(lambda image: student(image, iou=iou, device=device, verbose=False), images)
+    teacher, student_metrics = score_teacher(img_paths, thresholds), score_student(student, img_paths, iou)
+    result = {'device': device, 'images': len(img_paths), 'latency_images': len(images), 'weights': weights,
+              'nms_iou': iou}
+    for name, metrics, ms in (('ensemble', teacher, teacher_ms), ('student', student_metrics, student_ms)):
+        result[name] = {
+            'map50': metrics['map50'],
+            'map50_95': metrics['map50_95'],
+            'per_class_map50': {cls: float(metrics['ap'][c, 0]) for c, cls in enumerate(CLASS_NAMES)},
+            'ms_per_image': ms,
+        }
+    result['student']['map50_95_drop'] = result['ensemble']['map50_95'] - result['student']['map50_95']
+    result['student']['cost_vs_ensemble'] = student_ms / max(teacher_ms, 1e-9)
+    engine.close()
+    return result
+
+
+def print_report(result):
+    print(f"\n{'Model':<10} {'mAP50':>7} {'mAP50-95':>9} {'ms/img':>8} {'cost':>6}   ({result['device']}, "
+          f"{result['images']} test images)")
+    for name in ('ensemble', 'student'):
+        r = result[name]
+        cost = f"{r.get('cost_vs_ensemble', 1.0):.2f}x"
+        print(f"{name:<10} {r['map50']:>7.4f} {r['map50_95']:>9.4f} {r['ms_per_image']:>8.1f} {cost:>6}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Distill the one-class ensemble into one multi-class student.")
+    parser.add_argument('--steps', nargs='+', default=['labels', 'train', 'report'], choices=['labels', 'train', 'report'])
+    parser.add_argument('--train-labels', default='merge', choices=['merge', 'teacher', 'gt'],
+                        help="labels of the data/train images: ground truth + unmatched teacher boxes, teacher only, or ground truth only")
+    parser.add_argument('--no-collected', action='store_true', help=f"leave out the unlabelled frames in {COLLECTED_DIR}")
+    parser.add_argument('--uncertain-conf', type=float, default=UNCERTAIN_CONF,
+                        help="drop an unlabelled frame if the teacher has a box between this and the class threshold")
+    parser.add_argument('--link-mode', default='auto', choices=['auto', 'hardlink', 'reflink', 'symlink', 'copy'])
+    parser.add_argument('--model', default=STUDENT_MODEL, help="student architecture / starting weights")
+    parser.add_argument('--epochs', type=int, default=None, help=f"default: TRAIN_ARGS ({TRAIN_ARGS['epochs']})")
+    parser.add_argument('--device', default=None)
+    parser.add_argument('--name', default='distill')
+    parser.add_argument('--weights', default=os.path.join(RUNS_DIR, 'distill', 'weights', 'best.pt'),
+                        help="student to report on when the train step is skipped")
+    parser.add_argument('--latency-images', type=int, default=50)
+    parser.add_argument('--no-image-cache', action='store_true')
+    parser.add_argument('--no-metrics', action='store_true', help="do not write throughput.csv")
+    args = parser.parse_args()
+    device = int(args.device) if args.device and args.device.isdigit() else args.device
+
+    if 'labels' in args.steps:
+        counts = build_dataset(args.train_labels, not args.no_collected, args.uncertain_conf, args.link_mode)
+        print(f"🏷️  {counts['labelled']} labelled + {counts['collected']} collected images "
+              f"({counts['collected_skipped']} ambiguous frames and {counts['collected_held_out']} copies of val/test "
+              f"images left out), {counts['gt_boxes']} ground-truth + "
+              f"{counts['teacher_boxes']} teacher boxes -> {DISTILL_YAML}")
+    weights = args.weights
+    if 'train' in args.steps:
+        print("Starting student training on the teacher's labels...\n")
+        weights = train_student(args.model, args.epochs, device, args.name, not args.no_image_cache, not args.no_metrics)
+    if 'report' in args.steps:
+        result = report(weights, args.latency_images, device)
+        print_report(result)
+        os.makedirs(os.path.dirname(REPORT_PATH), exist_ok=True)
+        with open(REPORT_PATH, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"\n✅ Report saved to {REPORT_PATH}")
@@ -0,0 +1,569 @@
+"""Shared ensemble inference engine for the three one-class YOLOv8 models.
+
+The backend, the Streamlit app, Testing.py and ensemble_evaluate.py all run the
+FireExtinguisher / ToolBox / OxygenTank models on the same image. The engine
+decodes and letterboxes each image once, feeds the same tensor to every model
+and returns the merged detections as NumPy arrays.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+import cv2
+import numpy as np
+
+# torch and ultralytics are imported where the engine first needs them: the
+# image, threshold and Detections helpers stay cheap to import, and the apps can
+# accept connections while a background thread loads the models (EngineLoader).
+
+# ------------------------------ Config ------------------------------
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Class order matches data/classes.txt; a model's position is its class id
+CLASS_NAMES = ['FireExtinguisher', 'ToolBox', 'OxygenTank']
+MODEL_PATHS = {
+    cls: os.path.join(ROOT_DIR, 'runs', 'detect', cls, 'weights', 'best.pt')
+    for cls in CLASS_NAMES
+}
+COLOR_MAP = {
+    'FireExtinguisher': (0, 255, 0),   # Green
+    'ToolBox': (255, 0, 0),            # Blue
+    'OxygenTank': (0, 0, 255)          # Red
+}
+IMGSZ = 640
+STRIDE = 32
+# Per-class operating point written by tune_thresholds.py
+THRESHOLDS_PATH = os.path.join(ROOT_DIR, 'thresholds.json')
+DEFAULT_CONF = 0.5
+DEFAULT_NMS_IOU = 0.7  # per-model NMS IoU when nothing was tuned (ultralytics' predict default)
+# Inference backends: where export_models.py puts each format next to best.pt
+BACKEND_SUFFIXES = {
+    'torch': '.pt',
+    'onnx': '.onnx',                          # ONNX Runtime
+    'onnx-int8': '_int8.onnx',                # ONNX Runtime, static INT8
+    'openvino': '_openvino_model',            # OpenVINO IR folder
+    'openvino-int8': '_int8_openvino_model',  # OpenVINO IR folder, static INT8
+}
+
+
+# ------------------------------ Detections ------------------------------
+class Detections(NamedTuple):
+    boxes: np.ndarray      # (N, 4) float32, xyxy in original image pixels
+    scores: np.ndarray     # (N,) float32
+    class_ids: np.ndarray  # (N,) int64, index into the engine's class names
+
+    def __len__(self):
+        return len(self.scores)
+
+    def filter(self, conf):
+        """Keep detections with a score strictly above ``conf`` (a scalar, or one value per class id)."""
+        conf = np.asarray(conf, dtype=np.float32)
+        keep = self.scores > (conf[self.class_ids] if conf.ndim else conf)
+        return Detections(self.boxes[keep], self.scores[keep], self.class_ids[keep])
+
+    def to_dicts(self, class_names):
+        """Legacy ``[{'class', 'conf', 'box'}]`` representation used by the apps."""
+        return [
+            {'class': class_names[cid], 'conf': float(conf), 'box': [float(x) for x in box]}
+            for box, conf, cid in zip(self.boxes.tolist(), self.scores.tolist(), self.class_ids.tolist())
+        ]
+
+    def class_counts(self, class_names):
+        counts = np.bincount(self.class_ids, minlength=len(class_names))
+        return {cls: int(n) for cls, n in zip(class_names, counts)}
+
+
+def empty_detections():
+    return Detections(
+        np.zeros((0, 4), dtype=np.float32),
+        np.zeros((0,), dtype=np.float32),
+        np.zeros((0,), dtype=np.int64),
+    )
+
+
+def concat_detections(parts):
+    parts = [p for p in parts if len(p)]
+    if not parts:
+        return empty_detections()
+    return Detections(
+        np.concatenate([p.boxes for p in parts]),
+        np.concatenate([p.scores for p in parts]),
+        np.concatenate([p.class_ids for p in parts]),
+    )
+
+
+# ------------------------------ Operating point ------------------------------
+def load_thresholds(class_names=CLASS_NAMES, path=THRESHOLDS_PATH, default_conf=DEFAULT_CONF):
+    """Per-class confidence thresholds and fusion settings from ``path``.
+
+    Returns ``{'conf': float32 array in class order, 'nms_iou', 'fusion',
+    'fusion_iou', 'agnostic', 'source'}``. ``nms_iou`` is the per-model NMS IoU
+    the thresholds were tuned at; serving must run the models at it. Without a
+    thresholds file every class uses ``default_conf``, the models run at
+    ``DEFAULT_NMS_IOU`` and their boxes are fused with class-agnostic NMS at IoU 0.5.
+    """
+    config = {}
+    if path and os.path.exists(path):
+        with open(path) as f:
+            config = json.load(f)
+    per_class = config.get('conf', {})
+    return {
+        'conf': np.array([per_class.get(cls, default_conf) for cls in class_names], dtype=np.float32),
+        # Files written before nms_iou was recorded were tuned on the prediction store's default, 0.5
+        'nms_iou': config.get('nms_iou', 0.5) if config else DEFAULT_NMS_IOU,
+        'fusion': config.get('fusion', 'nms'),
+        'fusion_iou': config.get('fusion_iou', 0.5),
+        'agnostic': config.get('agnostic', True),
+        'source': path if config else None,
+    }
+
+
+# ------------------------------ Fingerprints ------------------------------
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    if os.path.isdir(path):
+        # Exported model folders (OpenVINO): hash every file, in a stable order
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                digest.update(f"{os.path.relpath(os.path.join(root, name), path)}:".encode())
+                digest.update(file_sha256(os.path.join(root, name), chunk_size).encode())
+        return digest.hexdigest()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def fingerprint_files(paths):
+    """Combined content hash of several files (e.g. the ensemble's weights)."""
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(file_sha256(path).encode())
+    return digest.hexdigest()
+
+
+def weights_fingerprint(model_paths, imgsz=IMGSZ):
+    """Identifies these exact weights + input size, without loading the models."""
+    paths = model_paths.values() if isinstance(model_paths, dict) else model_paths
+    return hashlib.sha256(f"{fingerprint_files(paths)}:{imgsz}".encode()).hexdigest()
+
+
+# ------------------------------ Backends ------------------------------
+def backend_path(weights, backend):
+    """``.../best.pt`` -> the file or folder of that model in ``backend``'s format."""
+    if backend not in BACKEND_SUFFIXES:
+        raise ValueError(f"Unknown backend {backend!r}, expected one of {list(BACKEND_SUFFIXES)}")
+    return os.path.splitext(weights)[0] + BACKEND_SUFFIXES[backend]
+
+
+def backend_model_paths(model_paths, backend='torch'):
+    """{class: exported model} for ``backend``; raises if a model has not been exported yet."""
+    paths = {cls: backend_path(path, backend) for cls, path in dict(model_paths).items()}
+    missing = [path for path in paths.values() if not os.path.exists(path)]
+    if missing:
+        raise FileNotFoundError(f"{missing[0]} not found, export it first: python export_models.py --formats {backend}")
+    return paths
+
+
+# ------------------------------ Image helpers ------------------------------
+def decode_image(data):
+    """Decode encoded image bytes (PNG/JPEG/...) into a BGR array, or None."""
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+
+def letterbox(image, imgsz=IMGSZ, stride=STRIDE, auto=False, color=(114, 114, 114)):
+    """Resize keeping aspect ratio and pad to ``imgsz`` (or to the stride if ``auto``).
+
+    Returns the padded image, the scale ratio and the (left, top) padding so that
+    boxes can be mapped back with :func:`scale_boxes`.
+    """
+    h, w = image.shape[:2]
+    r = min(imgsz / h, imgsz / w)
+    new_w, new_h = int(round(w * r)), int(round(h * r))
+    pad_w, pad_h = imgsz - new_w, imgsz - new_h
+    if auto:
+        pad_w, pad_h = pad_w % stride, pad_h % stride
+    if (w, h) != (new_w, new_h):
+        image = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    left, top = pad_w // 2, pad_h // 2
+    image = cv2.copyMakeBorder(image, top, pad_h - top, left, pad_w - left, cv2.BORDER_CONSTANT, value=color)
+    return image, r, (left, top)
+
+
+def scale_boxes(boxes, ratio, pad, orig_shape):
+    """Map xyxy boxes from letterboxed coordinates back to the original image."""
+    boxes = boxes.copy()
+    boxes[:, [0, 2]] -= pad[0]
+    boxes[:, [1, 3]] -= pad[1]
+    boxes /= ratio
+    boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, orig_shape[1])
+    boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, orig_shape[0])
+    return boxes
+
+
+def crop_to_frame(dets, crop, shape, margin=2):
+    """Map Detections found in ``image[y1:y2, x1:x2]`` back to the frame.
+
+    Boxes within ``margin`` pixels of a crop edge that is not also a frame edge
+    are dropped: the object continues outside the crop, so the box is partial.
+    """
+    if not len(dets):
+        return dets
+    x1, y1, x2, y2 = crop
+    h, w = shape
+    boxes = dets.boxes + np.array([x1, y1, x1, y1], dtype=np.float32)
+    cut = (((boxes[:, 0] <= x1 + margin) & (x1 > 0)) | ((boxes[:, 1] <= y1 + margin) & (y1 > 0))
+           | ((boxes[:, 2] >= x2 - margin) & (x2 < w)) | ((boxes[:, 3] >= y2 - margin) & (y2 < h)))
+    keep = ~cut
+    return Detections(boxes[keep], dets.scores[keep], dets.class_ids[keep])
+
+
+def box_iou(a, b):
+    """Pairwise IoU between (N, 4) and (M, 4) xyxy boxes, as an (N, M) array."""
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    iw = np.minimum(a[:, None, 2], b[None, :, 2]) - np.maximum(a[:, None, 0], b[None, :, 0])
+    ih = np.minimum(a[:, None, 3], b[None, :, 3]) - np.maximum(a[:, None, 1], b[None, :, 1])
+    inter = np.clip(iw, 0, None, out=iw) * np.clip(ih, 0, None, out=ih)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+def draw_detections(image, dets, class_names, color_map=COLOR_MAP):
+    """Draw boxes and labels onto ``image`` in place and return it."""
+    for box, conf, cid in zip(dets.boxes.tolist(), dets.scores.tolist(), dets.class_ids.tolist()):
+        cls = class_names[cid]
+        x1, y1, x2, y2 = map(int, box)
+        label = f"{cls} {conf:.2f}"
+        color = color_map.get(cls, (255, 255, 0))
+        cv2.rectangle(image, (x1, y1), (x2, y2), color, 2)
+        cv2.putText(image, label, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, color, 2)
+    return image
+
+
+# ------------------------------ Thread budget ------------------------------
+def available_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def split_cores(n_parts, cores=None):
+    """Split ``cores`` (default: all usable cores) into ``n_parts`` contiguous chunks."""
+    cores = list(cores) if cores is not None else available_cores()
+    size = max(1, len(cores) // n_parts)
+    return [cores[i * size:(i + 1) * size] or cores[-size:] for i in range(n_parts)]
+
+
+def apply_threads(num_threads):
+    """Set torch's intra-op thread count for the calling thread, if it drifted from ``num_threads``.
+
+    select_device() in a predictor's setup (the first call) sets it to
+    ultralytics' own default, in whichever thread runs it.
+    """
+    import torch
+    if num_threads and torch.get_num_threads() != num_threads:
+        torch.set_num_threads(num_threads)
+
+
+def _init_model_worker(num_threads, cores):
+    # Runs inside the model's dedicated worker thread. torch's OpenMP thread
+    # count and sched_setaffinity(0, ...) both apply to the calling thread only.
+    import torch
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    if cores and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+
+
+# ------------------------------ Engine ------------------------------
+class EnsembleEngine:
+    """Runs every one-class model on a single shared, preprocessed tensor.
+
+    With ``parallel=True`` each model gets its own worker thread so the three
+    forward passes overlap. ``threads_per_model`` sets torch's intra-op threads
+    in each worker, ``interop_threads`` the process-wide inter-op pool, and
+    ``cpu_affinity`` pins each worker to a set of cores: either a
+    ``{class_name: [cores]}`` dict or ``'auto'`` to split the usable cores
+    evenly. ``num_threads`` is the intra-op budget for the thread that calls
+    ``predict_batch`` when the models run sequentially. ultralytics resets
+    torch's thread count when a predictor is set up, so the budget is checked
+    and re-applied around every forward pass. Per-model wall times of the last
+    call are kept in ``last_timings``.
+
+    ``model_paths`` may point at exports instead of ``best.pt`` (see
+    ``backend_model_paths``); ultralytics then runs them with ONNX Runtime or
+    OpenVINO, on the CPU.
+    """
+
+    def __init__(self, model_paths=MODEL_PATHS, imgsz=IMGSZ, device=None, parallel=False,
+                 threads_per_model=None, interop_threads=None, cpu_affinity=None, num_threads=None):
+        import torch
+        from ultralytics import YOLO
+        self.class_names = list(model_paths)
+        self.model_paths = dict(model_paths)
+        self.imgsz = imgsz
+        # Exported models (ONNX Runtime / OpenVINO) take their input from host memory
+        self._exported = any(not str(path).endswith('.pt') for path in self.model_paths.values())
+        self._device = torch.device(device) if device is not None else None
+        self.models = {cls: YOLO(path, task='detect') for cls, path in self.model_paths.items()}
+        # Identifies these exact weights + input size, e.g. for result caches
+        self.fingerprint = weights_fingerprint(self.model_paths, imgsz)
+        self.last_timings = {}
+        self.num_threads = num_threads
+        self._threads = {}  # per-model budget of the parallel workers
+        # A YOLO predictor is not safe to call from two threads at once
+        self._locks = {cls: threading.Lock() for cls in self.class_names}
+        self._executors = {}
+        if parallel:
+            self._start_workers(threads_per_model, interop_threads, cpu_affinity)
+
+    @property
+    def device(self):
+        # Picked on first use, not in __init__: torch.cuda.is_available() sets up the CUDA
+        # driver, and a worker forked after that (backend/prefork.py) can no longer use CUDA
+        if self._device is None:
+            import torch
+            self._device = torch.device('cuda:0' if torch.cuda.is_available() and not self._exported else 'cpu')
+        return self._device
+
+    def _start_workers(self, threads_per_model, interop_threads, cpu_affinity):
+        import torch
+        if interop_threads:
+            try:
+                torch.set_num_interop_threads(interop_threads)
+            except RuntimeError:
+                # Can only be set once, before any inter-op work has started
+                print(f"⚠️  torch inter-op threads already fixed at {torch.get_num_interop_threads()}")
+        if cpu_affinity == 'auto':
+            cpu_affinity = dict(zip(self.class_names, split_cores(len(self.class_names))))
+        cpu_affinity = cpu_affinity or {}
+        for cls in self.class_names:
+            cores = cpu_affinity.get(cls)
+            num_threads = threads_per_model or (len(cores) if cores else max(1, torch.get_num_threads() // len(self.class_names)))
+            self._threads[cls] = num_threads
+            self._executors[cls] = ThreadPoolExecutor(
+                max_workers=1,
+                thread_name_prefix=f'ensemble-{cls}',
+                initializer=_init_model_worker,
+                initargs=(num_threads, cores),
+            )
+
+    def close(self):
+        for executor in self._executors.values():
+            executor.shutdown(wait=True)
+        self._executors = {}
+
+    def preprocess(self, images):
+        """Letterbox a list of BGR images into one normalized BCHW tensor.
+
+        A single image keeps its aspect ratio with minimal stride padding; a batch
+        is padded to the square ``imgsz`` so that every image has the same shape.
+        """
+        import torch
+        auto = len(images) == 1
+        batch, metas = [], []
+        for image in images:
+            padded, ratio, pad = letterbox(image, self.imgsz, auto=auto)
+            batch.append(padded)
+            metas.append((ratio, pad, image.shape[:2]))
+        # BGR HWC uint8 -> RGB CHW float in [0, 1]
+        array = np.ascontiguousarray(np.stack(batch)[..., ::-1].transpose(0, 3, 1, 2))
+        tensor = torch.from_numpy(array).to(self.device).float().div_(255.0)
+        return tensor, metas
+
+    def _run_model(self, model, tensor, conf, iou):
+        results = model(tensor, conf=conf, iou=iou, verbose=False)
+        return [r.boxes.data.cpu().numpy() if r.boxes is not None else np.zeros((0, 6), np.float32) for r in results]
+
+    def _timed_run(self, cls, tensor, conf, iou):
+        budget = self._threads.get(cls) if self._executors else self.num_threads
+        with self._locks[cls]:
+            apply_threads(budget)
+            start = time.perf_counter()
+            preds = self._run_model(self.models[cls], tensor, conf, iou)
+            elapsed = time.perf_counter() - start
+            apply_threads(budget)
+            return preds, elapsed
+
+    def _postprocess(self, per_model, metas):
+        out = []
+        for i, (ratio, pad, orig_shape) in enumerate(metas):
+            parts = []
+            for class_id, preds in enumerate(per_model):
+                data = preds[i]
+                if not len(data):
+                    continue
+                parts.append(Detections(
+                    scale_boxes(data[:, :4].astype(np.float32), ratio, pad, orig_shape),
+                    data[:, 4].astype(np.float32),
+                    np.full(len(data), class_id, dtype=np.int64),
+                ))
+            out.append(concat_detections(parts))
+        return out
+
+    def predict_batch(self, images, conf=0.25, iou=0.7):
+        """Detect on a list of BGR images; returns one Detections per image."""
+        if not images:
+            return []
+        tensor, metas = self.preprocess(images)
+        if self._executors:
+            futures = [self._executors[cls].submit(self._timed_run, cls, tensor, conf, iou) for cls in self.class_names]
+            runs = [f.result() for f in futures]
+        else:
+            runs = [self._timed_run(cls, tensor, conf, iou) for cls in self.class_names]
+        self.last_timings = {cls: seconds for cls, (_, seconds) in zip(self.class_names, runs)}
+        return self._postprocess([preds for preds, _ in runs], metas)
+
+    def predict(self, image, conf=0.25, iou=0.7):
+        return self.predict_batch([image], conf=conf, iou=iou)[0]
+
+
+# ------------------------------ Startup ------------------------------
+def warmup(engine, batch_sizes=(1,), imgsz=IMGSZ):
+    """Run ``engine`` on a synthetic frame, once per batch size.
+
+    The first forward pass pays for lazy kernel selection and memory pools
+    (CUDA or CPU). Doing it at startup keeps that cost off the first request.
+    """
+    image = np.random.default_rng(0).integers(0, 256, (imgsz, imgsz, 3), dtype=np.uint8)
+    for n in batch_sizes:
+        engine.predict_batch([image] * n)
+
+
+def share_weights(engine):
+    """Fuse conv+bn and move every PyTorch model's weights into shared memory.
+
+    Meant for a parent process that forks serving workers afterwards: the
+    workers map the same weight pages instead of each holding a copy. Fusing
+    here matters, since ultralytics otherwise fuses on the first prediction
+    and writes new tensors in every worker. Exported models (ONNX Runtime /
+    OpenVINO) are skipped. Returns the bytes now shared.
+    """
+    import torch
+    shared = 0
+    for model in engine.models.values():
+        module = model.model
+        if not isinstance(module, torch.nn.Module):
+            continue
+        module.fuse(verbose=False).eval()
+        module.share_memory()
+        shared += sum(t.numel() * t.element_size() for t in (*module.parameters(), *module.buffers()))
+    return shared
+
+
+def _import_frameworks():
+    import torch  # noqa: F401
+    import ultralytics  # noqa: F401
+
+
+class EngineLoader:
+    """Builds, warms up and hands out an engine from a background thread.
+
+    ``build`` is a zero-argument callable returning the engine. ``state`` goes
+    pending -> loading -> ready (or failed), and ``phases`` records the seconds
+    spent importing torch + ultralytics, loading the models and warming up.
+    With ``started_at`` (a ``time.time()`` stamp, e.g. the process start),
+    ``phases['total']`` is the time from then until the engine was ready.
+    ``threads`` becomes the engine's ``num_threads`` before the warm-up, so
+    every thread that later runs inference keeps that torch thread count.
+    """
+
+    def __init__(self, build, warmup_batch_sizes=(1,), started_at=None, threads=None):
+        self.build = build
+        self.warmup_batch_sizes = warmup_batch_sizes
+        self.started_at = started_at
+        self.threads = threads
+        self.engine = None
+        self._prebuilt = None
+        self.shared_bytes = 0
+        self.state = 'pending'
+        self.error = None
+        self.phases = {}
+        self._ready = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._load, name='engine-loader', daemon=True)
+            self._thread.start()
+        return self
+
+    def preload(self, shared=False):
+        """Build the engine now, in the calling thread, without warming it up.
+
+        For a parent process that forks workers afterwards: no inference may run
+        before the fork, and torch runs single-threaded here so its OpenMP pool
+        is not started either. ``build`` must not touch CUDA (the engines pick
+        their device on first use). Each worker's ``start()`` then only warms up.
+        ``shared=True`` also moves the weights into shared memory
+        (``share_weights``); ``shared_bytes`` says how much.
+        """
+        if self._prebuilt is None:
+            self._timed('import_torch', _import_frameworks)
+            import torch
+            threads = torch.get_num_threads()
+            torch.set_num_threads(1)
+            try:
+                engine = self._timed('load_models', self.build)
+                if shared:
+                    self.shared_bytes = self._timed('share_weights', lambda: share_weights(engine))
+            finally:
+                torch.set_num_threads(threads)
+            self._prebuilt = engine
+        return self._prebuilt
+
+    def _timed(self, phase, fn):
+        start = time.perf_counter()
+        result = fn()
+        self.phases[phase] = time.perf_counter() - start
+        return result
+
+    def _load(self):
+        self.state = 'loading'
+        try:
+            engine = self._prebuilt
+            if engine is None:
+                self._timed('import_torch', _import_frameworks)
+                engine = self._timed('load_models', self.build)
+            if self.threads:
+                engine.num_threads = self.threads
+            if self.warmup_batch_sizes:
+                self._timed('warmup', lambda: warmup(engine, self.warmup_batch_sizes, engine.imgsz))
+            apply_threads(self.threads)  # the warm-up's select_device() reset it in this thread
+            self.engine = engine
+            self.state = 'ready'
+            if self.started_at is not None:
+                self.phases['total'] = time.time() - self.started_at
+            print("⏱️ Models ready: " + " | ".join(f"{phase} {seconds:.2f}s" for phase, seconds in self.phases.items()))
+        except Exception as exc:
+            self.error = exc
+            self.state = 'failed'
+            print(f"❌ Model loading failed: {exc!r}")
+        finally:
+            self._ready.set()
+
+    @property
+    def ready(self):
+        return self.state == 'ready'
+
+    def wait(self, timeout=None):
+        """The engine once loaded (None on timeout); re-raises a loading error."""
+        self.start()
+        self._ready.wait(timeout)
+        if self.error is not None:
+            raise self.error
+        return self.engine
+
+    def status(self):
+        return {
+            'state': self.state,
+            'error': repr(self.error) if self.error is not None else None,
+            'phases': {phase: round(seconds, 3) for phase, seconds in self.phases.items()},
+        }
@@ -1,10 +1,13 @@
+import argparse
 import os
 import glob
-import torch
-from ultralytics import YOLO
-from ultralytics.utils.ops import non_max_suppression
+import time
 from tqdm import tqdm
 import numpy as np
+from ensemble import BACKEND_SUFFIXES, CLASS_NAMES, backend_model_paths
+from fusion import FUSION_METHODS, fuse_detections
+from prediction_store import open_or_build
+from evaluate_map import evaluate, print_report
 
 # Paths to models
 MODEL_PATHS = [
@@ -22,86 +25,49 @@ TEST_LABEL_DIR = 'data/test/labels'
 
 # Output prediction dir (YOLO format)
 PRED_LABEL_DIR = 'ensemble_pred_labels'
-os.makedirs(PRED_LABEL_DIR, exist_ok=True)
 
-# Load models
-models = [YOLO(path) for path in MODEL_PATHS]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ensemble the one-class models on the test set and compute mAP.")
+    parser.add_argument('--fusion', default='nms', choices=['none', *FUSION_METHODS])
+    parser.add_argument('--fusion-iou', type=float, default=0.5)
+    parser.add_argument('--class-aware', action='store_true', help="only fuse boxes of the same class")
+    parser.add_argument('--rebuild-store', action='store_true', help="re-run the models even if predictions are stored")
+    parser.add_argument('--backend', default='torch', choices=list(BACKEND_SUFFIXES),
+                        help="score an export from export_models.py instead of the PyTorch weights")
+    args = parser.parse_args()
 
-# Get test images
-img_paths = sorted(glob.glob(os.path.join(TEST_IMG_DIR, '*.png')))
+    os.makedirs(PRED_LABEL_DIR, exist_ok=True)
 
-# Inference and ensemble
-for img_path in tqdm(img_paths, desc='Ensembling'):
-    all_preds = []
-    for model, class_id in zip(models, CLASS_IDS):
-        results = model(img_path, conf=0.001, iou=0.5, verbose=False)
-        boxes = results[0].boxes
-        if boxes is not None and len(boxes) > 0:
-            for box in boxes:
-                xywh = box.xywh[0].cpu().numpy()  # center x, center y, w, h (normalized)
-                conf = float(box.conf[0].cpu().numpy())
-                # Assign correct class id for this model
-                all_preds.append([
-                    class_id, xywh[0], xywh[1], xywh[2], xywh[3], conf
-                ])
-    # Convert to numpy array for NMS
-    if len(all_preds) == 0:
-        pred_lines = []
-    else:
-        all_preds = np.array(all_preds)
-        if all_preds.ndim == 1:
-            all_preds = all_preds.reshape(1, -1)
-        nms_input = torch.tensor(np.stack([
-            all_preds[:,1], all_preds[:,2], all_preds[:,3], all_preds[:,4], all_preds[:,5], all_preds[:,0]
-        ], axis=1), dtype=torch.float32)
-        print(f"DEBUG: nms_input.shape = {nms_input.shape}")  # Debug print
-        if nms_input.ndim != 2:
-            print(f"SKIPPING: nms_input is not 2D, shape={nms_input.shape}")
-            pred_lines = []
-        elif nms_input.shape[0] == 1:
-            # Only one prediction, skip NMS
-            x, y, w, h, conf, cls = nms_input[0].tolist()
-            pred_lines = [f"{int(cls)} {x:.6f} {y:.6f} {w:.6f} {h:.6f} {conf:.6f}\n"]
-        elif nms_input.shape[0] > 1:
-            # Pass as a batch of one to NMS
-            nms_out = non_max_suppression(nms_input[None, ...], conf_thres=0.001, iou_thres=0.5, classes=None, agnostic=True)[0]
-            pred_lines = []
-            if nms_out is not None and len(nms_out) > 0:
-                for det in nms_out:
-                    x, y, w, h, conf, cls = det.tolist()
-                    pred_lines.append(f"{int(cls)} {x:.6f} {y:.6f} {w:.6f} {h:.6f} {conf:.6f}\n")
-            else:
-                pred_lines = []
-        else:
-            pred_lines = []
-    # Write to file
-    base = os.path.basename(img_path)
-    pred_file = os.path.join(PRED_LABEL_DIR, base.replace('.png', '.txt'))
-    with open(pred_file, 'w') as f:
-        f.writelines(pred_lines)
+    # Get test images
+    img_paths = sorted(glob.glob(os.path.join(TEST_IMG_DIR, '*.png')))
 
-print(f"\n✅ Ensemble predictions saved to {PRED_LABEL_DIR}")
+    # Raw predictions: the models only run when nothing is stored for these weights + images
+    model_paths = backend_model_paths(dict(zip(CLASS_NAMES, MODEL_PATHS)), args.backend)
+    store = open_or_build(img_paths, model_paths, conf=0.001, iou=0.5,
+                          rebuild=args.rebuild_store)
 
-# --- Evaluation ---
-# Use ultralytics' built-in val function for mAP@0.5
-# We'll create a temporary dataset YAML for evaluation
-EVAL_YAML = 'ensemble_eval.yaml'
-with open(EVAL_YAML, 'w') as f:
-    f.write(f"""
-path: .
-train: {TEST_IMG_DIR}
-val: {TEST_IMG_DIR}
-test: {TEST_IMG_DIR}
-nc: 3
-names: ['FireExtinguisher', 'ToolBox', 'OxygenTank']
-""")
+    # Fusion and writing
+    start = time.perf_counter()
+    class_ids = np.asarray(CLASS_IDS)
+    for image_id, (h, w), dets in tqdm(store, total=len(store), desc='Fusing'):
+        # Merge overlapping boxes across the models (class-agnostic NMS by default)
+        dets = fuse_detections(dets, args.fusion, iou_thres=args.fusion_iou, agnostic=not args.class_aware)
+        # xyxy pixels -> center x, center y, w, h (normalized), class id = model index
+        xyxy = dets.boxes / np.array([w, h, w, h], dtype=np.float32)
+        xywh = np.concatenate([(xyxy[:, :2] + xyxy[:, 2:]) / 2, xyxy[:, 2:] - xyxy[:, :2]], axis=1)
+        pred_lines = [
+            f"{cls} {x:.6f} {y:.6f} {bw:.6f} {bh:.6f} {conf:.6f}\n"
+            for cls, (x, y, bw, bh), conf in zip(class_ids[dets.class_ids].tolist(), xywh.tolist(), dets.scores.tolist())
+        ]
+        # Write to file
+        with open(os.path.join(PRED_LABEL_DIR, image_id + '.txt'), 'w') as f:
+            f.writelines(pred_lines)
 
-# Evaluate using YOLO's val method
-from ultralytics import YOLO
-model = YOLO(MODEL_PATHS[0])  # Use any model, just for API access
-metrics = model.val(
-    data=EVAL_YAML,
-    split='val',
-    pred=PRED_LABEL_DIR
-)
-print("\n🎯 mAP@0.5 evaluation complete. See printed results above.") 
\ No newline at end of file
+    print(f"\n✅ Ensemble predictions ({args.fusion}) saved to {PRED_LABEL_DIR} in {time.perf_counter() - start:.2f}s")
+
+    # --- Evaluation ---
+    # Score the written prediction files directly (no second forward pass)
+    start = time.perf_counter()
+    metrics = evaluate(PRED_LABEL_DIR, TEST_LABEL_DIR, CLASS_NAMES)
+    print_report(metrics)
+    print(f"⏱️ Evaluated in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,228 @@
+"""Score YOLO-format prediction files against the test labels, without running any model.
+
+Ground truth is read from ``data/test/labels`` (``cls cx cy w h``, normalized)
+and predictions from any directory of the same layout with an extra confidence
+column (``cls cx cy w h conf``), e.g. the ``ensemble_pred_labels/`` written by
+ensemble_evaluate.py. Files without a confidence column count as conf 1.0.
+
+Ground truth is loaded through the label index (label_index.py), so only
+changed label files are re-read. A prediction file without a label file is
+scored against an empty ground truth, as YOLO treats a missing label file.
+Images are split into chunks that a process pool matches independently.
+Each worker reads its prediction files and computes per-image IoU matrices
+in NumPy. It returns, for each prediction, whether it is a true positive at
+every IoU threshold from 0.50 to 0.95. The main process then builds per-class
+precision/recall curves, mAP@0.5 and mAP@0.5:0.95. Matching is COCO-style:
+predictions in descending confidence order each claim the best unclaimed
+ground-truth box. ultralytics' validator instead matches pairs in descending
+IoU order. AP uses 101-point interpolation. The numbers are comparable with
+``model.val()`` but not guaranteed identical on crowded images.
+
+Usage:
+    python evaluate_map.py --pred ensemble_pred_labels
+    python evaluate_map.py --pred ensemble_pred_labels --curves pr_curves.csv
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from ensemble import box_iou
+from label_index import open_index
+
+CLASS_NAMES = ['FireExtinguisher', 'ToolBox', 'OxygenTank']
+GT_LABEL_DIR = 'data/test/labels'
+IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+CURVE_POINTS = 1000
+
+_trapezoid = getattr(np, 'trapezoid', None) or np.trapz
+
+
+# ---------------- Reading labels ----------------
+def read_yolo_file(path):
+    """(N, 6) float32 rows [cls, cx, cy, w, h, conf]; conf is 1.0 when the file has none."""
+    try:
+        with open(path) as f:
+            rows = [line.split()[:6] for line in f if line.strip()]
+    except FileNotFoundError:
+        rows = []
+    if not rows:
+        return np.zeros((0, 6), dtype=np.float32)
+    return np.array([row + ['1'] * (6 - len(row)) for row in rows], dtype=np.float32)
+
+
+def xywh_to_xyxy(xywh):
+    return np.concatenate([xywh[:, :2] - xywh[:, 2:] / 2, xywh[:, :2] + xywh[:, 2:] / 2], axis=1)
+
+
+# ---------------- Matching (runs in the worker processes) ----------------
+def match_predictions(pred_cls, gt_cls, iou):
+    """(n_pred, n_thresholds) bool: prediction matched a same-class ground-truth box at each threshold.
+
+    ``iou`` is (n_gt, n_pred) with predictions in descending confidence order.
+    As in COCO, each prediction in turn claims the best still-unclaimed
+    ground-truth box, independently at every threshold.
+    """
+    correct = np.zeros((len(pred_cls), len(IOU_THRESHOLDS)), dtype=bool)
+    iou = iou * (gt_cls[:, None] == pred_cls[None, :])
+    claimed = np.zeros((len(gt_cls), len(IOU_THRESHOLDS)), dtype=bool)
+    thresholds = np.arange(len(IOU_THRESHOLDS))
+    for j in np.flatnonzero((iou >= IOU_THRESHOLDS[0]).any(0)):
+        available = np.where(claimed, 0, iou[:, j, None])
+        k = available.argmax(0)
+        correct[j] = available[k, thresholds] >= IOU_THRESHOLDS
+        claimed[k, thresholds] |= correct[j]
+    return correct
+
+
+def match_chunk(args):
+    """Match the predictions of a chunk of images. Returns (correct, conf, pred_cls, gt_cls)."""
+    stems, gts, pred_dir = args
+    correct, conf, pred_cls, gt_cls = [], [], [], []
+    for stem, gt in zip(stems, gts):
+        pred = read_yolo_file(os.path.join(pred_dir, stem + '.txt'))
+        gt_cls.append(gt[:, 0])
+        if not len(pred):
+            continue
+        pred = pred[np.argsort(-pred[:, 5], kind='stable')]
+        if len(gt):
+            iou = box_iou(xywh_to_xyxy(gt[:, 1:5]), xywh_to_xyxy(pred[:, 1:5]))
+            correct.append(match_predictions(pred[:, 0], gt[:, 0], iou))
+        else:
+            correct.append(np.zeros((len(pred), len(IOU_THRESHOLDS)), dtype=bool))
+        conf.append(pred[:, 5])
+        pred_cls.append(pred[:, 0])
+    if not correct:
+        correct = [np.zeros((0, len(IOU_THRESHOLDS)), dtype=bool)]
+    return (np.concatenate(correct), np.concatenate(conf or [np.zeros(0, np.float32)]),
+            np.concatenate(pred_cls or [np.zeros(0, np.float32)]), np.concatenate(gt_cls or [np.zeros(0, np.float32)]))
+
+
+# ---------------- Metrics ----------------
+def compute_ap(recall, precision):
+    """Area under the precision envelope, with 101-point interpolation (COCO)."""
+    # Precision drops to 0 past the highest recall reached
+    mrec = np.concatenate(([0.0], recall, [recall[-1] if len(recall) else 1.0], [1.0]))
+    mpre = np.concatenate(([1.0], precision, [0.0], [0.0]))
+    mpre = np.flip(np.maximum.accumulate(np.flip(mpre)))
+    x = np.linspace(0, 1, 101)
+    return _trapezoid(np.interp(x, mrec, mpre), x)
+
+
+def smooth(y, fraction=0.1):
+    """Box filter over ``fraction`` of the curve, with edge padding."""
+    nf = round(len(y) * fraction * 2) // 2 + 1
+    pad = np.ones(nf // 2)
+    return np.convolve(np.concatenate((pad * y[0], y, pad * y[-1])), np.ones(nf) / nf, mode='valid')
+
+
+def ap_per_class(correct, conf, pred_cls, gt_cls, n_classes):
+    """Per-class AP at every IoU threshold plus precision/recall curves over confidence."""
+    order = np.argsort(-conf, kind='stable')
+    correct, conf, pred_cls = correct[order], conf[order], pred_cls[order]
+    px = np.linspace(0, 1, CURVE_POINTS)
+    ap = np.zeros((n_classes, len(IOU_THRESHOLDS)))
+    p_curve = np.zeros((n_classes, CURVE_POINTS))
+    r_curve = np.zeros((n_classes, CURVE_POINTS))
+    n_gt = np.bincount(gt_cls.astype(np.int64), minlength=n_classes)[:n_classes]
+    for c in range(n_classes):
+        i = pred_cls == c
+        if not i.any() or not n_gt[c]:
+            continue
+        tpc = np.cumsum(correct[i], axis=0)
+        fpc = np.cumsum(~correct[i], axis=0)
+        recall = tpc / (n_gt[c] + 1e-16)
+        precision = tpc / (tpc + fpc)
+        # Curves at IoU 0.5, indexed by confidence threshold (conf is descending, so negate for interp)
+        r_curve[c] = np.interp(-px, -conf[i], recall[:, 0], left=0)
+        p_curve[c] = np.interp(-px, -conf[i], precision[:, 0], left=1)
+        for t in range(len(IOU_THRESHOLDS)):
+            ap[c, t] = compute_ap(recall[:, t], precision[:, t])
+    f1 = 2 * p_curve * r_curve / (p_curve + r_curve + 1e-16)
+    best = int(smooth(f1.mean(0)).argmax())  # confidence with the best mean F1 across classes
+    return {
+        'ap': ap,
+        'precision': p_curve[:, best],
+        'recall': r_curve[:, best],
+        'best_conf': float(px[best]),
+        'n_gt': n_gt,
+        'conf_grid': px,
+        'p_curve': p_curve,
+        'r_curve': r_curve,
+    }
+
+
+def evaluate(pred_dir, gt_dir=GT_LABEL_DIR, class_names=CLASS_NAMES, workers=None, chunk_size=64):
+    """Score ``pred_dir`` against ``gt_dir``. Returns a dict of per-class and overall metrics."""
+    index = open_index(gt_dir)
+    labeled = set(index.image_ids)
+    # Predictions for images without a label file are all false positives, not skipped
+    unlabeled = sorted(entry.name[:-4] for entry in os.scandir(pred_dir)
+                       if entry.name.endswith('.txt') and entry.name[:-4] not in labeled)
+    if unlabeled:
+        print(f"⚠️  {len(unlabeled)} prediction files have no label file in {gt_dir}; scored as images without objects")
+    stems = list(index.image_ids) + unlabeled
+    chunks = [
+        (stems[i:i + chunk_size], [index.labels(stem) for stem in stems[i:i + chunk_size]], pred_dir)
+        for i in range(0, len(stems), chunk_size)
+    ]
+    workers = min(workers or os.cpu_count() or 1, len(chunks) or 1)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(match_chunk, chunks))
+    else:
+        parts = [match_chunk(chunk) for chunk in chunks]
+    if parts:
+        correct, conf, pred_cls, gt_cls = (np.concatenate(p) for p in zip(*parts))
+    else:
+        correct, conf, pred_cls, gt_cls = np.zeros((0, len(IOU_THRESHOLDS)), bool), np.zeros(0), np.zeros(0), np.zeros(0)
+    metrics = ap_per_class(correct, conf, pred_cls, gt_cls, len(class_names))
+    present = metrics['n_gt'] > 0
+    ap = metrics['ap']
+    metrics.update({
+        'images': len(stems),
+        'unlabeled_images': len(unlabeled),
+        'predictions': len(conf),
+        'class_names': list(class_names),
+        'map50': float(ap[present, 0].mean()) if present.any() else 0.0,
+        'map50_95': float(ap[present].mean()) if present.any() else 0.0,
+    })
+    return metrics
+
+
+def print_report(metrics):
+    print(f"{'Class':<18} {'Labels':>7} {'P':>7} {'R':>7} {'mAP50':>7} {'mAP50-95':>9}")
+    for c, name in enumerate(metrics['class_names']):
+        print(f"{name:<18} {metrics['n_gt'][c]:>7} {metrics['precision'][c]:>7.3f} {metrics['recall'][c]:>7.3f} "
+              f"{metrics['ap'][c, 0]:>7.3f} {metrics['ap'][c].mean():>9.3f}")
+    print(f"\n🎯 mAP@0.5 = {metrics['map50']:.4f} | mAP@0.5:0.95 = {metrics['map50_95']:.4f} "
+          f"({metrics['images']} images, {metrics['predictions']} predictions, "
+          f"P/R at conf {metrics['best_conf']:.3f})")
+
+
+def save_curves(metrics, path):
+    """CSV of per-class precision and recall (IoU 0.5) at each confidence threshold."""
+    columns = ['conf'] + [f"{kind}_{name}" for name in metrics['class_names'] for kind in ('precision', 'recall')]
+    rows = [metrics['conf_grid']]
+    for c in range(len(metrics['class_names'])):
+        rows += [metrics['p_curve'][c], metrics['r_curve'][c]]
+    np.savetxt(path, np.column_stack(rows), delimiter=',', header=','.join(columns), comments='', fmt='%.6f')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute mAP of YOLO-format prediction files.")
+    parser.add_argument('--pred', required=True, help="directory of prediction .txt files (cls cx cy w h conf)")
+    parser.add_argument('--labels', default=GT_LABEL_DIR, help="directory of ground-truth .txt files")
+    parser.add_argument('--workers', type=int, default=None, help="processes (default: all cores)")
+    parser.add_argument('--curves', help="write per-class precision/recall curves to this CSV")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    metrics = evaluate(args.pred, args.labels, workers=args.workers)
+    print_report(metrics)
+    if args.curves:
+        save_curves(metrics, args.curves)
+        print(f"📈 Precision/recall curves saved to {args.curves}")
+    print(f"⏱️ Evaluated in {time.perf_counter() - start:.2f}s")
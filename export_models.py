@@ -0,0 +1,176 @@
+"""Export the one-class models and multiclass5 for CPU serving, and check their accuracy.
+
+Formats (see ensemble.BACKEND_SUFFIXES for where each one is written):
+
+    onnx            FP32 ONNX, dynamic batch and image size, for ONNX Runtime
+    onnx-int8       static INT8 ONNX (QDQ), calibrated on the model's val images
+    openvino        FP32 OpenVINO IR
+    openvino-int8   static INT8 OpenVINO IR (NNCF), calibrated the same way
+
+Calibration uses the ``val`` split of each model's dataset YAML: the
+``data/separated_dataset/<Class>/<Class>.yaml`` files for the one-class models
+(their val images are the data/val images of that class) and
+``yolo_params.yaml`` for multiclass5. The detection head's box decoding stays
+in float, since one INT8 scale cannot cover box pixels and class scores.
+
+``--check`` validates every exported model next to its PyTorch baseline on the
+test split (val if the YAML has none). Each one runs in its own process, so the
+resident memory of each backend is measured on its own. Models that lose
+more than ``--max-drop`` mAP@0.5:0.95 are flagged and the script exits with 1.
+
+Serving: set ``ENSEMBLE_BACKEND=onnx-int8`` (or any format above) for the
+backend and the Streamlit app; ``ensemble_evaluate.py --backend`` scores it.
+
+Usage:
+    python export_models.py                                  # onnx + onnx-int8 for every model
+    python export_models.py --formats openvino openvino-int8 --models FireExtinguisher
+    python export_models.py --check
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import psutil
+from ultralytics import YOLO
+
+from ensemble import BACKEND_SUFFIXES, CLASS_NAMES, IMGSZ, MODEL_PATHS, ROOT_DIR, backend_path
+
+SEPARATED_DIR = os.path.join(ROOT_DIR, 'data', 'separated_dataset')
+# name -> (PyTorch weights, dataset YAML used for calibration and the accuracy check)
+EXPORT_MODELS = {
+    **{cls: (MODEL_PATHS[cls], os.path.join(SEPARATED_DIR, cls, f"{cls}.yaml")) for cls in CLASS_NAMES},
+    'multiclass5': (os.path.join(ROOT_DIR, 'runs', 'detect', 'multiclass5', 'weights', 'best.pt'),
+                    os.path.join(ROOT_DIR, 'yolo_params.yaml')),
+}
+EXPORT_FORMATS = [b for b in BACKEND_SUFFIXES if b != 'torch']
+CALIBRATION_BATCH = 8
+CHECK_PATH = os.path.join(ROOT_DIR, 'runs', 'detect', 'export_check.json')
+
+
+def export_model(weights, data_yaml, backend, imgsz=IMGSZ, fraction=1.0):
+    """Export ``weights`` to ``backend``'s format. Returns the exported path."""
+    fmt, _, precision = backend.partition('-')
+    kwargs = dict(format=fmt, imgsz=imgsz, dynamic=True, device='cpu')
+    if fmt == 'onnx':
+        kwargs['simplify'] = True
+    if precision == 'int8':
+        kwargs.update(quantize=8, data=data_yaml, split='val', fraction=fraction, batch=CALIBRATION_BATCH)
+    exported = YOLO(weights).export(**kwargs)
+    expected = backend_path(weights, backend)
+    if os.path.normpath(str(exported)) != os.path.normpath(expected):
+        raise RuntimeError(f"ultralytics wrote {exported}, expected {expected}")
+    return expected
+
+
+def ordered_formats(formats):
+    # The INT8 ONNX export quantizes best.onnx and then deletes it, so it has to run before the FP32 export
+    return sorted(formats, key=lambda b: (b.split('-')[0], not b.endswith('int8')))
+
+
+def export_all(names, formats, imgsz=IMGSZ, fraction=1.0, force=False):
+    exported = {}
+    for name in names:
+        weights, data_yaml = EXPORT_MODELS[name]
+        if not os.path.exists(weights):
+            print(f"❌ {weights} not found, skipping {name}.")
+            continue
+        for backend in ordered_formats(formats):
+            path = backend_path(weights, backend)
+            if not force and os.path.exists(path) and os.path.getmtime(path) > os.path.getmtime(weights):
+                print(f"✔️  {name} {backend}: up to date ({path})")
+            else:
+                start = time.perf_counter()
+                export_model(weights, data_yaml, backend, imgsz, fraction)
+                print(f"📦 {name} {backend}: {path} ({time.perf_counter() - start:.0f}s)")
+            exported[(name, backend)] = path
+    return exported
+
+
+# ---------------- Accuracy check ----------------
+def check_split(data_yaml):
+    import yaml
+    with open(data_yaml) as f:
+        data = yaml.safe_load(f)
+    return 'test' if data.get('test') else 'val'
+
+
+def validate(path, data_yaml, imgsz=IMGSZ):
+    """mAP, CPU latency and resident memory of one model; runs in a fresh process."""
+    model = YOLO(path, task='detect')
+    metrics = model.val(data=data_yaml, split=check_split(data_yaml), imgsz=imgsz, batch=1, device='cpu',
+                        plots=False, verbose=False)
+    # Resident set after validation: the loaded model + runtime, as a serving process would hold it.
+    # (ru_maxrss is no use here: Linux carries it over from the parent through fork + exec.)
+    return {
+        'map50': float(metrics.box.map50),
+        'map50_95': float(metrics.box.map),
+        'inference_ms': float(metrics.speed['inference']),
+        'rss_mb': psutil.Process().memory_info().rss / 2 ** 20,
+    }
+
+
+def check_accuracy(names, formats, imgsz=IMGSZ, max_drop=0.01):
+    """Validate torch + every exported format of each model. Returns (results, failures)."""
+    results, failures = {}, []
+    ctx = mp.get_context('spawn')
+    for name in names:
+        weights, data_yaml = EXPORT_MODELS[name]
+        if not os.path.exists(weights):
+            continue
+        results[name] = {}
+        for backend in ['torch', *formats]:
+            path = backend_path(weights, backend)
+            if not os.path.exists(path):
+                print(f"⚠️  {name} {backend}: not exported, skipping")
+                continue
+            # One process per model: the RSS is the backend's own, not the sum of everything loaded so far
+            with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+                results[name][backend] = pool.submit(validate, path, data_yaml, imgsz).result()
+        base = results[name].get('torch')
+        for backend, r in results[name].items():
+            if base is None or backend == 'torch':
+                continue
+            r['map50_95_drop'] = base['map50_95'] - r['map50_95']
+            r['speedup'] = base['inference_ms'] / max(r['inference_ms'], 1e-9)
+            if r['map50_95_drop'] > max_drop:
+                failures.append(f"{name} {backend}")
+    return results, failures
+
+
+def print_check(results, max_drop):
+    print(f"\n{'Model':<18} {'backend':<14} {'mAP50':>7} {'mAP50-95':>9} {'drop':>7} {'ms/img':>8} {'speedup':>8} {'RSS MB':>8}")
+    for name, backends in results.items():
+        for backend, r in backends.items():
+            drop = f"{r['map50_95_drop']:+.4f}" if 'map50_95_drop' in r else '-'
+            speedup = f"{r['speedup']:.2f}x" if 'speedup' in r else '-'
+            flag = '  ❌' if r.get('map50_95_drop', 0.0) > max_drop else ''
+            print(f"{name:<18} {backend:<14} {r['map50']:>7.4f} {r['map50_95']:>9.4f} {drop:>7} "
+                  f"{r['inference_ms']:>8.1f} {speedup:>8} {r['rss_mb']:>8.0f}{flag}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export models for ONNX Runtime / OpenVINO and check their accuracy.")
+    parser.add_argument('--models', nargs='+', default=list(EXPORT_MODELS), choices=list(EXPORT_MODELS))
+    parser.add_argument('--formats', nargs='+', default=['onnx', 'onnx-int8'], choices=EXPORT_FORMATS)
+    parser.add_argument('--imgsz', type=int, default=IMGSZ)
+    parser.add_argument('--fraction', type=float, default=1.0, help="fraction of the val images used for calibration")
+    parser.add_argument('--force', action='store_true', help="re-export even if the export is newer than the weights")
+    parser.add_argument('--check', action='store_true', help="compare every export's mAP with the PyTorch model")
+    parser.add_argument('--max-drop', type=float, default=0.01, help="allowed mAP@0.5:0.95 drop in --check")
+    args = parser.parse_args()
+
+    export_all(args.models, args.formats, args.imgsz, args.fraction, args.force)
+    if args.check:
+        results, failures = check_accuracy(args.models, args.formats, args.imgsz, args.max_drop)
+        print_check(results, args.max_drop)
+        os.makedirs(os.path.dirname(CHECK_PATH), exist_ok=True)
+        with open(CHECK_PATH, 'w') as f:
+            json.dump({'max_drop': args.max_drop, 'results': results}, f, indent=2)
+        print(f"🧾 Saved to {CHECK_PATH}")
+        if failures:
+            print(f"\n❌ mAP@0.5:0.95 dropped by more than {args.max_drop} for: {', '.join(failures)}")
+            raise SystemExit(1)
+    print("\n✅ Done. Serve an export with ENSEMBLE_BACKEND=<format> (backend and Streamlit app).")
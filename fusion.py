@@ -0,0 +1,169 @@
+"""Box fusion for combining the one-class models' predictions.
+
+All functions take the concatenated predictions of every model as an (N, 6)
+array of ``[x1, y1, x2, y2, score, class_id]`` rows and return a new (M, 6)
+array sorted by descending score. Each step computes, in one NumPy call, the
+IoU of the current best box against every remaining candidate. The Python loop
+only runs once per kept box or cluster, never once per candidate pair.
+
+- ``nms``: greedy non-maximum suppression
+- ``soft_nms``: Soft-NMS (linear or Gaussian score decay)
+- ``weighted_boxes_fusion``: Weighted Boxes Fusion (score-weighted box averaging)
+
+Every method is class-aware by default; ``agnostic=True`` lets boxes of
+different classes suppress or fuse with each other.
+"""
+import numpy as np
+
+from ensemble import Detections
+
+
+class _BoxSet:
+    """Coordinates and areas of the candidate boxes, for one-vs-many IoU.
+
+    Unless ``agnostic``, boxes are shifted per class so that boxes of different
+    classes never overlap.
+    """
+
+    def __init__(self, preds, agnostic):
+        boxes = preds[:, :4].astype(np.float32)
+        if not agnostic and len(boxes):
+            boxes = boxes + preds[:, 5:6].astype(np.float32) * (boxes.max() + 1.0)
+        self.x1, self.y1, self.x2, self.y2 = boxes.T.copy()
+        self.area = (self.x2 - self.x1) * (self.y2 - self.y1)
+
+    def iou(self, i, idx):
+        """IoU of box ``i`` with every box in the index array ``idx``."""
+        w = np.minimum(self.x2[i], self.x2[idx]) - np.maximum(self.x1[i], self.x1[idx])
+        h = np.minimum(self.y2[i], self.y2[idx]) - np.maximum(self.y1[i], self.y1[idx])
+        inter = np.clip(w, 0, None) * np.clip(h, 0, None)
+        return inter / (self.area[i] + self.area[idx] - inter + 1e-9)
+
+
+def _sorted(preds):
+    order = np.argsort(-preds[:, 4], kind='stable')
+    return preds[order]
+
+
+def nms(preds, iou_thres=0.5, agnostic=False):
+    preds = _sorted(np.asarray(preds, dtype=np.float32).reshape(-1, 6))
+    if len(preds) < 2:
+        return preds
+    box_set = _BoxSet(preds, agnostic)
+    remaining = np.arange(len(preds))
+    keep = []
+    while remaining.size:
+        best = remaining[0]  # preds are sorted, so this is the best remaining box
+        keep.append(best)
+        remaining = remaining[1:]
+        remaining = remaining[box_set.iou(best, remaining) <= iou_thres]
+    return preds[keep]
+
+
+def soft_nms(preds, iou_thres=0.5, sigma=0.5, method='gaussian', score_thres=0.001, agnostic=False):
+    """Soft-NMS: decay the scores of overlapping boxes instead of dropping them.
+
+    ``method='linear'`` multiplies scores by ``1 - IoU`` above ``iou_thres``;
+    ``'gaussian'`` by ``exp(-IoU^2 / sigma)``. Boxes whose score decays below
+    ``score_thres`` are removed.
+    """
+    preds = _sorted(np.asarray(preds, dtype=np.float32).reshape(-1, 6))
+    if len(preds) < 2:
+        return preds
+    box_set = _BoxSet(preds, agnostic)
+    scores = preds[:, 4].copy()
+    remaining = np.arange(len(preds))
+    keep = []
+    while remaining.size:
+        top = np.argmax(scores[remaining])
+        best = remaining[top]
+        keep.append(best)
+        remaining = np.delete(remaining, top)
+        if not remaining.size:
+            break
+        iou = box_set.iou(best, remaining)
+        if method == 'linear':
+            decay = np.where(iou > iou_thres, 1.0 - iou, 1.0)
+        else:
+            decay = np.exp(-(iou ** 2) / sigma)
+        scores[remaining] *= decay
+        remaining = remaining[scores[remaining] > score_thres]
+    out = preds[keep].copy()
+    out[:, 4] = scores[keep]
+    return _sorted(out)
+
+
+def weighted_boxes_fusion(preds, iou_thres=0.55, n_models=1, conf_type='avg', agnostic=False):
+    """Weighted Boxes Fusion.
+
+    Boxes are clustered around the highest-scoring remaining box (IoU above
+    ``iou_thres``). Each cluster becomes one box whose coordinates are the
+    score-weighted mean of its members. Its score is the mean (``'avg'``) or
+    max (``'max'``) member score, scaled by ``min(members, n_models) / n_models``
+    so that boxes only one of several models agrees on are down-weighted.
+    """
+    preds = _sorted(np.asarray(preds, dtype=np.float32).reshape(-1, 6))
+    n = len(preds)
+    if n < 2:
+        return preds
+    box_set = _BoxSet(preds, agnostic)
+    cluster = np.empty(n, dtype=np.int64)
+    seeds = []
+    remaining = np.arange(n)
+    while remaining.size:
+        seed = remaining[0]  # preds are sorted, so this is the best remaining box
+        members = box_set.iou(seed, remaining) > iou_thres
+        members[0] = True
+        cluster[remaining[members]] = len(seeds)
+        seeds.append(seed)
+        remaining = remaining[~members]
+
+    n_clusters = len(seeds)
+    scores = preds[:, 4].astype(np.float64)
+    weight = np.bincount(cluster, weights=scores, minlength=n_clusters)
+    count = np.bincount(cluster, minlength=n_clusters)
+    fused = np.empty((n_clusters, 6), dtype=np.float32)
+    for k in range(4):
+        fused[:, k] = np.bincount(cluster, weights=scores * preds[:, k], minlength=n_clusters) / weight
+    if conf_type == 'max':
+        conf = np.zeros(n_clusters)
+        np.maximum.at(conf, cluster, scores)
+    else:
+        conf = weight / count
+    fused[:, 4] = conf * np.minimum(count, n_models) / n_models
+    fused[:, 5] = preds[seeds, 5]
+    return _sorted(fused)
+
+
+FUSION_METHODS = {
+    'nms': nms,
+    'soft_nms': soft_nms,
+    'wbf': weighted_boxes_fusion,
+}
+
+
+def fuse(preds, method='nms', **kwargs):
+    if method in (None, 'none'):
+        return _sorted(np.asarray(preds, dtype=np.float32).reshape(-1, 6))
+    if method not in FUSION_METHODS:
+        raise ValueError(f"Unknown fusion method {method!r}, expected one of {['none', *FUSION_METHODS]}")
+    return FUSION_METHODS[method](preds, **kwargs)
+
+
+def detections_to_preds(dets):
+    return np.column_stack([dets.boxes, dets.scores, dets.class_ids]).astype(np.float32)
+
+
+def preds_to_detections(preds):
+    return Detections(
+        np.ascontiguousarray(preds[:, :4], dtype=np.float32),
+        np.ascontiguousarray(preds[:, 4], dtype=np.float32),
+        preds[:, 5].astype(np.int64),
+    )
+
+
+def fuse_detections(dets, method='nms', **kwargs):
+    """``fuse`` for ensemble Detections; ``method=None`` or ``'none'`` returns them unchanged."""
+    if method in (None, 'none') or len(dets) < 2:
+        return dets
+    return preds_to_detections(fuse(detections_to_preds(dets), method, **kwargs))
@@ -6,13 +6,25 @@ BASE_DIR = os.path.abspath("data/separated_dataset")
 
 for class_name in CLASSES:
     class_dir = os.path.join(BASE_DIR, class_name)
-    images_dir = os.path.join(class_dir, "images")
     yaml_path = os.path.join(class_dir, f"{class_name}.yaml")
+    # grouping.py writes <class>/<split>/images; fall back to train when a split is missing
+    train_dir = os.path.join(class_dir, "train", "images")
+    val_dir = os.path.join(class_dir, "val", "images")
     data = {
-        'train': images_dir,
-        'val': images_dir,  # using all images for val for simplicity
+        'train': train_dir,
+        'val': val_dir if os.path.isdir(val_dir) else train_dir,
         'names': [class_name]
     }
+    test_dir = os.path.join(class_dir, "test", "images")
+    if os.path.isdir(test_dir):
+        data['test'] = test_dir
+    text = yaml.dump(data)
+    # Leave an unchanged file alone: train_all_oneclass.py retrains a class whose YAML is newer than its weights
+    if os.path.exists(yaml_path):
+        with open(yaml_path) as f:
+            if f.read() == text:
+                print(f"✔️  {yaml_path} is up to date")
+                continue
     with open(yaml_path, 'w') as f:
-        yaml.dump(data, f)
+        f.write(text)
     print(f"✅ Generated {yaml_path} with absolute image paths") 
\ No newline at end of file
@@ -1,90 +1,272 @@
+"""Split the dataset into one folder per class for the one-class models.
+
+For every split (train / val / test ...) and every class, an image that
+contains the class is placed in
+
+    data/separated_dataset/<Class>/<split>/images/<image>
+    data/separated_dataset/<Class>/<split>/labels/<stem>.txt
+
+The label file keeps only that class's boxes, re-numbered to class id 0, so the
+one-class models never see the other classes' objects as positives. Images are
+hardlinked, reflinked or symlinked instead of copied (``--mode``; ``auto``
+tries them in that order and falls back to a copy), so a multi-class image
+costs no extra disk space.
+
+Runs are incremental. ``manifest.json`` records every source file's mtime,
+size and label hash. Unchanged files are skipped, and outputs of deleted
+sources are removed. Files are processed on a thread pool.
+
+Usage:
+    python grouping.py
+    python grouping.py --splits train val --mode symlink
+"""
+import argparse
+import hashlib
+import json
 import os
 import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 # Define dataset and class mapping
 DATASET_DIR = "data"
 CLASSES_FILE = os.path.join(DATASET_DIR, "classes.txt")
+OUTPUT_DIR = os.path.join(DATASET_DIR, "separated_dataset")
+MANIFEST_NAME = "manifest.json"
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.webp')
+LINK_MODES = ('hardlink', 'reflink', 'symlink', 'copy')
+FICLONE = 0x40049409  # Linux ioctl: share the source's extents (btrfs, XFS, ...)
+
 
-# Read class names
-with open(CLASSES_FILE, "r") as f:
-    CLASSES = f.read().splitlines()
+# ---------------- Linking ----------------
+def _reflink(src, dst):
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError("reflinks need fcntl")
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError:
+            d.close()
+            os.remove(dst)
+            raise
 
-print(f"Classes found: {CLASSES}")
 
-# Output directory
-OUTPUT_DIR = os.path.join(DATASET_DIR, "separated_dataset_test")
+def _link_once(src, dst, mode):
+    if mode == 'hardlink':
+        os.link(src, dst)
+    elif mode == 'reflink':
+        _reflink(src, dst)
+    elif mode == 'symlink':
+        os.symlink(os.path.relpath(src, os.path.dirname(dst)), dst)
+    else:
+        shutil.copy2(src, dst)
 
-# Create class folders with images and labels subfolders
-for cls in CLASSES:
-    os.makedirs(os.path.join(OUTPUT_DIR, cls, "images"), exist_ok=True)
-    os.makedirs(os.path.join(OUTPUT_DIR, cls, "labels"), exist_ok=True)
 
-# Helper: process one subfolder (test)
-def process_split(split_name):
-    image_dir = os.path.join(DATASET_DIR, split_name, "images")
-    label_dir = os.path.join(DATASET_DIR, split_name, "labels")
-    
-    print(f"Processing {split_name} split...")
-    print(f"Image directory: {image_dir}")
-    print(f"Label directory: {label_dir}")
+def place_file(src, dst, mode='auto'):
+    """Put ``src`` at ``dst`` without copying when possible. Returns the mode used.
 
-    processed_count = 0
-    skipped_count = 0
+    Falls back to a copy when the filesystem does not support the link type
+    (e.g. hardlinks across devices, reflinks on ext4).
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+    candidates = LINK_MODES if mode == 'auto' else (mode, 'copy')
+    for candidate in candidates[:-1]:
+        try:
+            _link_once(src, dst, candidate)
+            return candidate
+        except OSError:
+            pass
+    _link_once(src, dst, candidates[-1])
+    return candidates[-1]
 
-    for label_file in os.listdir(label_dir):
-        if not label_file.endswith(".txt"):
+
+# ---------------- Labels ----------------
+def split_label(text, num_classes):
+    """{class_id: label text with only that class's boxes, renumbered to 0}."""
+    per_class = {}
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) < 5:
             continue
+        class_id = int(parts[0])
+        if 0 <= class_id < num_classes:
+            per_class.setdefault(class_id, []).append(' '.join(['0'] + parts[1:]))
+    return {class_id: '\n'.join(lines) + '\n' for class_id, lines in per_class.items()}
+
+
+def write_atomic(path, text):
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+# ---------------- One image ----------------
+def signature(path):
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def output_paths(split, cls, image_name, stem):
+    base = os.path.join(OUTPUT_DIR, cls, split)
+    return os.path.join(base, 'images', image_name), os.path.join(base, 'labels', stem + '.txt')
+
+
+def remove_outputs(split, entry, classes):
+    for cls in classes:
+        for path in output_paths(split, cls, entry['image_name'], entry['stem']):
+            if os.path.lexists(path):
+                os.remove(path)
+
 
-        label_path = os.path.join(label_dir, label_file)
-        # Change .txt to .png for image files
-        image_name = label_file.replace(".txt", ".png")
-        image_path = os.path.join(image_dir, image_name)
+def process_item(split, stem, label_path, image_path, prev, class_names, mode, force):
+    """Bring one image's per-class outputs up to date. Returns (manifest entry, status)."""
+    image_name = os.path.basename(image_path)
+    label_sig, image_sig = signature(label_path), signature(image_path)
+    outputs_ok = prev is not None and prev['image_name'] == image_name and all(
+        os.path.lexists(p) for cls in prev['classes'] for p in output_paths(split, cls, image_name, stem)
+    )
+    if not force and outputs_ok and prev['label'] == label_sig and prev['image'] == image_sig:
+        return prev, 'unchanged'
 
-        # Skip if image missing
-        if not os.path.exists(image_path):
-            print(f"⚠️  Image missing: {image_name}")
-            skipped_count += 1
+    with open(label_path) as f:
+        text = f.read()
+    label_sha = hashlib.sha256(text.encode()).hexdigest()
+    relabel = force or not outputs_ok or prev['label_sha'] != label_sha
+    relink = force or not outputs_ok or prev['image'] != image_sig
+    if not relabel and not relink:
+        # Touched but identical: only the recorded mtimes change
+        return {**prev, 'label': label_sig}, 'unchanged'
+
+    per_class = split_label(text, len(class_names))
+    classes = [class_names[class_id] for class_id in sorted(per_class)]
+    if prev is not None:
+        # Drop outputs of classes the label no longer contains (or an old image name)
+        remove_outputs(split, prev, [cls for cls in prev['classes'] if cls not in classes or prev['image_name'] != image_name])
+    link_mode = prev['link'] if prev is not None and not relink else None
+    for class_id, cls in zip(sorted(per_class), classes):
+        dst_image, dst_label = output_paths(split, cls, image_name, stem)
+        if relabel or not os.path.exists(dst_label):
+            write_atomic(dst_label, per_class[class_id])
+        if relink or not os.path.lexists(dst_image):
+            link_mode = place_file(os.path.abspath(image_path), dst_image, mode)
+    entry = {
+        'stem': stem,
+        'image_name': image_name,
+        'label': label_sig,
+        'image': image_sig,
+        'label_sha': label_sha,
+        'classes': classes,
+        'link': link_mode,
+    }
+    return entry, 'updated' if prev is not None else 'added'
+
+
+# ---------------- Splits ----------------
+def find_splits():
+    return sorted(
+        name for name in os.listdir(DATASET_DIR)
+        if os.path.isdir(os.path.join(DATASET_DIR, name, 'images'))
+        and os.path.isdir(os.path.join(DATASET_DIR, name, 'labels'))
+    )
+
+
+def split_items(split):
+    """(stem, label_path, image_path) for every labelled image; the list of labels without an image."""
+    image_dir = os.path.join(DATASET_DIR, split, "images")
+    label_dir = os.path.join(DATASET_DIR, split, "labels")
+    images = {}
+    for name in os.listdir(image_dir):
+        stem, ext = os.path.splitext(name)
+        if ext.lower() in IMAGE_EXTENSIONS:
+            images[stem] = os.path.join(image_dir, name)
+    items, missing = [], []
+    for name in sorted(os.listdir(label_dir)):
+        stem, ext = os.path.splitext(name)
+        if ext != '.txt':
+            continue
+        if stem not in images:
+            missing.append(name)
             continue
+        items.append((stem, os.path.join(label_dir, name), images[stem]))
+    return items, missing
+
+
+def load_manifest(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def group(splits, class_names, mode='auto', workers=None, force=False):
+    manifest_path = os.path.join(OUTPUT_DIR, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+    for cls in class_names:
+        for split in splits:
+            os.makedirs(os.path.join(OUTPUT_DIR, cls, split, "images"), exist_ok=True)
+            os.makedirs(os.path.join(OUTPUT_DIR, cls, split, "labels"), exist_ok=True)
+
+    new_manifest = {key: entry for key, entry in manifest.items() if key.split('/', 1)[0] not in splits}
+    with ThreadPoolExecutor(max_workers=workers or min(32, (os.cpu_count() or 1) * 4)) as pool:
+        for split in splits:
+            items, missing = split_items(split)
+            futures = {
+                f"{split}/{stem}": pool.submit(process_item, split, stem, label_path, image_path,
+                                               manifest.get(f"{split}/{stem}"), class_names, mode, force)
+                for stem, label_path, image_path in items
+            }
+            counts = {'added': 0, 'updated': 0, 'unchanged': 0, 'removed': 0}
+            links = {}
+            for key, future in futures.items():
+                entry, status = future.result()
+                new_manifest[key] = entry
+                counts[status] += 1
+                links[entry['link']] = links.get(entry['link'], 0) + 1
+            # Sources that disappeared since the last run
+            for key, entry in manifest.items():
+                if key.split('/', 1)[0] == split and key not in futures:
+                    remove_outputs(split, entry, entry['classes'])
+                    counts['removed'] += 1
+            if missing:
+                print(f"⚠️  {split}: {len(missing)} labels without an image, skipped (e.g. {missing[0]})")
+            link_summary = ', '.join(f"{n} {m}" for m, n in sorted(links.items(), key=lambda kv: str(kv[0])) if m)
+            print(f"📂 {split}: {counts['added']} added, {counts['updated']} updated, "
+                  f"{counts['unchanged']} unchanged, {counts['removed']} removed ({link_summary or 'no images'})")
+
+    tmp = manifest_path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(new_manifest, f)
+    os.replace(tmp, manifest_path)
+    return new_manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Group the dataset into one-class folders.")
+    parser.add_argument('--splits', nargs='+', help="splits to process (default: every data/<split> with images/ and labels/)")
+    parser.add_argument('--mode', default='auto', choices=['auto', *LINK_MODES], help="how images are placed")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--force', action='store_true', help="rebuild every file, ignoring the manifest")
+    args = parser.parse_args()
+
+    # Read class names
+    with open(CLASSES_FILE, "r") as f:
+        CLASSES = [line.strip() for line in f if line.strip()]
+    print(f"Classes found: {CLASSES}")
+
+    splits = args.splits or find_splits()
+    start = time.perf_counter()
+    manifest = group(splits, CLASSES, mode=args.mode, workers=args.workers, force=args.force)
+    print(f"\n✅ Grouped {len(manifest)} images into class folders in {OUTPUT_DIR} ({time.perf_counter() - start:.1f}s)")
 
-        with open(label_path, "r") as f:
-            lines = f.readlines()
-
-        found_classes = set()
-        for line in lines:
-            parts = line.strip().split()
-            if len(parts) < 5:
-                continue
-            class_id = int(parts[0])
-            if 0 <= class_id < len(CLASSES):
-                found_classes.add(CLASSES[class_id])
-
-        # Copy image and label into all relevant class folders
-        for cls in found_classes:
-            # Copy image
-            dest_image_path = os.path.join(OUTPUT_DIR, cls, "images", image_name)
-            shutil.copy(image_path, dest_image_path)
-            
-            # Copy label
-            dest_label_path = os.path.join(OUTPUT_DIR, cls, "labels", label_file)
-            shutil.copy(label_path, dest_label_path)
-            
-            print(f"✅ Copied {image_name} to {cls} class")
-
-        processed_count += 1
-
-    print(f"Processed {processed_count} files, skipped {skipped_count} files")
-
-# Run for test set
-process_split("test")
-
-print(f"\n✅ All images and labels sorted into class folders in {OUTPUT_DIR}")
-
-# Print summary
-for cls in CLASSES:
-    cls_image_dir = os.path.join(OUTPUT_DIR, cls, "images")
-    cls_label_dir = os.path.join(OUTPUT_DIR, cls, "labels")
-    
-    image_count = len([f for f in os.listdir(cls_image_dir) if f.endswith('.png')])
-    label_count = len([f for f in os.listdir(cls_label_dir) if f.endswith('.txt')])
-    
-    print(f"{cls}: {image_count} images, {label_count} labels")
+    # Print summary
+    for cls in CLASSES:
+        counts = []
+        for split in splits:
+            cls_image_dir = os.path.join(OUTPUT_DIR, cls, split, "images")
+            counts.append(f"{split} {len(os.listdir(cls_image_dir))}")
+        print(f"{cls}: {', '.join(counts)} images")
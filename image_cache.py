@@ -0,0 +1,260 @@
+"""Decode every training image once and share it across training runs.
+
+The one-class runs (train_all_oneclass.py) and the multi-class run
+(train_multiclass.py) read the same PNGs: grouping.py only links the originals
+into ``data/separated_dataset/<Class>/<split>/images``. Without a cache, every
+run decodes and resizes each image again on every epoch. This module decodes
+``data/<split>/images`` once, resizes each image the way ultralytics does (long
+side to ``imgsz``) and stores it in a fixed ``imgsz x imgsz`` slot of one uint8
+array:
+
+    images.npy  (I, S, S, 3) uint8  image i in images[i, :h, :w], the rest is padding
+    shapes.npy  (I, 4)       int32  h0, w0 (original) and h, w (resized) of every image
+    files.json                      imgsz, "<split>/<stem>" keys + (mtime, size) of every source
+
+The cache lives in ``data/image_cache/``. ``open_cache`` refreshes it before
+memory-mapping it: only images whose mtime or size changed are decoded again (on
+a thread pool, since OpenCV releases the GIL), and new or removed images
+rebuild the arrays, with unchanged rows copied from the old ones.
+
+Training feeds from it through ``CachedDetectionTrainer``. Its datasets read
+the cached slot instead of the PNG and fall back to a normal decode for any
+image that is not cached or no longer matches its source.
+
+Usage:
+    python image_cache.py                  # build / refresh for train and val
+    python image_cache.py --splits train val test --imgsz 640
+"""
+import argparse
+import json
+import math
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+DATASET_DIR = 'data'
+CACHE_DIR = os.path.join(DATASET_DIR, 'image_cache')
+CACHE_SPLITS = ('train', 'val')
+IMGSZ = 640
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.webp')
+
+
+def cache_key(image_path):
+    """``.../<split>/images/<stem>.png`` -> ``<split>/<stem>``, for originals and per-class links alike."""
+    image_dir, name = os.path.split(os.path.abspath(image_path))
+    split = os.path.basename(os.path.dirname(image_dir))
+    return f"{split}/{os.path.splitext(name)[0]}"
+
+
+def scan_images(splits, dataset_dir=DATASET_DIR):
+    """{key: (path, [mtime_ns, size])} for every image of ``splits``, sorted by key."""
+    files = {}
+    for split in splits:
+        image_dir = os.path.join(dataset_dir, split, 'images')
+        if not os.path.isdir(image_dir):
+            continue
+        with os.scandir(image_dir) as entries:
+            for entry in entries:
+                stem, ext = os.path.splitext(entry.name)
+                if ext.lower() in IMAGE_EXTENSIONS and entry.is_file():
+                    stat = entry.stat()
+                    files[f"{split}/{stem}"] = (entry.path, [stat.st_mtime_ns, stat.st_size])
+    return dict(sorted(files.items()))
+
+
+def resize_long_side(image, imgsz):
+    """Same resize as ultralytics' BaseDataset.load_image in rect mode, so cached and uncached runs match."""
+    h0, w0 = image.shape[:2]
+    r = imgsz / max(h0, w0)
+    if r != 1:
+        w, h = min(math.ceil(w0 * r), imgsz), min(math.ceil(h0 * r), imgsz)
+        image = cv2.resize(image, (w, h), interpolation=cv2.INTER_LINEAR)
+    return image
+
+
+def decode_into(path, images, shapes, row, imgsz):
+    image = cv2.imread(path, cv2.IMREAD_COLOR)
+    if image is None:
+        shapes[row] = 0  # unreadable: the dataset falls back to its own decode (and error)
+        return
+    h0, w0 = image.shape[:2]
+    image = resize_long_side(image, imgsz)
+    h, w = image.shape[:2]
+    images[row, :h, :w] = image
+    images[row, h:] = 0
+    images[row, :h, w:] = 0
+    shapes[row] = (h0, w0, h, w)
+
+
+class ImageCache:
+    """Memory-mapped decoded images, looked up by image path."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'files.json')) as f:
+            meta = json.load(f)
+        self.imgsz = meta['imgsz']
+        self.files = meta['files']
+        self.keys = list(self.files)
+        self._rows = {key: i for i, key in enumerate(self.keys)}
+        self._images = None
+        self.shapes = np.load(os.path.join(path, 'shapes.npy'))
+
+    @property
+    def images(self):
+        # Opened lazily, so every dataloader worker maps the file itself instead of receiving a pickled copy
+        if self._images is None:
+            self._images = np.load(os.path.join(self.path, 'images.npy'), mmap_mode='r')
+        return self._images
+
+    def __getstate__(self):
+        return {**self.__dict__, '_images': None}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def row(self, image_path):
+        """Row of ``image_path``, or None if it is not cached or its size no longer matches the source."""
+        key = cache_key(image_path)
+        i = self._rows.get(key)
+        if i is None or not self.shapes[i, 0]:
+            return None
+        try:
+            if os.path.getsize(image_path) != self.files[key][1]:
+                return None
+        except OSError:
+            return None
+        return i
+
+    def load(self, i):
+        """(image, (h0, w0), (h, w)) like ultralytics' load_image; the image is a private copy."""
+        h0, w0, h, w = self.shapes[i].tolist()
+        return np.array(self.images[i, :h, :w]), (h0, w0), (h, w)
+
+
+def open_cache(splits=CACHE_SPLITS, imgsz=IMGSZ, root=CACHE_DIR, dataset_dir=DATASET_DIR, workers=None, verbose=False):
+    """Refresh (if any source image changed) and memory-map the decoded image cache."""
+    scanned = scan_images(splits, dataset_dir)
+    files = {key: sig for key, (_, sig) in scanned.items()}
+    old = None
+    if os.path.exists(os.path.join(root, 'files.json')):
+        try:
+            old = ImageCache(root)
+        except (OSError, ValueError, KeyError):
+            old = None  # truncated/corrupt cache, rebuild
+        if old is not None and old.imgsz != imgsz:
+            old = None
+        # Splits that were not asked for keep their rows
+        if old is not None:
+            files = dict(sorted({**{k: v for k, v in old.files.items() if k.split('/', 1)[0] not in splits}, **files}.items()))
+        if old is not None and old.files == files:
+            return old
+
+    stale = [key for key, sig in files.items() if old is None or old.files.get(key) != sig]
+    start = time.perf_counter()
+    pool = ThreadPoolExecutor(max_workers=workers or os.cpu_count())
+    if old is not None and old.keys == list(files):
+        # Same image set: re-decode the changed rows in place, then record their new signatures
+        images = np.load(os.path.join(root, 'images.npy'), mmap_mode='r+')
+        shapes = np.array(old.shapes)
+        rows = [old._rows[key] for key in stale]
+        list(pool.map(lambda r: decode_into(scanned[old.keys[r]][0], images, shapes, r, imgsz), rows))
+        images.flush()
+        del images
+        np.save(os.path.join(root, 'shapes.npy'), shapes)
+        with open(os.path.join(root, 'files.json'), 'w') as f:
+            json.dump({'imgsz': imgsz, 'files': files}, f)
+    else:
+        tmp = f"{root}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        images = np.lib.format.open_memmap(os.path.join(tmp, 'images.npy'), mode='w+', dtype=np.uint8,
+                                           shape=(len(files), imgsz, imgsz, 3))
+        shapes = np.zeros((len(files), 4), dtype=np.int32)
+        stale_set = set(stale)
+        jobs = []
+        for row, key in enumerate(files):
+            if key in stale_set:
+                jobs.append(pool.submit(decode_into, scanned[key][0], images, shapes, row, imgsz))
+            else:
+                old_row = old._rows[key]
+                images[row] = old.images[old_row]
+                shapes[row] = old.shapes[old_row]
+        for job in jobs:
+            job.result()
+        images.flush()
+        del images
+        np.save(os.path.join(tmp, 'shapes.npy'), shapes)
+        with open(os.path.join(tmp, 'files.json'), 'w') as f:
+            json.dump({'imgsz': imgsz, 'files': files}, f)
+        old = None  # release the memory maps before the old cache is replaced
+        shutil.rmtree(root, ignore_errors=True)
+        os.replace(tmp, root)
+    pool.shutdown()
+    if verbose:
+        size_gb = len(files) * imgsz * imgsz * 3 / 1e9
+        print(f"🖼️  Image cache {root}: {len(stale)} of {len(files)} images decoded "
+              f"in {time.perf_counter() - start:.1f}s ({size_gb:.1f} GB)")
+    return ImageCache(root)
+
+
+# ---------------- Ultralytics integration ----------------
+try:
+    from ultralytics.data.dataset import YOLODataset
+    from ultralytics.models.yolo.detect import DetectionTrainer
+except ImportError:  # the cache itself does not need ultralytics
+    YOLODataset = DetectionTrainer = None
+
+
+if YOLODataset is not None:
+    class CachedYOLODataset(YOLODataset):
+        """YOLODataset whose load_image reads the shared image cache when it can."""
+
+        def attach_cache(self, cache):
+            usable = cache.imgsz == self.imgsz and self.channels == 3
+            self.image_cache = cache
+            self.cache_rows = [cache.row(f) if usable else None for f in self.im_files]
+            return sum(row is not None for row in self.cache_rows)
+
+        def load_image(self, i, rect_mode=True, resize_short=False):
+            row = self.cache_rows[i]
+            if row is None or self.ims[i] is not None or not rect_mode or resize_short:
+                return super().load_image(i, rect_mode, resize_short)
+            im, hw0, hw = self.image_cache.load(row)
+            # Keep the mosaic buffer behaviour of BaseDataset.load_image
+            if self.augment and self.cache != "ram":
+                self.ims[i], self.im_hw0[i], self.im_hw[i] = im, hw0, hw
+                self.buffer.append(i)
+                if 1 < len(self.buffer) >= self.max_buffer_length:
+                    j = self.buffer.pop(0)
+                    self.ims[j], self.im_hw0[j], self.im_hw[j] = None, None, None
+            return im, hw0, hw
+
+    class CachedDetectionTrainer(DetectionTrainer):
+        """DetectionTrainer that feeds from ``data/image_cache``; pass it as ``model.train(trainer=...)``."""
+        cache_root = CACHE_DIR
+
+        def build_dataset(self, img_path, mode="train", batch=None):
+            dataset = super().build_dataset(img_path, mode, batch)
+            if type(dataset) is not YOLODataset:
+                return dataset
+            dataset.__class__ = CachedYOLODataset
+            cache = open_cache(imgsz=self.args.imgsz, root=self.cache_root)
+            hits = dataset.attach_cache(cache)
+            print(f"🖼️  {mode}: {hits} of {len(dataset.im_files)} images served from {self.cache_root}")
+            return dataset
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Decode the training images once into a shared memory-mapped cache.")
+    parser.add_argument('--splits', nargs='+', default=list(CACHE_SPLITS))
+    parser.add_argument('--imgsz', type=int, default=IMGSZ)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    cache = open_cache(args.splits, imgsz=args.imgsz, workers=args.workers, verbose=True)
+    print(f"✅ {len(cache)} images cached in {CACHE_DIR}")
@@ -0,0 +1,189 @@
+"""Columnar index of the YOLO label files of a split.
+
+Every box of ``data/<split>/labels/*.txt`` is stored once in flat NumPy columns
+next to the labels, in ``data/<split>/labels_index/``:
+
+    image_idx.npy  (N,)   int32    index into the image list
+    class_ids.npy  (N,)   int64
+    boxes.npy      (N, 4) float32  cx, cy, w, h (normalized)
+    offsets.npy    (I+1,) int64    image i owns rows offsets[i]:offsets[i+1]
+    files.json                     image stems + (mtime, size) of every label file
+
+``open_index`` memory-maps the columns. Before that it refreshes them: only
+label files whose mtime or size changed are re-parsed (in a process pool when
+there are many), and unchanged images keep their rows. Class balance, box-size
+histograms, per-class image lists and evaluation ground truth then come from
+the arrays instead of thousands of small file reads.
+
+Usage:
+    python label_index.py                 # index + stats for every split
+    python label_index.py --splits test
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+DATASET_DIR = 'data'
+CLASS_NAMES = ['FireExtinguisher', 'ToolBox', 'OxygenTank']
+COLUMNS = ('image_idx', 'class_ids', 'boxes', 'offsets')
+PARALLEL_MIN_FILES = 512  # below this, parsing in-process beats starting a pool
+
+
+def parse_label_file(path):
+    """(N, 5) float32 rows [cls, cx, cy, w, h]; extra columns (e.g. conf) are ignored."""
+    with open(path) as f:
+        rows = [line.split()[:5] for line in f if line.strip()]
+    rows = [row for row in rows if len(row) == 5]
+    if not rows:
+        return np.zeros((0, 5), dtype=np.float32)
+    return np.array(rows, dtype=np.float32)
+
+
+def parse_label_files(paths):
+    return [parse_label_file(path) for path in paths]
+
+
+def index_path_for(label_dir):
+    """``data/test/labels`` -> ``data/test/labels_index``."""
+    return os.path.normpath(label_dir) + '_index'
+
+
+def scan_labels(label_dir):
+    """{stem: [mtime_ns, size]} for every label file, sorted by stem."""
+    files = {}
+    with os.scandir(label_dir) as entries:
+        for entry in entries:
+            if entry.name.endswith('.txt') and entry.is_file():
+                stat = entry.stat()
+                files[entry.name[:-4]] = [stat.st_mtime_ns, stat.st_size]
+    return dict(sorted(files.items()))
+
+
+class LabelIndex:
+    """Memory-mapped label columns of one split."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'files.json')) as f:
+            self.files = json.load(f)
+        self.image_ids = list(self.files)
+        self._positions = None
+        for name in COLUMNS:
+            setattr(self, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r'))
+
+    def __len__(self):
+        return len(self.image_ids)
+
+    def position(self, stem):
+        if self._positions is None:
+            self._positions = {stem: i for i, stem in enumerate(self.image_ids)}
+        return self._positions.get(stem)
+
+    def labels(self, i):
+        """(N, 5) [cls, cx, cy, w, h] of image ``i`` (an index or a stem)."""
+        if isinstance(i, str):
+            i = self.position(i)
+            if i is None:
+                return np.zeros((0, 5), dtype=np.float32)
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return np.column_stack([self.class_ids[start:end], self.boxes[start:end]]).astype(np.float32)
+
+    # ---------------- statistics ----------------
+    def class_counts(self, num_classes=len(CLASS_NAMES)):
+        """Boxes per class."""
+        return np.bincount(self.class_ids, minlength=num_classes)[:num_classes]
+
+    def images_per_class(self, num_classes=len(CLASS_NAMES)):
+        """Images containing each class at least once."""
+        pairs = np.unique(self.image_idx.astype(np.int64) * num_classes + self.class_ids)
+        return np.bincount(pairs % num_classes, minlength=num_classes)[:num_classes]
+
+    def images_with_class(self, class_id):
+        """Stems of the images that contain ``class_id``."""
+        idx = np.unique(self.image_idx[self.class_ids == class_id])
+        return [self.image_ids[i] for i in idx.tolist()]
+
+    def box_size_histogram(self, class_id=None, bins=20):
+        """Histogram of sqrt(w * h), the box size as a fraction of the image side."""
+        boxes = self.boxes if class_id is None else self.boxes[self.class_ids == class_id]
+        return np.histogram(np.sqrt(boxes[:, 2] * boxes[:, 3]), bins=bins, range=(0.0, 1.0))
+
+
+def write_index(path, files, labels):
+    """Write the columns for ``labels`` (one (N, 5) array per stem in ``files``) atomically."""
+    counts = np.array([len(l) for l in labels], dtype=np.int64)
+    rows = np.concatenate(labels) if labels else np.zeros((0, 5), dtype=np.float32)
+    columns = {
+        'image_idx': np.repeat(np.arange(len(labels), dtype=np.int32), counts),
+        'class_ids': rows[:, 0].astype(np.int64),
+        'boxes': np.ascontiguousarray(rows[:, 1:5], dtype=np.float32),
+        'offsets': np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+    }
+    tmp = f"{path}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for name, array in columns.items():
+        np.save(os.path.join(tmp, f"{name}.npy"), array)
+    with open(os.path.join(tmp, 'files.json'), 'w') as f:
+        json.dump(files, f)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
+
+
+def open_index(label_dir, workers=None, verbose=False):
+    """Refresh (if any label file changed) and memory-map the index of ``label_dir``."""
+    path = index_path_for(label_dir)
+    files = scan_labels(label_dir)
+    old = None
+    if os.path.exists(os.path.join(path, 'files.json')):
+        try:
+            old = LabelIndex(path)
+        except (OSError, ValueError):
+            old = None  # truncated/corrupt index, rebuild
+        if old is not None and old.files == files:
+            return old
+
+    stale = [stem for stem, sig in files.items() if old is None or old.files.get(stem) != sig]
+    paths = [os.path.join(label_dir, stem + '.txt') for stem in stale]
+    if len(paths) >= PARALLEL_MIN_FILES and (workers or os.cpu_count() or 1) > 1:
+        workers = workers or os.cpu_count()
+        chunk = -(-len(paths) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parsed = [a for part in pool.map(parse_label_files, [paths[i:i + chunk] for i in range(0, len(paths), chunk)]) for a in part]
+    else:
+        parsed = parse_label_files(paths)
+    fresh = dict(zip(stale, parsed))
+    labels = [fresh[stem] if stem in fresh else old.labels(old.position(stem)) for stem in files]
+    old = None  # release the memory maps before the old index is replaced
+    write_index(path, files, labels)
+    if verbose:
+        print(f"🗂️  {label_dir}: {len(stale)} of {len(files)} label files (re)parsed")
+    return LabelIndex(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the label index and print dataset statistics.")
+    parser.add_argument('--splits', nargs='+', default=['train', 'val', 'test'])
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    for split in args.splits:
+        label_dir = os.path.join(DATASET_DIR, split, 'labels')
+        if not os.path.isdir(label_dir):
+            print(f"❌ {label_dir} not found, skipping.")
+            continue
+        start = time.perf_counter()
+        index = open_index(label_dir, workers=args.workers, verbose=True)
+        elapsed = time.perf_counter() - start
+        print(f"\n📊 {split}: {len(index)} images, {len(index.class_ids)} boxes ({1000 * elapsed:.0f} ms)")
+        boxes, images = index.class_counts(), index.images_per_class()
+        for c, name in enumerate(CLASS_NAMES):
+            hist, edges = index.box_size_histogram(c, bins=10)
+            peak = int(hist.argmax()) if hist.any() else 0
+            print(f"  {name:<18} {boxes[c]:>6} boxes in {images[c]:>6} images, "
+                  f"most boxes {edges[peak]:.1f}-{edges[peak + 1]:.1f} of the image side")
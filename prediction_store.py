@@ -0,0 +1,127 @@
+"""Persistent store of the ensemble's raw test-set predictions.
+
+Changing ``iou_thres`` or the fusion method should not mean re-running three
+models over the whole test set. ``open_or_build`` runs the ensemble once per
+image at a low confidence (``conf=0.001``) and saves the unfused detections as
+flat columns, one ``.npy`` file each:
+
+    boxes.npy      (N, 4) float32   xyxy, original image pixels
+    scores.npy     (N,)   float32
+    class_ids.npy  (N,)   int64
+    offsets.npy    (I+1,) int64     image i owns rows offsets[i]:offsets[i+1]
+    shapes.npy     (I, 2) int32     (height, width) of every image
+    meta.json                       image ids, thresholds, fingerprints
+
+The store lives in ``prediction_store/<key>/``. The key hashes the model
+weights, the test images (name, size, mtime) and the inference thresholds, so
+retraining or changing the test set starts a new store. Later runs memory-map
+the columns, and every image's Detections are zero-copy slices of them.
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+from ensemble import Detections, EnsembleEngine, MODEL_PATHS, IMGSZ, weights_fingerprint
+
+STORE_DIR = 'prediction_store'
+COLUMNS = ('boxes', 'scores', 'class_ids', 'offsets', 'shapes')
+
+
+def image_set_fingerprint(img_paths):
+    """Cheap identity of a set of images: names, sizes and modification times."""
+    digest = hashlib.sha256()
+    for path in img_paths:
+        stat = os.stat(path)
+        digest.update(f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns}|".encode())
+    return digest.hexdigest()
+
+
+def store_key(weights_fp, images_fp, conf, iou):
+    return hashlib.sha256(f"{weights_fp}:{images_fp}:conf={conf!r}:iou={iou!r}".encode()).hexdigest()
+
+
+class PredictionStore:
+    """Read-only, memory-mapped view of a written store."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.image_ids = self.meta['images']
+        for name in COLUMNS:
+            setattr(self, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r'))
+
+    def __len__(self):
+        return len(self.image_ids)
+
+    def __getitem__(self, i):
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return Detections(self.boxes[start:end], self.scores[start:end], self.class_ids[start:end])
+
+    def __iter__(self):
+        """Yields (image_id, (height, width), Detections) in image order."""
+        for i, image_id in enumerate(self.image_ids):
+            yield image_id, tuple(self.shapes[i].tolist()), self[i]
+
+    @classmethod
+    def write(cls, path, image_ids, shapes, dets_list, meta):
+        """Write a store atomically: columns go to a temporary directory that is renamed into place."""
+        counts = np.array([len(d) for d in dets_list], dtype=np.int64)
+        columns = {
+            'boxes': np.concatenate([d.boxes for d in dets_list] or [np.zeros((0, 4))]).astype(np.float32).reshape(-1, 4),
+            'scores': np.concatenate([d.scores for d in dets_list] or [np.zeros(0)]).astype(np.float32),
+            'class_ids': np.concatenate([d.class_ids for d in dets_list] or [np.zeros(0)]).astype(np.int64),
+            'offsets': np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+            'shapes': np.asarray(shapes, dtype=np.int32).reshape(-1, 2),
+        }
+        tmp = f"{path}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for name, array in columns.items():
+            np.save(os.path.join(tmp, f"{name}.npy"), array)
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump({**meta, 'images': list(image_ids), 'predictions': int(counts.sum())}, f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp, path)
+        return cls(path)
+
+
+def open_or_build(img_paths, model_paths=MODEL_PATHS, conf=0.001, iou=0.5, imgsz=IMGSZ,
+                  root=STORE_DIR, rebuild=False):
+    """Load the store for these weights, images and thresholds, running the ensemble only if it is missing."""
+    img_paths = list(img_paths)
+    weights_fp = weights_fingerprint(model_paths, imgsz)
+    images_fp = image_set_fingerprint(img_paths)
+    path = os.path.join(root, store_key(weights_fp, images_fp, conf, iou))
+    if not rebuild and os.path.exists(os.path.join(path, 'meta.json')):
+        print(f"📦 Loading stored predictions from {path}")
+        return PredictionStore(path)
+
+    print(f"🧠 No stored predictions for these weights/images, running the ensemble once (conf={conf})")
+    engine = EnsembleEngine(model_paths, imgsz=imgsz)
+    start = time.perf_counter()
+    image_ids, shapes, dets_list = [], [], []
+    for img_path in tqdm(img_paths, desc='Ensembling'):
+        image = cv2.imread(img_path)
+        image_ids.append(os.path.splitext(os.path.basename(img_path))[0])
+        shapes.append(image.shape[:2])
+        dets_list.append(engine.predict(image, conf=conf, iou=iou))
+    os.makedirs(root, exist_ok=True)
+    meta = {
+        'weights_fingerprint': weights_fp,
+        'images_fingerprint': images_fp,
+        'class_names': engine.class_names,
+        'conf': conf,
+        'iou': iou,
+        'imgsz': imgsz,
+        'inference_seconds': time.perf_counter() - start,
+    }
+    store = PredictionStore.write(path, image_ids, shapes, dets_list, meta)
+    print(f"💾 Saved {store.meta['predictions']} predictions for {len(store)} images to {path}")
+    return store
@@ -0,0 +1,85 @@
+"""Content-addressed cache of ensemble results.
+
+Entries are keyed on the SHA-256 of the encoded image bytes, the engine's
+weight fingerprint and the inference thresholds, so a byte-identical upload
+costs a hash lookup instead of three forward passes. The in-memory tier is an
+LRU bounded by ``max_entries``; the optional disk tier stores one ``.npz`` per
+key under ``disk_dir`` and survives restarts.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from ensemble import Detections
+
+
+def cache_key(image_bytes, fingerprint, **params):
+    digest = hashlib.sha256(image_bytes)
+    digest.update(fingerprint.encode())
+    for name in sorted(params):
+        digest.update(f"|{name}={params[name]!r}".encode())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    def __init__(self, max_entries=1024, disk_dir=None):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _disk_path(self, key):
+        # Two-level fan-out keeps directories small for long-running stations
+        return os.path.join(self.disk_dir, key[:2], f"{key}.npz")
+
+    def get(self, key):
+        with self._lock:
+            dets = self._entries.get(key)
+            if dets is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return dets
+        if self.disk_dir:
+            path = self._disk_path(key)
+            if os.path.exists(path):
+                try:
+                    with np.load(path) as data:
+                        dets = Detections(data['boxes'], data['scores'], data['class_ids'])
+                except (OSError, ValueError, KeyError):
+                    dets = None  # truncated/corrupt entry, recompute
+                if dets is not None:
+                    self._remember(key, dets)
+                    with self._lock:
+                        self.hits += 1
+                    return dets
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, dets):
+        self._remember(key, dets)
+        if self.disk_dir:
+            path = self._disk_path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, boxes=dets.boxes, scores=dets.scores, class_ids=dets.class_ids)
+            os.replace(tmp_path, path)
+
+    def _remember(self, key, dets):
+        with self._lock:
+            self._entries[key] = dets
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
@@ -1,11 +1,34 @@
-from fastapi import FastAPI, File, UploadFile
+from fastapi import FastAPI, File, HTTPException, UploadFile, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from ultralytics import YOLO
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional
+import asyncio
 import cv2
 import numpy as np
 import base64
+import io
+import json
 import os
+import sys
+import time
+import zipfile
+
+import psutil
+
+# Cold-start timings are measured from process creation (interpreter + uvicorn + imports)
+PROCESS_START = psutil.Process().create_time()
+
+# Shared ensemble engine lives at the repository root
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from ensemble import (EngineLoader, EnsembleEngine, THRESHOLDS_PATH, backend_model_paths, decode_image,  # noqa: E402
+                      draw_detections, load_thresholds)
+from result_cache import ResultCache, cache_key  # noqa: E402
+from fusion import fuse_detections  # noqa: E402
+from batcher import MicroBatcher  # noqa: E402
+from cascade import CASCADE_BAND, FAST_MODEL_PATH, CascadeEngine  # noqa: E402
+from tiling import TILE_BATCH, TILE_MIN_SIDE, TILE_OVERLAP, TILE_SIZE, TiledEngine  # noqa: E402
+from video_stream import VideoPipeline  # noqa: E402
 
 app = FastAPI()
 
@@ -25,48 +48,385 @@ MODEL_PATHS = {
     'OxygenTank': '../../runs/detect/OxygenTank/weights/best.pt',
 }
 
-# Load models once at startup
-models = {cls: YOLO(path) for cls, path in MODEL_PATHS.items()}
+# Concurrent per-model execution (see EnsembleEngine). On a 16-core box e.g.
+# ENSEMBLE_PARALLEL=1 ENSEMBLE_THREADS_PER_MODEL=5 ENSEMBLE_CPU_AFFINITY=auto
+PARALLEL_MODELS = os.environ.get('ENSEMBLE_PARALLEL', '0') == '1'
+THREADS_PER_MODEL = int(os.environ.get('ENSEMBLE_THREADS_PER_MODEL', '0')) or None
+INTEROP_THREADS = int(os.environ.get('ENSEMBLE_INTEROP_THREADS', '0')) or None
+CPU_AFFINITY = os.environ.get('ENSEMBLE_CPU_AFFINITY') or None  # 'auto' or unset
+# torch | onnx | onnx-int8 | openvino | openvino-int8 (exported with export_models.py)
+INFERENCE_BACKEND = os.environ.get('ENSEMBLE_BACKEND', 'torch')
+# Cascade (see cascade.py): multiclass5 on every image, the one-class models only where it is unsure.
+# ENSEMBLE_CASCADE=1 CASCADE_BAND=0.1,0.6 CASCADE_ESCALATE=crop|frame CASCADE_ESCALATE_EMPTY=0|1 CASCADE_MODEL=.../best.pt
+CASCADE = os.environ.get('ENSEMBLE_CASCADE', '0') == '1'
+CASCADE_MODEL = os.environ.get('CASCADE_MODEL', FAST_MODEL_PATH)
+CASCADE_BAND_LIMITS = tuple(float(x) for x in os.environ.get('CASCADE_BAND', ','.join(map(str, CASCADE_BAND))).split(','))
+CASCADE_ESCALATE = os.environ.get('CASCADE_ESCALATE', 'crop')
+CASCADE_ESCALATE_EMPTY = os.environ.get('CASCADE_ESCALATE_EMPTY', '0') == '1'
+# Tiled inference for high-resolution frames (see tiling.py): frames longer than TILE_MIN_SIDE
+# are cut into overlapping TILE_SIZE tiles, TILE_BATCH per forward pass. ENSEMBLE_TILING=1 enables it.
+TILING = os.environ.get('ENSEMBLE_TILING', '0') == '1'
+TILE_ARGS = dict(
+    tile_size=int(os.environ.get('TILE_SIZE', TILE_SIZE)),
+    overlap=float(os.environ.get('TILE_OVERLAP', TILE_OVERLAP)),
+    batch_size=int(os.environ.get('TILE_BATCH', TILE_BATCH)),
+    min_side=int(os.environ.get('TILE_MIN_SIDE', TILE_MIN_SIDE)),
+)
+
+# Warm-up batch sizes run on a synthetic frame before /readyz turns ready ('' or 0 disables):
+# 1 is the single-image path, 2 the padded micro-batch path
+WARMUP_BATCH_SIZES = [int(n) for n in os.environ.get('ENSEMBLE_WARMUP', '1,2').split(',') if n.strip() and int(n)]
+CLASS_NAMES = list(MODEL_PATHS)
+
+def build_engine():
+    engine = EnsembleEngine(
+        backend_model_paths(MODEL_PATHS, INFERENCE_BACKEND),
+        parallel=PARALLEL_MODELS,
+        threads_per_model=THREADS_PER_MODEL,
+        interop_threads=INTEROP_THREADS,
+        cpu_affinity=CPU_AFFINITY,
+    )
+    if CASCADE:
+        engine = app.state.cascade = CascadeEngine(
+            engine,
+            backend_model_paths({'cascade': CASCADE_MODEL}, INFERENCE_BACKEND)['cascade'],
+            band=CASCADE_BAND_LIMITS,
+            escalate=CASCADE_ESCALATE,
+            escalate_empty=CASCADE_ESCALATE_EMPTY,
+        )
+    if TILING:
+        engine = TiledEngine(engine, **TILE_ARGS)
+    return engine
+
+# Models load on a background thread started with the app, so uvicorn accepts
+# connections (/healthz, /readyz) right away; inference endpoints answer 503 until ready
+loader = EngineLoader(build_engine, WARMUP_BATCH_SIZES, started_at=PROCESS_START)
+loader.phases['imports'] = time.time() - PROCESS_START
+
+def ready_engine():
+    if not loader.ready:
+        raise HTTPException(status_code=503, detail=f"Models are {loader.state}", headers={'Retry-After': '5'})
+    return loader.engine
+
+# Per-class confidence thresholds and fusion settings from tune_thresholds.py
+# (0.5 for every class and class-agnostic NMS when there is no thresholds file)
+thresholds = load_thresholds(CLASS_NAMES, os.environ.get('ENSEMBLE_THRESHOLDS', THRESHOLDS_PATH))
+CLASS_CONF = thresholds['conf']
+# The models run at the lowest class threshold; each class is cut to its own after fusion
+CONF_THRESHOLD = float(CLASS_CONF.min())
+# Per-model NMS IoU the thresholds were tuned at
+NMS_IOU = float(os.environ.get('ENSEMBLE_NMS_IOU', thresholds['nms_iou']))
+
+# Merge overlapping boxes across the one-class models: nms | soft_nms | wbf | none.
+# Environment variables override the thresholds file.
+FUSION_METHOD = os.environ.get('ENSEMBLE_FUSION', thresholds['fusion'])
+FUSION_IOU = float(os.environ.get('ENSEMBLE_FUSION_IOU', thresholds['fusion_iou']))
+FUSION_AGNOSTIC = os.environ.get('ENSEMBLE_FUSION_AGNOSTIC', '1' if thresholds['agnostic'] else '0') == '1'
+print(f"🎚️ Confidence thresholds: {dict(zip(CLASS_NAMES, CLASS_CONF.tolist()))} "
+      f"({thresholds['source'] or 'default'}), model NMS @ IoU {NMS_IOU}, fusion {FUSION_METHOD} @ IoU {FUSION_IOU}")
+
+def predict_and_fuse(images):
+    """One (fused detections, per-model seconds of its batch) pair per image."""
+    engine = loader.engine
+    batch = engine.predict_batch(images, conf=CONF_THRESHOLD, iou=NMS_IOU)
+    # Read here, on the batcher's only thread, before the next batch overwrites them
+    timings = dict(engine.last_timings)
+    return [
+        (fuse_detections(dets, FUSION_METHOD, iou_thres=FUSION_IOU, agnostic=FUSION_AGNOSTIC).filter(CLASS_CONF), timings)
+        for dets in batch
+    ]
+
+# Micro-batching: concurrent /detect requests are grouped into one forward pass
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', '8'))
+BATCH_MAX_WAIT_MS = float(os.environ.get('BATCH_MAX_WAIT_MS', '10'))
+batcher = MicroBatcher(
+    predict_and_fuse,
+    max_batch_size=BATCH_MAX_SIZE,
+    max_wait_ms=BATCH_MAX_WAIT_MS,
+)
+
+# Result cache for byte-identical uploads (e.g. fixed station cameras).
+# RESULT_CACHE_DIR enables the on-disk tier that survives restarts.
+result_cache = ResultCache(
+    max_entries=int(os.environ.get('RESULT_CACHE_SIZE', '1024')),
+    disk_dir=os.environ.get('RESULT_CACHE_DIR') or None,
+)
+
+color_map = {
+    'FireExtinguisher': (0, 255, 0),
+    'ToolBox': (255, 0, 0),
+    'OxygenTank': (0, 0, 255)
+}
+
+@app.on_event('startup')
+async def start_batcher():
+    loader.start()
+    await batcher.start()
+
+@app.on_event('shutdown')
+async def stop_batcher():
+    await batcher.stop()
+
+# Annotated image encodings: format -> (extension, OpenCV quality flag)
+IMAGE_ENCODINGS = {
+    'png': ('.png', None),
+    'jpeg': ('.jpg', cv2.IMWRITE_JPEG_QUALITY),
+    'webp': ('.webp', cv2.IMWRITE_WEBP_QUALITY),
+}
+
+def check_image_format(image_format, quality):
+    if image_format not in IMAGE_ENCODINGS:
+        raise HTTPException(status_code=400, detail=f"image_format must be one of {list(IMAGE_ENCODINGS)}")
+    if not 1 <= quality <= 100:
+        raise HTTPException(status_code=400, detail='quality must be between 1 and 100')
+
+def encode_annotated(image, dets, image_format='png', quality=90):
+    draw_detections(image, dets, CLASS_NAMES, color_map)
+    ext, quality_flag = IMAGE_ENCODINGS[image_format]
+    params = [quality_flag, quality] if quality_flag is not None else []
+    _, buffer = cv2.imencode(ext, image, params)
+    return base64.b64encode(buffer).decode('utf-8')
+
+def pack_detections(dets):
+    """Base64 of little-endian float32 rows [x1, y1, x2, y2, conf, class_id]."""
+    packed = np.column_stack([dets.boxes, dets.scores, dets.class_ids]).astype('<f4')
+    return base64.b64encode(packed.tobytes()).decode('ascii')
+
+async def run_ensemble(contents, image):
+    """(detections, per-model seconds) for ``image`` (decoded from ``contents``).
+
+    Served from the cache when possible; a cache hit ran no model, so its timings are ``{}``.
+    """
+    key = cache_key(contents, ready_engine().fingerprint, conf=tuple(CLASS_CONF.tolist()), nms_iou=NMS_IOU,
+                    fusion=FUSION_METHOD, fusion_iou=FUSION_IOU, fusion_agnostic=FUSION_AGNOSTIC)
+    dets = await run_in_threadpool(result_cache.get, key)
+    if dets is not None:
+        return dets, {}
+    dets, timings = await batcher.submit(image)
+    await run_in_threadpool(result_cache.put, key, dets)
+    return dets, timings
+
+def summarize(dets):
+    all_detections = dets.to_dicts(CLASS_NAMES)
+    # Stats for charts
+    return {
+        'detections': all_detections,
+        'class_counts': dets.class_counts(CLASS_NAMES),
+        'confidences': [d['conf'] for d in all_detections],
+    }
 
 @app.post('/detect')
-async def detect(file: UploadFile = File(...)):
+async def detect(
+    file: UploadFile = File(...),
+    mode: str = 'full',
+    include_image: Optional[bool] = None,
+    image_format: str = 'png',
+    quality: int = 90,
+):
+    """Run the ensemble on one image.
+
+    ``mode=full`` (default) returns detection dicts plus the annotated image.
+    ``mode=compact`` returns only the image size, class names and the packed
+    detections (see ``pack_detections``) for the client to draw itself; the
+    annotated image is then only added with ``include_image=true``.
+    """
+    if mode not in ('full', 'compact'):
+        raise HTTPException(status_code=400, detail="mode must be 'full' or 'compact'")
+    check_image_format(image_format, quality)
+    if include_image is None:
+        include_image = mode == 'full'
     contents = await file.read()
-    nparr = np.frombuffer(contents, np.uint8)
-    image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    all_detections = []
-    color_map = {
-        'FireExtinguisher': (0, 255, 0),
-        'ToolBox': (255, 0, 0),
-        'OxygenTank': (0, 0, 255)
+    image = await run_in_threadpool(decode_image, contents)
+    if image is None:
+        raise HTTPException(status_code=400, detail='Could not decode image')
+    dets, timings = await run_ensemble(contents, image)
+    if mode == 'compact':
+        payload = {
+            'width': image.shape[1],
+            'height': image.shape[0],
+            'classes': CLASS_NAMES,
+            'boxes': pack_detections(dets),
+        }
+    else:
+        payload = summarize(dets)
+    if include_image:
+        # Encode processed image to base64
+        payload['image'] = await run_in_threadpool(encode_annotated, image, dets, image_format, quality)
+        payload['image_format'] = image_format
+    payload['model_times'] = timings
+    return JSONResponse(payload)
+
+# --- Bulk detection ---
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+async def collect_batch_inputs(files, archive):
+    """Return [(filename, read_bytes)] where read_bytes is a blocking zero-arg callable."""
+    inputs = []
+    for f in files:
+        data = await f.read()
+        inputs.append((f.filename, lambda data=data: data))
+    if archive is not None:
+        zf = zipfile.ZipFile(io.BytesIO(await archive.read()))
+        for info in zf.infolist():
+            if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS):
+                inputs.append((info.filename, lambda name=info.filename: zf.read(name)))
+    return inputs
+
+async def detect_one(index, filename, read_bytes, include_image, image_format, quality):
+    record = {'index': index, 'filename': filename}
+    contents = await run_in_threadpool(read_bytes)
+    image = await run_in_threadpool(decode_image, contents)
+    if image is None:
+        record['error'] = 'Could not decode image'
+        return record
+    dets, _ = await run_ensemble(contents, image)
+    record.update(summarize(dets))
+    if include_image:
+        record['image'] = await run_in_threadpool(encode_annotated, image, dets, image_format, quality)
+        record['image_format'] = image_format
+    return record
+
+@app.post('/detect/batch')
+async def detect_batch(
+    files: List[UploadFile] = File(default=[]),
+    archive: Optional[UploadFile] = File(default=None),
+    include_image: bool = False,
+    image_format: str = 'jpeg',
+    quality: int = 85,
+):
+    """Detect on many images (multipart ``files`` and/or a zip ``archive``).
+
+    Streams one NDJSON line per image in completion order; ``index`` is the
+    image's position in the upload. Annotated images are only included when
+    ``include_image=true``.
+    """
+    check_image_format(image_format, quality)
+    ready_engine()
+    try:
+        inputs = await collect_batch_inputs(files, archive)
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail='archive is not a valid zip file')
+    if not inputs:
+        raise HTTPException(status_code=400, detail='No images uploaded')
+
+    async def stream():
+        # Bound in-flight images so a large sweep doesn't decode everything at once
+        in_flight = asyncio.Semaphore(BATCH_MAX_SIZE * 2)
+
+        async def bounded(index, filename, read_bytes):
+            async with in_flight:
+                return await detect_one(index, filename, read_bytes, include_image, image_format, quality)
+
+        tasks = [asyncio.create_task(bounded(i, name, read)) for i, (name, read) in enumerate(inputs)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield json.dumps(await next_done) + '\n'
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream(), media_type='application/x-ndjson')
+
+@app.get('/cache/stats')
+async def cache_stats():
+    return result_cache.stats()
+
+@app.get('/cascade/stats')
+async def cascade_stats():
+    cascade = getattr(app.state, 'cascade', None)
+    return {'enabled': CASCADE, **(cascade.stats.snapshot() if cascade is not None else {})}
+
+def process_memory(pid=None):
+    """RSS, PSS and USS of a process in MB. PSS splits each shared page across the processes mapping it."""
+    process = psutil.Process(pid)
+    info = process.memory_full_info()
+    return {
+        'pid': process.pid,
+        'rss_mb': info.rss / 2 ** 20,
+        'pss_mb': getattr(info, 'pss', info.rss) / 2 ** 20,  # Linux only
+        'uss_mb': info.uss / 2 ** 20,
     }
-    for cls, model in models.items():
-        results = model(image)
-        for r in results:
-            if r.boxes is not None:
-                boxes = r.boxes.xyxy.cpu().numpy()
-                confs = r.boxes.conf.cpu().numpy()
-                for box, conf in zip(boxes, confs):
-                    if float(conf) > 0.5:
-                        all_detections.append({
-                            'class': cls,
-                            'conf': float(conf),
-                            'box': [float(x) for x in box]
-                        })
-                        # Draw box
-                        x1, y1, x2, y2 = map(int, box)
-                        label = f"{cls} {conf:.2f}"
-                        color = color_map.get(cls, (255, 255, 0))
-                        cv2.rectangle(image, (x1, y1), (x2, y2), color, 2)
-                        cv2.putText(image, label, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, color, 2)
-    # Encode processed image to base64
-    _, buffer = cv2.imencode('.png', image)
-    img_str = base64.b64encode(buffer).decode('utf-8')
-    # Stats for charts
-    class_counts = {cls: sum(1 for d in all_detections if d['class'] == cls) for cls in models.keys()}
-    confs = [d['conf'] for d in all_detections]
-    return JSONResponse({
-        'detections': all_detections,
-        'image': img_str,
-        'class_counts': class_counts,
-        'confidences': confs
-    }) 
\ No newline at end of file
+
+@app.get('/memory')
+async def memory():
+    """This worker's memory; under prefork.py the shared model weights count towards PSS, not USS."""
+    return process_memory()
+
+@app.get('/healthz')
+async def healthz():
+    """Liveness: the process is up. Fails only when model loading failed, so the pod gets restarted."""
+    status = loader.status()
+    return JSONResponse(status, status_code=500 if status['state'] == 'failed' else 200)
+
+@app.get('/readyz')
+async def readyz():
+    """Readiness: models loaded and warmed up. Carries the startup timing per phase."""
+    return JSONResponse({'ready': loader.ready, **loader.status()}, status_code=200 if loader.ready else 503)
+
+# --- Video / camera streaming ---
+# Clients may only open configured sources: STREAM_SOURCES="cam0=0,dock=rtsp://..."
+# names live cameras, and any video file inside STREAM_VIDEO_DIR can be replayed.
+STREAM_SOURCES = dict(
+    item.split('=', 1) for item in os.environ.get('STREAM_SOURCES', '').split(',') if '=' in item
+)
+STREAM_VIDEO_DIR = os.path.abspath(os.environ.get('STREAM_VIDEO_DIR', 'videos'))
+
+def resolve_stream_source(name):
+    if name in STREAM_SOURCES:
+        return STREAM_SOURCES[name]
+    path = os.path.abspath(os.path.join(STREAM_VIDEO_DIR, name))
+    if os.path.commonpath([path, STREAM_VIDEO_DIR]) == STREAM_VIDEO_DIR and os.path.isfile(path):
+        return path
+    return None
+
+@app.websocket('/ws/stream')
+async def stream_detect(websocket: WebSocket, source: str, include_image: bool = False, jpeg_quality: int = 70,
+                        detect_every: int = 0):
+    """Push per-frame detections for a video file or camera over a WebSocket.
+
+    One JSON message per processed frame; stale frames are dropped under load
+    (the ``dropped`` counter says how many). A final ``{'done': true, ...}``
+    message carries the pipeline stats. With ``detect_every=N`` the models run
+    at most every N frames, a tracker fills the rest and detections carry a
+    ``track_id``.
+    """
+    await websocket.accept()
+    if not loader.ready:
+        await websocket.close(code=1013, reason=f"Models are {loader.state}")
+        return
+    resolved = resolve_stream_source(source)
+    if resolved is None:
+        await websocket.close(code=1008, reason='Unknown stream source')
+        return
+    loop = asyncio.get_running_loop()
+
+    def detect_frame(image):
+        # Runs on the pipeline's inference thread; frames share the micro-batcher with /detect
+        return asyncio.run_coroutine_threadsafe(batcher.submit(image), loop).result()[0]
+
+    pipeline = VideoPipeline(
+        resolved,
+        detect_frame,
+        CLASS_NAMES,
+        output='jpeg' if include_image else None,
+        jpeg_quality=jpeg_quality,
+        color_map=color_map,
+        detect_every=detect_every or None,
+    )
+    try:
+        await run_in_threadpool(pipeline.start)
+    except IOError as exc:
+        await websocket.close(code=1011, reason=str(exc))
+        return
+    try:
+        while True:
+            result = await run_in_threadpool(pipeline.get)
+            if result is None:
+                break
+            await websocket.send_json(result)
+        await websocket.send_json({'done': True, 'error': str(pipeline.error) if pipeline.error else None, **pipeline.stats()})
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await run_in_threadpool(pipeline.stop)
@@ -0,0 +1,158 @@
+"""Pre-forking server: load the models once, then fork the uvicorn workers.
+
+``uvicorn main:app --workers N`` starts N fresh interpreters, and each one
+loads its own copy of every model. Here the parent imports ``main`` and builds
+the engine once (``EngineLoader.preload``). ``ensemble.share_weights`` then
+fuses the PyTorch models and moves their weights into shared memory. Only
+after that does the parent bind the port and fork the workers, which all accept
+on the same socket. Each worker maps the parent's weight pages, warms up on
+its own and turns ready at ``/readyz``.
+
+No inference runs in the parent, since torch's thread pools do not survive a
+fork, and neither does CUDA. The parent never touches it: the engine picks its
+device on first use, which happens in each worker. On a GPU each worker then
+moves its models to the device, and only the disk load is saved. Exported
+models (``ENSEMBLE_BACKEND=onnx...``) are loaded per worker, as with
+``uvicorn --workers``.
+
+The parent restarts workers that die and logs RSS / PSS / USS per process
+every ``--report-every`` seconds. PSS splits each shared page between the
+processes mapping it, so the PSS column sums to the real total. ``GET /memory``
+on a worker returns its own numbers. ``--no-share`` forks the same way, but
+every worker loads its own models, so the saving can be measured.
+
+Usage:
+    python prefork.py --workers 4 --port 8000
+    python prefork.py --workers 4 --no-share      # baseline: one copy of the weights per worker
+"""
+import argparse
+import os
+import signal
+import socket
+import time
+import traceback
+
+import psutil
+import uvicorn
+
+# Should anything in the parent still ask torch.cuda.is_available(), answer through NVML
+# instead of initialising the CUDA driver, which forked workers could then not use
+os.environ.setdefault('PYTORCH_NVML_BASED_CUDA_CHECK', '1')
+
+import main  # noqa: E402
+from ensemble import available_cores  # noqa: E402
+
+
+def bind_socket(host, port):
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    return sock
+
+
+def preload_shared():
+    """Build the engine in the parent and share its weights. Returns the shared bytes (0: not shared)."""
+    if main.INFERENCE_BACKEND != 'torch':
+        print(f"⚠️  {main.INFERENCE_BACKEND} models can't be shared; every worker loads its own")
+        return 0
+    engine = main.loader.preload(shared=True)
+    import torch
+    if torch.cuda.is_initialized():
+        raise RuntimeError("CUDA was initialised while loading the models; forked workers could not use it")
+    print(f"📦 Loaded {', '.join(engine.models)} once, {main.loader.shared_bytes / 2 ** 20:.1f} MB of weights shared "
+          f"({', '.join(f'{k} {v:.2f}s' for k, v in main.loader.phases.items())})")
+    return main.loader.shared_bytes
+
+
+def run_worker(sock, threads, log_level):
+    if threads:
+        import torch
+        torch.set_num_threads(threads)
+        # Inference runs in the micro-batcher's thread, and ultralytics resets torch's
+        # thread count during the warm-up; the engine re-applies this around every pass
+        main.loader.threads = threads
+    config = uvicorn.Config(main.app, log_level=log_level)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def fork_worker(sock, threads, log_level):
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            run_worker(sock, threads, log_level)
+            code = 0
+        except Exception:
+            traceback.print_exc()
+        finally:
+            os._exit(code)  # never fall back into the parent's loop
+    return pid
+
+
+def print_memory(parent, workers):
+    rows = [('parent', main.process_memory(parent))]
+    for pid in workers:
+        try:
+            rows.append(('worker', main.process_memory(pid)))
+        except psutil.Error:
+            pass  # exited between the listing and the read
+    print(f"\n{'process':<8} {'pid':>7} {'RSS MB':>8} {'PSS MB':>8} {'USS MB':>8}")
+    for role, m in rows:
+        print(f"{role:<8} {m['pid']:>7} {m['rss_mb']:>8.0f} {m['pss_mb']:>8.0f} {m['uss_mb']:>8.0f}")
+    print(f"{'total':<8} {'':>7} {sum(m['rss_mb'] for _, m in rows):>8.0f} "
+          f"{sum(m['pss_mb'] for _, m in rows):>8.0f} {sum(m['uss_mb'] for _, m in rows):>8.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the backend from workers forked after the models are loaded.")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=None,
+                        help="torch threads per worker (default: usable cores / workers)")
+    parser.add_argument('--no-share', action='store_true', help="every worker loads its own models")
+    parser.add_argument('--report-every', type=float, default=60, help="seconds between memory reports (0: never)")
+    parser.add_argument('--log-level', default='info')
+    args = parser.parse_args()
+
+    threads = args.threads or max(1, len(available_cores()) // args.workers)
+    if not args.no_share:
+        preload_shared()
+    sock = bind_socket(args.host, args.port)
+    print(f"🚀 Forking {args.workers} workers on {args.host}:{args.port}, {threads} torch threads each")
+
+    stopping = False
+
+    def stop(signum, frame):
+        global stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    workers = {fork_worker(sock, threads, args.log_level) for _ in range(args.workers)}
+    parent = os.getpid()
+    next_report = time.monotonic() + min(args.report_every, 15) if args.report_every else None
+
+    while workers:
+        if stopping:
+            for pid in workers:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+            for pid in list(workers):
+                os.waitpid(pid, 0)
+                workers.discard(pid)
+            break
+        pid, status = os.waitpid(-1, os.WNOHANG)
+        if pid in workers:
+            workers.discard(pid)
+            print(f"⚠️  Worker {pid} exited with {os.waitstatus_to_exitcode(status)}, restarting")
+            workers.add(fork_worker(sock, threads, args.log_level))
+        if next_report is not None and time.monotonic() >= next_report:
+            print_memory(parent, workers)
+            next_report = time.monotonic() + args.report_every
+        time.sleep(0.5)
+    sock.close()
+    print("👋 All workers stopped.")
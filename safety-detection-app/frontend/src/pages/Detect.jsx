@@ -20,6 +20,52 @@ function getNowString() {
   return now.toLocaleString();
 }
 
+// Same colors the backend uses for annotated images (BGR there, RGB here)
+const BOX_COLORS = { FireExtinguisher: "#00ff00", ToolBox: "#0000ff", OxygenTank: "#ff0000" };
+
+// Decode the compact /detect response: base64 little-endian float32 rows
+// [x1, y1, x2, y2, conf, class_id] -> [{ class, conf, box }]
+function unpackDetections(data) {
+  const bytes = Uint8Array.from(atob(data.boxes), (c) => c.charCodeAt(0));
+  const view = new DataView(bytes.buffer);
+  const detections = [];
+  for (let offset = 0; offset < bytes.length; offset += 24) {
+    const row = Array.from({ length: 6 }, (_, i) => view.getFloat32(offset + i * 4, true));
+    detections.push({ class: data.classes[row[5]], conf: row[4], box: row.slice(0, 4) });
+  }
+  return detections;
+}
+
+// Draw the detections over the input image on a canvas and return a PNG data URL
+function renderDetections(src, detections, width, height) {
+  return new Promise((resolve, reject) => {
+    const img = new Image();
+    img.onload = () => {
+      const canvas = document.createElement("canvas");
+      canvas.width = img.naturalWidth;
+      canvas.height = img.naturalHeight;
+      const ctx = canvas.getContext("2d");
+      ctx.drawImage(img, 0, 0);
+      const sx = img.naturalWidth / (width || img.naturalWidth);
+      const sy = img.naturalHeight / (height || img.naturalHeight);
+      const lineWidth = Math.max(2, Math.round(canvas.width / 400));
+      ctx.lineWidth = lineWidth;
+      ctx.font = `${lineWidth * 8}px sans-serif`;
+      for (const det of detections) {
+        const [x1, y1, x2, y2] = det.box;
+        const color = BOX_COLORS[det.class] || "#ffff00";
+        ctx.strokeStyle = color;
+        ctx.fillStyle = color;
+        ctx.strokeRect(x1 * sx, y1 * sy, (x2 - x1) * sx, (y2 - y1) * sy);
+        ctx.fillText(`${det.class} ${det.conf.toFixed(2)}`, x1 * sx, Math.max(lineWidth * 8, y1 * sy - lineWidth * 4));
+      }
+      resolve(canvas.toDataURL("image/png"));
+    };
+    img.onerror = reject;
+    img.src = src;
+  });
+}
+
 function fileToBase64(file) {
   return new Promise((resolve, reject) => {
     const reader = new FileReader();
@@ -58,18 +104,23 @@ export default function Detect({ theme }) {
     try {
       const formData = new FormData();
       formData.append("file", file);
-      const res = await axios.post("http://localhost:8000/detect", formData, { responseType: "json" });
-      setResult(res.data);
+      // Compact mode: the backend only returns detections, boxes are drawn here
+      const res = await axios.post("http://localhost:8000/detect?mode=compact", formData, { responseType: "json" });
+      const detections = unpackDetections(res.data);
+      const class_counts = Object.fromEntries(res.data.classes.map((cls) => [cls, detections.filter((d) => d.class === cls).length]));
+      const confidences = detections.map((d) => d.conf);
+      const annotatedUrl = await renderDetections(fileUrl, detections, res.data.width, res.data.height);
+      setResult({ ...res.data, detections, class_counts, confidences, annotatedUrl });
       setError("");
       // Only add metadata to history (no images), but pass previews for session cache
       addDetection({
         id: Date.now(),
-        detections: res.data.detections,
-        class_counts: res.data.class_counts,
-        confidences: res.data.confidences,
+        detections,
+        class_counts,
+        confidences,
         date: getNowString(),
         filename: file.name
-      }, fileUrl, `data:image/png;base64,${res.data.image}`);
+      }, fileUrl, annotatedUrl);
     } catch (err) {
       if (!result) setError("Detection failed. Please check your backend connection.");
     } finally {
@@ -78,9 +129,9 @@ export default function Detect({ theme }) {
   };
 
   const handleDownloadImage = () => {
-    if (!result?.image) return;
+    if (!result?.annotatedUrl) return;
     const link = document.createElement("a");
-    link.href = `data:image/png;base64,${result.image}`;
+    link.href = result.annotatedUrl;
     link.download = "detection_result.png";
     link.click();
   };
@@ -147,8 +198,8 @@ export default function Detect({ theme }) {
           </div>
           <div className="bg-white/10 backdrop-blur-md border border-[#2E236C]/30 rounded-2xl p-6 shadow-lg flex flex-col items-center justify-center w-full min-h-[300px]">
             <div className="text-white/70 mb-2">Output Preview</div>
-            {result?.image ? (
-              <img src={`data:image/png;base64,${result.image}`} alt="Detection Result" className="rounded-xl border-2 border-[#2E236C] shadow-xl max-w-full mb-2" style={{ background: "#18181b", maxHeight: 220 }} />
+            {result?.annotatedUrl ? (
+              <img src={result.annotatedUrl} alt="Detection Result" className="rounded-xl border-2 border-[#2E236C] shadow-xl max-w-full mb-2" style={{ background: "#18181b", maxHeight: 220 }} />
             ) : (
               <div className="w-full h-48 bg-black/30 rounded-lg flex items-center justify-center text-white/40">No output image</div>
             )}
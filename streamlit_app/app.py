@@ -1,14 +1,20 @@
 import streamlit as st
-from PIL import Image
+import io
 import os
+import sys
 import time
-import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 import cv2
-import torch
-from ultralytics import YOLO
-import matplotlib.pyplot as plt
 import pandas as pd
 
+# Shared ensemble engine lives at the repository root
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from ensemble import EngineLoader, EnsembleEngine, backend_model_paths, decode_image, draw_detections, load_thresholds  # noqa: E402
+from result_cache import ResultCache, cache_key  # noqa: E402
+from fusion import fuse_detections  # noqa: E402
+from cascade import FAST_MODEL_PATH, CascadeEngine  # noqa: E402
+from tiling import TiledEngine  # noqa: E402
+
 st.set_page_config(page_title="Safety Equipment Ensemble Detection", layout="wide")
 
 # --- VANTA.JS 3D NETWORK BACKGROUND (using three.js) ---
@@ -113,20 +119,44 @@ COLOR_MAP = {
 }
 DATA_COLLECTION_DIR = "data_collection"
 OUTPUT_DIR = "output"
-CONF_THRESHOLD = 0.5
+RESULT_CACHE_DIR = "result_cache"  # on-disk tier of the result cache, survives restarts
+# Per-class confidence thresholds + fusion (nms | soft_nms | wbf | none) from tune_thresholds.py
+THRESHOLDS = load_thresholds(list(MODEL_PATHS))
+CLASS_CONF = THRESHOLDS['conf']
+FUSION_METHOD = THRESHOLDS['fusion']
+FUSION_IOU = THRESHOLDS['fusion_iou']
+NMS_IOU = THRESHOLDS['nms_iou']  # per-model NMS IoU the thresholds were tuned at
+# torch | onnx | onnx-int8 | openvino | openvino-int8 (exported with export_models.py)
+INFERENCE_BACKEND = os.environ.get('ENSEMBLE_BACKEND', 'torch')
+# ENSEMBLE_CASCADE=1: multiclass5 first, the one-class models only where it is unsure (cascade.py)
+CASCADE = os.environ.get('ENSEMBLE_CASCADE', '0') == '1'
+# ENSEMBLE_TILING=1: frames above 1920 px are run as overlapping 640 px tiles (tiling.py)
+TILING = os.environ.get('ENSEMBLE_TILING', '0') == '1'
 
 os.makedirs(DATA_COLLECTION_DIR, exist_ok=True)
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
 # --- LOAD MODELS ---
+def build_engine():
+    engine = EnsembleEngine(backend_model_paths(MODEL_PATHS, INFERENCE_BACKEND))
+    if CASCADE:
+        engine = CascadeEngine(engine, backend_model_paths({'cascade': FAST_MODEL_PATH}, INFERENCE_BACKEND)['cascade'])
+    if TILING:
+        engine = TiledEngine(engine)
+    return engine
+
+@st.cache_resource
+def load_engine():
+    # Loads + warms up in the background while the page renders; detection waits for it
+    return EngineLoader(build_engine).start()
+
+engine_loader = load_engine()
+
 @st.cache_resource
-def load_models():
-    models = {}
-    for cls, path in MODEL_PATHS.items():
-        models[cls] = YOLO(path)
-    return models
+def load_result_cache():
+    return ResultCache(max_entries=256, disk_dir=RESULT_CACHE_DIR)
 
-models = load_models()
+result_cache = load_result_cache()
 
 # --- SIDEBAR INFO ---
 st.sidebar.header("Project Info")
@@ -136,54 +166,115 @@ st.sidebar.markdown("""
 - **mAP@50:** FireExtinguisher 98.7%, ToolBox 99.4%, OxygenTank 99.5%
 - **Hardware:** RTX 3050 4GB VRAM
 """)
+st.sidebar.caption(f"Models: {engine_loader.state}")
+
+# --- BACKGROUND ARCHIVING ---
+@st.cache_resource
+def archive_executor():
+    # Uploads and outputs are archived off the script thread so reruns never wait on disk
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="archive")
+
+def archive_files(file_name, image_bytes, annotated_bytes):
+    with open(os.path.join(DATA_COLLECTION_DIR, file_name), "wb") as f:
+        f.write(image_bytes)
+    with open(os.path.join(OUTPUT_DIR, f"ensemble_{file_name}"), "wb") as f:
+        f.write(annotated_bytes)
+
+# --- CACHED DETECTION PIPELINE ---
+@st.cache_data(show_spinner="Running ensemble detection...", max_entries=64)
+def detect_upload(image_bytes, ext):
+    """Decode once in memory, run the ensemble and encode the annotated image (memoized per upload)."""
+    start_time = time.time()
+    engine = engine_loader.wait()
+    image = decode_image(image_bytes)
+    key = cache_key(image_bytes, engine.fingerprint, conf=tuple(CLASS_CONF.tolist()), nms_iou=NMS_IOU, fusion=FUSION_METHOD,
+                    fusion_iou=FUSION_IOU, fusion_agnostic=THRESHOLDS['agnostic'])
+    dets = result_cache.get(key)
+    cached = dets is not None
+    if not cached:
+        # Run at the lowest class threshold, then cut each class to its own after fusion
+        dets = engine.predict(image, conf=float(CLASS_CONF.min()), iou=NMS_IOU)
+        dets = fuse_detections(dets, FUSION_METHOD, iou_thres=FUSION_IOU, agnostic=THRESHOLDS['agnostic'])
+        dets = dets.filter(CLASS_CONF)
+        result_cache.put(key, dets)
+    inf_time = time.time() - start_time
+    # --- DRAW RESULTS ---
+    result_img = draw_detections(image, dets, engine.class_names, COLOR_MAP)
+    _, buffer = cv2.imencode(ext, result_img)
+    return {
+        'detections': dets.to_dicts(engine.class_names),
+        'inf_time': inf_time,
+        'cached': cached,
+        'annotated': buffer.tobytes(),
+    }
+
+def style_axes(ax):
+    ax.spines['bottom'].set_color('#ff003c')
+    ax.spines['left'].set_color('#ff003c')
+    ax.tick_params(axis='x', colors='#ff003c')
+    ax.tick_params(axis='y', colors='#ff003c')
+
+def figure_to_png(fig):
+    import matplotlib.pyplot as plt
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", dpi=200, bbox_inches="tight")
+    plt.close(fig)
+    return buf.getvalue()
+
+@st.cache_data(max_entries=64)
+def render_stat_figures(confidences, class_counts):
+    """Confidence histogram and class pie chart as PNG bytes, rendered once per result."""
+    import matplotlib.pyplot as plt  # deferred: only needed once there are detections to plot
+    fig, ax = plt.subplots(figsize=(4, 2))
+    ax.hist(confidences, bins=10, color='#ff003c')
+    ax.set_xlabel("Confidence")
+    ax.set_ylabel("Count")
+    ax.set_title("Detection Confidence Histogram")
+    style_axes(ax)
+    hist_png = figure_to_png(fig)
+
+    fig, ax = plt.subplots(figsize=(4, 2))
+    labels, counts = zip(*class_counts)
+    ax.pie(counts, labels=labels, autopct='%1.1f%%', startangle=140, colors=['#ff003c', '#232326', '#b30021'])
+    ax.axis('equal')
+    pie_png = figure_to_png(fig)
+    return hist_png, pie_png
+
+@st.cache_data
+def render_map_chart():
+    import matplotlib.pyplot as plt
+    map_scores = {"FireExtinguisher": 98.7, "ToolBox": 99.4, "OxygenTank": 99.5}
+    fig, ax = plt.subplots(figsize=(4, 2))
+    ax.bar(map_scores.keys(), map_scores.values(), color=['#ff003c', '#232326', '#b30021'])
+    ax.set_ylabel("mAP@50 (%)")
+    ax.set_ylim(95, 100)
+    style_axes(ax)
+    return figure_to_png(fig)
 
 # --- IMAGE UPLOAD ---
 uploaded_file = st.file_uploader("Upload an image for detection", type=["jpg", "jpeg", "png"])
 if uploaded_file:
-    # Save uploaded image
-    img_path = os.path.join(DATA_COLLECTION_DIR, uploaded_file.name)
-    with open(img_path, "wb") as f:
-        f.write(uploaded_file.getbuffer())
-    image = cv2.imdecode(np.frombuffer(uploaded_file.read(), np.uint8), cv2.IMREAD_COLOR)
-    st.image(Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB)), caption="Uploaded Image", use_column_width=True)
+    image_bytes = uploaded_file.getvalue()
+    ext = os.path.splitext(uploaded_file.name)[1].lower() or ".png"
+    st.image(image_bytes, caption="Uploaded Image", use_column_width=True)
 
     # --- RUN ENSEMBLE DETECTION ---
     st.subheader("Detection Results (Ensemble)")
-    start_time = time.time()
-    all_detections = []
-    for cls, model in models.items():
-        results = model(img_path)
-        for r in results:
-            if r.boxes is not None:
-                boxes = r.boxes.xyxy.cpu().numpy()
-                confs = r.boxes.conf.cpu().numpy()
-                for box, conf in zip(boxes, confs):
-                    if float(conf) > CONF_THRESHOLD:
-                        det = {
-                            'class': cls,
-                            'conf': float(conf),
-                            'box': [float(x) for x in box]
-                        }
-                        all_detections.append(det)
-    end_time = time.time()
-    inf_time = end_time - start_time
+    result = detect_upload(image_bytes, ext)
+    all_detections = result['detections']
 
-    # --- DRAW RESULTS ---
-    result_img = image.copy()
-    for det in all_detections:
-        x1, y1, x2, y2 = map(int, det['box'])
-        label = f"{det['class']} {det['conf']:.2f}"
-        color = COLOR_MAP.get(det['class'], (255, 255, 0))
-        cv2.rectangle(result_img, (x1, y1), (x2, y2), color, 2)
-        cv2.putText(result_img, label, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, color, 2)
-
-    out_img_path = os.path.join(OUTPUT_DIR, f"ensemble_{uploaded_file.name}")
-    cv2.imwrite(out_img_path, result_img)
-    st.image(Image.fromarray(cv2.cvtColor(result_img, cv2.COLOR_BGR2RGB)), caption="Ensemble Detection Output", use_column_width=True)
+    # Archive upload + output once per upload, in the background
+    archived = st.session_state.setdefault("archived_uploads", set())
+    archive_id = getattr(uploaded_file, "file_id", uploaded_file.name)
+    if archive_id not in archived:
+        archived.add(archive_id)
+        archive_executor().submit(archive_files, uploaded_file.name, image_bytes, result['annotated'])
+
+    st.image(result['annotated'], caption="Ensemble Detection Output", use_column_width=True)
 
     # --- SHOW DETECTIONS TABLE ---
+    df = pd.DataFrame(all_detections)
     if all_detections:
-        df = pd.DataFrame(all_detections)
         st.dataframe(df)
     else:
         st.info("No objects detected.")
@@ -191,53 +282,33 @@ if uploaded_file:
     # --- STATS & GRAPHS ---
     st.subheader("Detection Statistics & Graphs")
     if all_detections:
-        df = pd.DataFrame(all_detections)
         # 1. Bar chart: Class counts
         class_counts = df["class"].value_counts()
         st.bar_chart(class_counts)
+        hist_png, pie_png = render_stat_figures(
+            tuple(df["conf"].tolist()),
+            tuple(class_counts.items()),
+        )
 
         # 2. Histogram: Confidence distribution
         st.write("Confidence Distribution")
-        plt.figure(figsize=(4,2))
-        plt.hist(df["conf"], bins=10, color='#ff003c')
-        plt.xlabel("Confidence")
-        plt.ylabel("Count")
-        plt.title("Detection Confidence Histogram")
-        plt.gca().spines['bottom'].set_color('#ff003c')
-        plt.gca().spines['left'].set_color('#ff003c')
-        plt.gca().tick_params(axis='x', colors='#ff003c')
-        plt.gca().tick_params(axis='y', colors='#ff003c')
-        st.pyplot(plt.gcf())
-        plt.clf()
+        st.image(hist_png, use_column_width=True)
 
         # 3. Pie chart: Class proportions
         st.write("Class Proportions")
-        plt.pie(class_counts, labels=class_counts.index, autopct='%1.1f%%', startangle=140, colors=['#ff003c', '#232326', '#b30021'])
-        plt.axis('equal')
-        st.pyplot(plt.gcf())
-        plt.clf()
+        st.image(pie_png, use_column_width=True)
 
         # 4. Inference time
-        st.metric("Inference Time (s)", f"{inf_time:.3f}")
+        st.metric("Inference Time (s)", f"{result['inf_time']:.3f}", delta="cached result" if result['cached'] else None, delta_color="off")
 
         # 5. Static mAP/accuracy chart
         st.write("Model mAP@50 (Static)")
-        map_scores = {"FireExtinguisher": 98.7, "ToolBox": 99.4, "OxygenTank": 99.5}
-        plt.bar(map_scores.keys(), map_scores.values(), color=['#ff003c', '#232326', '#b30021'])
-        plt.ylabel("mAP@50 (%)")
-        plt.ylim(95, 100)
-        plt.gca().spines['bottom'].set_color('#ff003c')
-        plt.gca().spines['left'].set_color('#ff003c')
-        plt.gca().tick_params(axis='x', colors='#ff003c')
-        plt.gca().tick_params(axis='y', colors='#ff003c')
-        st.pyplot(plt.gcf())
-        plt.clf()
+        st.image(render_map_chart(), use_column_width=True)
     else:
         st.info("No statistics to display.")
 
     # --- DOWNLOAD OUTPUT ---
-    with open(out_img_path, "rb") as f:
-        st.download_button("Download Labeled Image", f, file_name=f"ensemble_{uploaded_file.name}")
+    st.download_button("Download Labeled Image", result['annotated'], file_name=f"ensemble_{uploaded_file.name}")
 
 # --- FOOTER ---
 st.markdown("---")
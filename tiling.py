@@ -0,0 +1,201 @@
+"""Sliced (tiled) inference for high-resolution frames.
+
+At ``imgsz=640`` a 3840x2160 module-wide shot is shrunk six times, and a
+toolbox across the module ends up a few pixels wide. ``TiledEngine`` wraps
+any engine with ``predict_batch`` (EnsembleEngine, CascadeEngine). Frames whose
+long side exceeds ``min_side`` are cut into overlapping ``tile_size`` tiles at
+native resolution:
+
+- The tiles of every frame in the call, plus each frame's full downscaled view
+  for objects larger than a tile (``full_frame``), go through the wrapped engine
+  in chunks of ``batch_size``. Each chunk is one forward pass per model.
+- Tile boxes are shifted back to frame coordinates. Boxes cut off by an inner
+  tile edge are dropped, since the overlap or the full-frame pass sees those
+  objects whole. The rest are merged with class-aware NMS at ``merge_iou``, so
+  an object seen by several overlapping tiles is reported once.
+
+Smaller frames go through the wrapped engine unchanged. ``python tiling.py``
+times a set of tile sizes on test images upscaled to 4K and reports how
+latency scales with the tile count.
+
+Usage:
+    python tiling.py                                  # data/test images at 3840 px
+    python tiling.py --source frame.png --tile-sizes 640 960 1280 --overlap 0.25 --batch 16
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import time
+
+import cv2
+
+from ensemble import MODEL_PATHS, ROOT_DIR, EnsembleEngine, concat_detections, crop_to_frame
+from fusion import fuse_detections
+
+TILE_SIZE = 640
+TILE_OVERLAP = 0.2   # fraction of the tile shared with each neighbour
+TILE_BATCH = 8       # tiles per forward pass
+TILE_MIN_SIDE = 1920  # frames whose long side is at most this are not tiled
+MERGE_IOU = 0.5
+TEST_IMG_DIR = 'data/test/images'
+REPORT_PATH = os.path.join(ROOT_DIR, 'runs', 'detect', 'tiling_report.json')
+
+
+def tile_starts(length, tile, stride):
+    """Start offsets covering ``length`` with ``tile``-sized windows; the last one ends on the edge."""
+    if length <= tile:
+        return [0]
+    starts = list(range(0, length - tile, stride))
+    return starts + [length - tile]
+
+
+def tile_grid(shape, tile_size=TILE_SIZE, overlap=TILE_OVERLAP):
+    """(x1, y1, x2, y2) of every tile of an image of ``shape``, row by row."""
+    h, w = shape
+    stride = max(1, int(round(tile_size * (1 - overlap))))
+    return [(x, y, min(x + tile_size, w), min(y + tile_size, h))
+            for y in tile_starts(h, tile_size, stride) for x in tile_starts(w, tile_size, stride)]
+
+
+class TiledEngine:
+    """Runs large frames through ``engine`` as batched, overlapping tiles (plus the full frame)."""
+
+    def __init__(self, engine, tile_size=TILE_SIZE, overlap=TILE_OVERLAP, batch_size=TILE_BATCH,
+                 min_side=TILE_MIN_SIDE, full_frame=True, merge_iou=MERGE_IOU):
+        if not 0 <= overlap < 1:
+            raise ValueError(f"overlap must be in [0, 1), got {overlap}")
+        self.engine = engine
+        self.class_names = engine.class_names
+        self.models = engine.models
+        self.imgsz = engine.imgsz
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.batch_size = batch_size
+        self.min_side = min_side
+        self.full_frame = full_frame
+        self.merge_iou = merge_iou
+        self.fingerprint = hashlib.sha256(
+            f"{engine.fingerprint}:tiles={tile_size},{overlap},{min_side},{full_frame},{merge_iou}".encode()).hexdigest()
+        self.last_timings = {}
+        self.last_tiles = 0
+
+    @property
+    def device(self):
+        return self.engine.device
+
+    @property
+    def num_threads(self):
+        return self.engine.num_threads
+
+    @num_threads.setter
+    def num_threads(self, value):
+        self.engine.num_threads = value
+
+    def close(self):
+        self.engine.close()
+
+    def predict_batch(self, images, conf=0.25, iou=0.7):
+        """Detect on a list of BGR images; returns one Detections per image."""
+        if not images:
+            return []
+        inputs, owners = [], []
+        for i, image in enumerate(images):
+            shape = image.shape[:2]
+            tiled = max(shape) > self.min_side
+            if not tiled or self.full_frame:
+                inputs.append(image)
+                owners.append((i, None))
+            if tiled:
+                for x1, y1, x2, y2 in tile_grid(shape, self.tile_size, self.overlap):
+                    inputs.append(image[y1:y2, x1:x2])
+                    owners.append((i, (x1, y1, x2, y2)))
+
+        parts = [[] for _ in images]
+        timings = {}
+        for start in range(0, len(inputs), self.batch_size):
+            chunk = inputs[start:start + self.batch_size]
+            for (i, tile), dets in zip(owners[start:start + self.batch_size],
+                                       self.engine.predict_batch(chunk, conf=conf, iou=iou)):
+                parts[i].append(dets if tile is None else crop_to_frame(dets, tile, images[i].shape[:2]))
+            for name, seconds in self.engine.last_timings.items():
+                timings[name] = timings.get(name, 0.0) + seconds
+        self.last_timings = timings
+        self.last_tiles = sum(tile is not None for _, tile in owners)
+
+        out = []
+        for p in parts:
+            dets = concat_detections(p)
+            if len(p) > 1:
+                # The same object seen by overlapping tiles and the full frame: keep the best box per class
+                dets = fuse_detections(dets, 'nms', iou_thres=self.merge_iou, agnostic=False)
+            out.append(dets)
+        return out
+
+    def predict(self, image, conf=0.25, iou=0.7):
+        return self.predict_batch([image], conf=conf, iou=iou)[0]
+
+
+# ---------------- Latency scaling ----------------
+def upscale(image, long_side):
+    r = long_side / max(image.shape[:2])
+    return cv2.resize(image, None, fx=r, fy=r, interpolation=cv2.INTER_LINEAR) if r != 1 else image
+
+
+def time_frames(engine, frames, conf, repeats=1):
+    engine.predict(frames[0], conf=conf)  # warm-up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for frame in frames:
+            engine.predict(frame, conf=conf)
+    return 1000 * (time.perf_counter() - start) / (repeats * len(frames))
+
+
+def latency_scaling(frames, tile_sizes, overlap, batch_size, conf=0.25, device=None):
+    """ms/frame for the untiled engine and for every tile size. Returns (rows, device)."""
+    engine = EnsembleEngine(MODEL_PATHS, device=device)
+    rows = [{'tile_size': None, 'tiles': 0, 'ms_per_frame': time_frames(engine, frames, conf)}]
+    for tile_size in tile_sizes:
+        tiled = TiledEngine(engine, tile_size, overlap, batch_size, min_side=0)
+        ms = time_frames(tiled, frames, conf)
+        # Per model input: the tiles plus the full-frame view
+        rows.append({'tile_size': tile_size, 'tiles': tiled.last_tiles, 'ms_per_frame': ms,
+                     'ms_per_input': ms / (tiled.last_tiles + 1)})
+    engine.close()
+    return rows, str(engine.device)
+
+
+def print_scaling(rows, shape, overlap, batch_size, device):
+    base = rows[0]['ms_per_frame']
+    print(f"\nFrames {shape[1]}x{shape[0]}, overlap {overlap}, batch {batch_size}, {device}")
+    print(f"{'tile':>6} {'tiles':>6} {'ms/frame':>9} {'ms/input':>9} {'vs whole':>9}")
+    for r in rows:
+        tile = r['tile_size'] or 'whole'
+        per_input = r.get('ms_per_input', r['ms_per_frame'])
+        print(f"{tile:>6} {r['tiles']:>6} {r['ms_per_frame']:>9.1f} {per_input:>9.1f} {r['ms_per_frame'] / base:>8.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure how tiled inference latency scales with the tile count.")
+    parser.add_argument('--source', default=TEST_IMG_DIR, help="an image or a folder of images")
+    parser.add_argument('--frames', type=int, default=10, help="images to time")
+    parser.add_argument('--long-side', type=int, default=3840, help="upscale the frames to this long side (0: keep)")
+    parser.add_argument('--tile-sizes', type=int, nargs='+', default=[640, 960, 1280])
+    parser.add_argument('--overlap', type=float, default=TILE_OVERLAP)
+    parser.add_argument('--batch', type=int, default=TILE_BATCH)
+    parser.add_argument('--conf', type=float, default=0.25)
+    parser.add_argument('--device', default=None)
+    args = parser.parse_args()
+
+    paths = [args.source] if os.path.isfile(args.source) else sorted(glob.glob(os.path.join(args.source, '*.png')))
+    frames = [cv2.imread(p) for p in paths[:args.frames]]
+    if args.long_side:
+        frames = [upscale(f, args.long_side) for f in frames]
+    rows, device = latency_scaling(frames, args.tile_sizes, args.overlap, args.batch, args.conf, args.device)
+    print_scaling(rows, frames[0].shape[:2], args.overlap, args.batch, device)
+    os.makedirs(os.path.dirname(REPORT_PATH), exist_ok=True)
+    with open(REPORT_PATH, 'w') as f:
+        json.dump({'frame_shape': list(frames[0].shape[:2]), 'overlap': args.overlap, 'batch': args.batch,
+                   'device': device, 'rows': rows}, f, indent=2)
+    print(f"🧾 Saved to {REPORT_PATH}")
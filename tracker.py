@@ -0,0 +1,202 @@
+"""Multi-object tracking on top of the ensemble, used to skip inference on video.
+
+Most station footage shows the same extinguishers and tanks in the same
+places, frame after frame. MultiObjectTracker carries boxes forward with a
+constant-velocity Kalman filter per track and associates new detections by
+IoU within each class. TrackedDetector wraps a detector and only re-runs full
+detection every ``detect_every`` frames, or sooner when a track's confidence
+has decayed below ``min_confidence``, a track was lost (unmatched at the last
+detection or drifting out of frame), or nothing has been detected yet.
+
+Every output box carries a stable track id.
+"""
+import numpy as np
+
+from ensemble import Detections, box_iou, empty_detections
+
+# Constant-velocity model over (cx, cy, w, h, vcx, vcy, vw, vh)
+_F = np.eye(8, dtype=np.float64)
+_F[:4, 4:] = np.eye(4)
+_H = np.eye(4, 8, dtype=np.float64)
+
+
+def xyxy_to_cxcywh(box):
+    x1, y1, x2, y2 = box
+    return np.array([(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1], dtype=np.float64)
+
+
+def cxcywh_to_xyxy(state):
+    cx, cy, w, h = state[:4]
+    return np.array([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], dtype=np.float32)
+
+
+class KalmanBoxTrack:
+    # Noise is scaled by the box height so that big and small objects behave alike
+    POS_STD = 1.0 / 20
+    VEL_STD = 1.0 / 160
+
+    def __init__(self, track_id, box, score, class_id):
+        self.track_id = track_id
+        self.class_id = int(class_id)
+        self.score = float(score)
+        self.x = np.zeros(8)
+        self.x[:4] = xyxy_to_cxcywh(box)
+        h = max(self.x[3], 1.0)
+        std = np.array([2 * self.POS_STD * h] * 4 + [10 * self.VEL_STD * h] * 4)
+        self.P = np.diag(std ** 2)
+        self.time_since_update = 0  # frames since the last matched detection
+        self.misses = 0             # consecutive detection passes without a match
+        self.hits = 1
+        self.visible = True         # matched at the most recent detection pass
+
+    @property
+    def box(self):
+        return cxcywh_to_xyxy(self.x)
+
+    def predict(self):
+        h = max(self.x[3], 1.0)
+        q = np.array([self.POS_STD * h] * 4 + [self.VEL_STD * h] * 4)
+        self.x = _F @ self.x
+        self.x[2:4] = np.maximum(self.x[2:4], 1.0)
+        self.P = _F @ self.P @ _F.T + np.diag(q ** 2)
+        self.time_since_update += 1
+
+    def update(self, box, score):
+        h = max(self.x[3], 1.0)
+        R = np.diag(np.full(4, (self.POS_STD * h) ** 2))
+        z = xyxy_to_cxcywh(box)
+        S = _H @ self.P @ _H.T + R
+        K = self.P @ _H.T @ np.linalg.inv(S)
+        self.x = self.x + K @ (z - _H @ self.x)
+        self.P = (np.eye(8) - K @ _H) @ self.P
+        self.score = float(score)
+        self.time_since_update = 0
+        self.misses = 0
+        self.hits += 1
+        self.visible = True
+
+
+def greedy_match(iou, threshold):
+    """Greedy highest-IoU-first assignment. Returns (row_idx, col_idx) arrays."""
+    rows, cols = [], []
+    if iou.size == 0:
+        return np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64)
+    iou = iou.copy()
+    while True:
+        r, c = np.unravel_index(np.argmax(iou), iou.shape)
+        if iou[r, c] < threshold:
+            break
+        rows.append(r)
+        cols.append(c)
+        iou[r, :] = -1
+        iou[:, c] = -1
+    return np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64)
+
+
+class MultiObjectTracker:
+    def __init__(self, iou_threshold=0.3, max_age=3, score_decay=0.95):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age          # detection passes a track may go unmatched
+        self.score_decay = score_decay  # per-frame confidence decay while only predicted
+        self.tracks = []
+        self._next_id = 1
+
+    def predict(self):
+        for track in self.tracks:
+            track.predict()
+            track.score *= self.score_decay
+
+    def update(self, dets):
+        """Associate a detection pass with the tracks. Returns the track id of every detection."""
+        track_ids = np.zeros(len(dets), dtype=np.int64)
+        if self.tracks and len(dets):
+            track_boxes = np.stack([t.box for t in self.tracks])
+            track_classes = np.array([t.class_id for t in self.tracks])
+            iou = box_iou(track_boxes, dets.boxes)
+            iou[track_classes[:, None] != dets.class_ids[None, :]] = 0.0
+            t_idx, d_idx = greedy_match(iou, self.iou_threshold)
+        else:
+            t_idx = d_idx = np.zeros(0, dtype=np.int64)
+
+        for track in self.tracks:
+            track.visible = False
+            track.misses += 1
+        for ti, di in zip(t_idx.tolist(), d_idx.tolist()):
+            self.tracks[ti].update(dets.boxes[di], dets.scores[di])
+            track_ids[di] = self.tracks[ti].track_id
+        for di in sorted(set(range(len(dets))) - set(d_idx.tolist())):
+            track = KalmanBoxTrack(self._next_id, dets.boxes[di], dets.scores[di], dets.class_ids[di])
+            self._next_id += 1
+            self.tracks.append(track)
+            track_ids[di] = track.track_id
+        # Unmatched tracks survive a few passes in case the detector missed them once
+        self.tracks = [t for t in self.tracks if t.misses <= self.max_age]
+        return track_ids
+
+    @property
+    def lost(self):
+        """Tracks alive but not matched at the last detection pass."""
+        return [t for t in self.tracks if not t.visible]
+
+    def active(self):
+        """Predicted boxes of the tracks seen at the last detection pass, with their ids."""
+        visible = [t for t in self.tracks if t.visible]
+        if not visible:
+            return empty_detections(), np.zeros(0, dtype=np.int64)
+        dets = Detections(
+            np.stack([t.box for t in visible]),
+            np.array([t.score for t in visible], dtype=np.float32),
+            np.array([t.class_id for t in visible], dtype=np.int64),
+        )
+        return dets, np.array([t.track_id for t in visible], dtype=np.int64)
+
+
+class TrackedDetector:
+    """Run ``detect_fn`` only when needed and fill the other frames from the tracker."""
+
+    def __init__(self, detect_fn, detect_every=5, min_confidence=0.35, min_inside=0.5, **tracker_kwargs):
+        self.detect_fn = detect_fn
+        self.detect_every = max(1, detect_every)
+        self.min_confidence = min_confidence
+        self.min_inside = min_inside  # visible fraction below which a track counts as leaving the frame
+        self.tracker = MultiObjectTracker(**tracker_kwargs)
+        self.frames_since_detect = None
+        self.frames = 0
+        self.detections_run = 0
+
+    def _needs_detection(self, width, height):
+        if self.frames_since_detect is None or self.frames_since_detect + 1 >= self.detect_every:
+            return True
+        if self.tracker.lost:
+            return True
+        tracks = [t for t in self.tracker.tracks if t.visible]
+        if any(t.score < self.min_confidence for t in tracks):
+            return True
+        for t in tracks:
+            x1, y1, x2, y2 = t.box
+            inside = max(0.0, min(x2, width) - max(x1, 0)) * max(0.0, min(y2, height) - max(y1, 0))
+            if inside < self.min_inside * max((x2 - x1) * (y2 - y1), 1e-9):
+                return True
+        return False
+
+    def step(self, image):
+        """Returns (Detections, track_ids, ran_detection) for one frame."""
+        self.frames += 1
+        self.tracker.predict()
+        height, width = image.shape[:2]
+        if self._needs_detection(width, height):
+            dets = self.detect_fn(image)
+            track_ids = self.tracker.update(dets)
+            self.frames_since_detect = 0
+            self.detections_run += 1
+            return dets, track_ids, True
+        self.frames_since_detect += 1
+        dets, track_ids = self.tracker.active()
+        return dets, track_ids, False
+
+    def stats(self):
+        return {
+            'frames': self.frames,
+            'detections_run': self.detections_run,
+            'skip_ratio': 1.0 - self.detections_run / self.frames if self.frames else 0.0,
+        }
@@ -1,10 +1,39 @@
+"""Train one YOLOv8 model per class, as separate scheduled processes.
+
+Every class is one job. ``--jobs`` jobs run side by side, each in its own
+process, with its own torch thread count and (on Linux) its own set of cores
+(``--threads``, ``--cores``; by default the usable cores are split evenly
+between the parallel jobs). A job is skipped when
+``runs/detect/<class>/weights/best.pt`` is newer than every file of the class's
+data, and an interrupted run continues from its ``last.pt``. A crash in one
+job does not stop the others: run the script again to pick it up.
+
+Wall time and outcome per job go to ``runs/detect/oneclass_schedule.json``.
+
+Usage:
+    python train_all_oneclass.py                          # one job at a time on GPU 0 (or CPU)
+    python train_all_oneclass.py --device cpu --jobs 3    # three CPU jobs, cores split three ways
+    python train_all_oneclass.py --jobs 3 --cores 0-7 8-15 16-23 --threads 8
+"""
+import argparse
+import json
+import multiprocessing as mp
 import os
+import time
+from multiprocessing.connection import wait
+
+import torch
 from ultralytics import YOLO
-from tqdm import tqdm
+
+from ensemble import split_cores
+from image_cache import CachedDetectionTrainer, open_cache
+from train_metrics import instrumented
 
 # List of classes (should match your dataset)
 CLASSES = ["FireExtinguisher", "ToolBox", "OxygenTank"]
 BASE_DIR = "data/separated_dataset"
+RUNS_DIR = os.path.abspath("runs/detect")
+SUMMARY_PATH = os.path.join(RUNS_DIR, "oneclass_schedule.json")
 
 # Training configuration (tailored for laptop/4GB VRAM)
 TRAIN_ARGS = dict(
@@ -34,17 +63,83 @@ TRAIN_ARGS = dict(
     single_cls=True
 )
 
-if __name__ == "__main__":
-    print("Starting one-class YOLOv8 training for all classes...\n")
-    for class_name in tqdm(CLASSES, desc="Classes", unit="class"):
-        class_dir = os.path.join(BASE_DIR, class_name)
-        yaml_path = os.path.join(class_dir, f"{class_name}.yaml")
-        if not os.path.exists(yaml_path):
-            print(f"❌ YAML not found for {class_name}, skipping.")
-            continue
-        print(f"\n🚀 Training model for class: {class_name}")
-        model = YOLO(TRAIN_ARGS['model'])
-        results = model.train(
+
+# ---------------- Job state ----------------
+def data_mtime(class_name):
+    """Newest mtime (ns) of the class's YAML and its split folders and files."""
+    class_dir = os.path.join(BASE_DIR, class_name)
+    newest = os.stat(os.path.join(class_dir, f"{class_name}.yaml")).st_mtime_ns
+    for split in os.listdir(class_dir):
+        for sub in ("images", "labels"):
+            folder = os.path.join(class_dir, split, sub)
+            if not os.path.isdir(folder):
+                continue
+            # A directory's mtime covers added, removed and atomically replaced files
+            newest = max(newest, os.stat(folder).st_mtime_ns)
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    newest = max(newest, entry.stat().st_mtime_ns)
+    return newest
+
+
+def checkpoint_epoch(path):
+    """Epoch stored in an ultralytics checkpoint; -1 once training finished and the optimizer was stripped."""
+    try:
+        ckpt = torch.load(path, map_location="cpu", weights_only=False)
+    except Exception:
+        return -1
+    return ckpt.get("epoch", -1)
+
+
+def plan_job(class_name, force=False):
+    """('skip' | 'resume' | 'train' | 'missing', reason)."""
+    yaml_path = os.path.join(BASE_DIR, class_name, f"{class_name}.yaml")
+    if not os.path.exists(yaml_path):
+        return "missing", f"{yaml_path} not found"
+    weights_dir = os.path.join(RUNS_DIR, class_name, "weights")
+    best, last = os.path.join(weights_dir, "best.pt"), os.path.join(weights_dir, "last.pt")
+    newest_data = data_mtime(class_name)
+    if force:
+        return "train", "--force"
+    if os.path.exists(last) and os.stat(last).st_mtime_ns > newest_data:
+        epoch = checkpoint_epoch(last)
+        if epoch >= 0:
+            return "resume", f"interrupted after epoch {epoch + 1}"
+    if os.path.exists(best) and os.stat(best).st_mtime_ns > newest_data:
+        return "skip", "best.pt is newer than the data"
+    return "train", "no up-to-date weights"
+
+
+# ---------------- One job (child process) ----------------
+def thread_budget(threads):
+    """Trainer callback that sets torch's thread count back to ``threads``.
+
+    The trainer's select_device() sets it to ultralytics' own default (up to 8,
+    counted from all of the machine's cores, not the job's) on CPU, after
+    anything done before ``model.train()``.
+    """
+    def on_pretrain_routine_end(trainer):
+        torch.set_num_threads(threads)
+    return on_pretrain_routine_end
+
+
+def train_class(class_name, action, device, threads, cores, use_cache, metrics):
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    if threads:
+        os.environ["OMP_NUM_THREADS"] = str(threads)  # for the dataloader workers started later
+    trainer = CachedDetectionTrainer if use_cache else None
+    if metrics:
+        trainer = instrumented(trainer)  # writes runs/detect/<class>/throughput.csv
+    yaml_path = os.path.join(BASE_DIR, class_name, f"{class_name}.yaml")
+    print(f"\n🚀 Training model for class: {class_name} ({action}, device={device}, threads={threads}, cores={cores})")
+    model = YOLO(os.path.join(RUNS_DIR, class_name, "weights", "last.pt") if action == "resume" else TRAIN_ARGS['model'])
+    if threads:
+        model.add_callback("on_pretrain_routine_end", thread_budget(threads))
+    if action == "resume":
+        model.train(resume=True, data=yaml_path, device=device, workers=TRAIN_ARGS['workers'], trainer=trainer)
+    else:
+        model.train(
             data=yaml_path,
             epochs=TRAIN_ARGS['epochs'],
             imgsz=TRAIN_ARGS['imgsz'],
@@ -67,9 +162,110 @@ if __name__ == "__main__":
             copy_paste=TRAIN_ARGS['copy_paste'],
             patience=TRAIN_ARGS['patience'],
             workers=TRAIN_ARGS['workers'],
-            device=TRAIN_ARGS['device'],
+            device=device,
             single_cls=TRAIN_ARGS['single_cls'],
-            name=class_name
+            trainer=trainer,
+            project=RUNS_DIR,
+            name=class_name,
+            exist_ok=True  # always runs/detect/<class>, so the next run finds best.pt / last.pt
         )
-        print(f"✅ Finished training for {class_name}! Check weights in runs/detect/{class_name}/weights/best.pt")
-    print("\n🎉 All one-class models have been trained!") 
\ No newline at end of file
+    print(f"✅ Finished training for {class_name}! Check weights in runs/detect/{class_name}/weights/best.pt")
+
+
+# ---------------- Scheduler ----------------
+def parse_cores(spec):
+    """'0-3,8' -> [0, 1, 2, 3, 8]."""
+    cores = []
+    for part in spec.split(','):
+        start, _, end = part.partition('-')
+        cores.extend(range(int(start), int(end or start) + 1))
+    return cores
+
+
+def schedule(classes, jobs=1, devices=None, threads=None, cores=None, use_cache=True, metrics=True, force=False):
+    """Run the per-class jobs, at most ``jobs`` at a time. Returns one summary entry per class."""
+    if devices is None:
+        devices = [TRAIN_ARGS['device'] if torch.cuda.is_available() else "cpu"]
+    if cores is None and jobs > 1 and all(str(d) == "cpu" for d in devices):
+        cores = split_cores(jobs)
+    summary, pending = {}, []
+    for class_name in classes:
+        action, reason = plan_job(class_name, force)
+        print(f"📋 {class_name}: {action} ({reason})")
+        summary[class_name] = {"class": class_name, "action": action, "reason": reason, "wall_seconds": 0.0}
+        if action in ("train", "resume"):
+            pending.append((class_name, action))
+
+    ctx = mp.get_context("spawn")  # a fresh interpreter per job: no forked CUDA or torch thread state
+    free_slots = list(range(jobs))
+    running = {}  # sentinel -> (process, class_name, slot, start)
+    while pending or running:
+        while pending and free_slots:
+            class_name, action = pending.pop(0)
+            slot = free_slots.pop(0)
+            device = devices[slot % len(devices)]
+            slot_cores = cores[slot % len(cores)] if cores else None
+            slot_threads = threads or (len(slot_cores) if slot_cores else None)
+            process = ctx.Process(target=train_class, name=f"train-{class_name}",
+                                  args=(class_name, action, device, slot_threads, slot_cores, use_cache, metrics))
+            process.start()
+            running[process.sentinel] = (process, class_name, slot, time.perf_counter())
+            summary[class_name].update(device=str(device), threads=slot_threads, cores=slot_cores)
+        for sentinel in wait(list(running)):
+            process, class_name, slot, start = running.pop(sentinel)
+            process.join()
+            entry = summary[class_name]
+            entry["wall_seconds"] = round(time.perf_counter() - start, 1)
+            entry["exit_code"] = process.exitcode
+            if process.exitcode != 0:
+                entry["action"] = "failed"
+                print(f"❌ {class_name} failed (exit code {process.exitcode}); run again to resume from last.pt")
+            else:
+                entry["action"] = {"train": "trained", "resume": "resumed"}[entry["action"]]
+            free_slots.append(slot)
+    return list(summary.values())
+
+
+def write_summary(entries, path=SUMMARY_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"finished": time.strftime("%Y-%m-%d %H:%M:%S"), "jobs": entries}, f, indent=2)
+    print(f"\n{'Class':<18} {'result':<8} {'wall':>9}  device  cores")
+    for e in entries:
+        cores = e.get("cores")
+        cores = f"{cores[0]}-{cores[-1]}" if cores else "-"
+        print(f"{e['class']:<18} {e['action']:<8} {e['wall_seconds']:>8.1f}s  {e.get('device', '-'):<6}  {cores}")
+    print(f"🧾 Summary saved to {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train one YOLOv8 model per class.")
+    parser.add_argument('--classes', nargs='+', default=CLASSES, choices=CLASSES)
+    parser.add_argument('--jobs', type=int, default=1, help="jobs running at the same time")
+    parser.add_argument('--device', nargs='+', default=None,
+                        help="devices given to the job slots in turn, e.g. 0 1 or cpu (default: GPU 0 if available)")
+    parser.add_argument('--threads', type=int, default=None, help="torch threads per job (default: its core count)")
+    parser.add_argument('--cores', nargs='+', default=None,
+                        help="cores per job slot, e.g. 0-7 8-15 16-23 (default on CPU: split evenly)")
+    parser.add_argument('--force', action='store_true', help="retrain even if best.pt is up to date")
+    parser.add_argument('--no-image-cache', action='store_true',
+                        help="decode the PNGs every epoch instead of reading data/image_cache")
+    parser.add_argument('--no-metrics', action='store_true', help="do not write throughput.csv")
+    args = parser.parse_args()
+
+    if not args.no_image_cache:
+        # Decode once for all three runs: the per-class folders link to the same data/<split>/images files
+        open_cache(imgsz=TRAIN_ARGS['imgsz'], verbose=True)
+
+    devices = [int(d) if d.isdigit() else d for d in args.device] if args.device else None
+    cores = [parse_cores(spec) for spec in args.cores] if args.cores else None
+    print("Starting one-class YOLOv8 training for all classes...\n")
+    start = time.perf_counter()
+    entries = schedule(args.classes, jobs=max(1, args.jobs), devices=devices, threads=args.threads, cores=cores,
+                       use_cache=not args.no_image_cache, metrics=not args.no_metrics, force=args.force)
+    write_summary(entries)
+    failed = [e['class'] for e in entries if e['action'] == 'failed']
+    if failed:
+        print(f"\n⚠️  {', '.join(failed)} did not finish ({time.perf_counter() - start:.0f}s total)")
+        raise SystemExit(1)
+    print(f"\n🎉 All one-class models have been trained! ({time.perf_counter() - start:.0f}s total)")
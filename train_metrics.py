@@ -0,0 +1,251 @@
+"""Per-epoch training throughput, written next to ultralytics' results.csv.
+
+The ``time`` column of results.csv only says how long an epoch took, not why.
+``InstrumentedTrainer`` / ``InstrumentedCachedTrainer`` register callbacks for
+the epoch, batch and validation events and write
+``runs/detect/<run>/throughput.csv`` with one row per epoch:
+
+    images_per_s        training images / train-loop seconds
+    dataloader_wait_s   time the loop spent waiting for the next batch
+    compute_s           preprocess + forward + backward + optimizer step
+    load_s, augment_s   time inside the dataset: image decode/resize (incl.
+                        mosaic partners) and the transform pipeline (mosaic,
+                        copy_paste, mixup, ...). Summed over dataloader
+                        workers, so with workers > 0 they can exceed the wait.
+    val_s               validation after the epoch
+    peak_rss_mb         peak resident memory of the trainer + its workers
+    peak_gpu_mb         torch.cuda.max_memory_allocated during the epoch
+
+``python train_metrics.py`` compares runs (multiclass, multiclass3,
+multiclass5, the one-class models ...). Runs trained before this existed only
+have results.csv, so they show seconds per epoch only.
+"""
+import argparse
+import csv
+import multiprocessing as mp
+import os
+import time
+
+import psutil
+import torch
+from ultralytics.data.dataset import YOLODataset
+from ultralytics.models.yolo.detect import DetectionTrainer
+
+from image_cache import CachedDetectionTrainer, CachedYOLODataset
+
+RUNS_DIR = 'runs/detect'
+SIDECAR_NAME = 'throughput.csv'
+FIELDS = ('epoch', 'images', 'train_s', 'images_per_s', 'dataloader_wait_s', 'compute_s', 'load_s', 'augment_s',
+          'val_s', 'peak_rss_mb', 'peak_gpu_mb')
+RSS_EVERY = 10  # batches between memory samples; walking the worker processes costs ~1 ms
+
+
+# ---------------- Dataset timing (runs in the dataloader workers) ----------------
+class TimedYOLODataset(YOLODataset):
+    """Accumulates load / total item time into a shared array (count, load_s, total_s)."""
+
+    def start_timing(self):
+        self.timing = mp.Array('d', 3)  # shared with forked or spawned workers
+
+    def load_image(self, i, rect_mode=True, resize_short=False):
+        start = time.perf_counter()
+        out = super().load_image(i, rect_mode, resize_short)
+        with self.timing.get_lock():
+            self.timing[1] += time.perf_counter() - start
+        return out
+
+    def __getitem__(self, index):
+        start = time.perf_counter()
+        out = super().__getitem__(index)
+        with self.timing.get_lock():
+            self.timing[0] += 1
+            self.timing[2] += time.perf_counter() - start
+        return out
+
+
+class TimedCachedYOLODataset(TimedYOLODataset, CachedYOLODataset):
+    pass
+
+
+TIMED_CLASSES = {YOLODataset: TimedYOLODataset, CachedYOLODataset: TimedCachedYOLODataset}
+
+
+def process_tree_rss(process):
+    rss = process.memory_info().rss
+    for child in process.children(recursive=True):
+        try:
+            rss += child.memory_info().rss
+        except psutil.Error:
+            pass  # a worker exited between listing and reading
+    return rss
+
+
+# ---------------- Callbacks ----------------
+class ThroughputLogger:
+    """Callback state for one training run."""
+
+    def __init__(self):
+        self.process = psutil.Process()
+        self.path = None
+        self.row = None
+
+    def register(self, trainer):
+        for event in ('on_train_start', 'on_train_epoch_start', 'on_train_batch_start', 'on_train_batch_end',
+                      'on_train_epoch_end', 'on_val_start', 'on_val_end', 'on_fit_epoch_end'):
+            trainer.add_callback(event, getattr(self, event))
+
+    def on_train_start(self, trainer):
+        self.path = os.path.join(trainer.save_dir, SIDECAR_NAME)
+        kept = []
+        if trainer.start_epoch and os.path.exists(self.path):
+            # Resumed run: keep the epochs that were already trained
+            with open(self.path, newline='') as f:
+                kept = [row for row in csv.DictReader(f) if int(row['epoch']) <= trainer.start_epoch]
+        with open(self.path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(kept)
+
+    def _dataset_timing(self, trainer):
+        timing = getattr(trainer.train_loader.dataset, 'timing', None)
+        return list(timing[:]) if timing is not None else [0.0, 0.0, 0.0]
+
+    def on_train_epoch_start(self, trainer):
+        now = time.perf_counter()
+        self.row = {'epoch': trainer.epoch + 1, 'dataloader_wait_s': 0.0, 'compute_s': 0.0, 'val_s': 0.0}
+        self.epoch_start = self.batch_end = now
+        self.timing_start = self._dataset_timing(trainer)
+        self.peak_rss = process_tree_rss(self.process)
+        self.batches = 0
+        if torch.cuda.is_available():
+            torch.cuda.reset_peak_memory_stats()
+
+    def on_train_batch_start(self, trainer):
+        self.batch_start = time.perf_counter()
+        self.row['dataloader_wait_s'] += self.batch_start - self.batch_end
+
+    def on_train_batch_end(self, trainer):
+        self.batch_end = time.perf_counter()
+        self.row['compute_s'] += self.batch_end - self.batch_start
+        self.batches += 1
+        if self.batches % RSS_EVERY == 0:
+            self.peak_rss = max(self.peak_rss, process_tree_rss(self.process))
+
+    def on_train_epoch_end(self, trainer):
+        row = self.row
+        row['train_s'] = time.perf_counter() - self.epoch_start
+        row['images'] = len(trainer.train_loader.dataset)
+        row['images_per_s'] = row['images'] / max(row['train_s'], 1e-9)
+        _, load, total = (b - a for a, b in zip(self.timing_start, self._dataset_timing(trainer)))
+        row['load_s'], row['augment_s'] = load, max(total - load, 0.0)
+        self.peak_rss = max(self.peak_rss, process_tree_rss(self.process))
+
+    def on_val_start(self, validator):
+        self.val_start = time.perf_counter()
+
+    def on_val_end(self, validator):
+        if self.row is not None:
+            self.row['val_s'] += time.perf_counter() - self.val_start
+
+    def on_fit_epoch_end(self, trainer):
+        row = self.row
+        if row is None:
+            return  # final_eval after training fires this event again
+        row['peak_rss_mb'] = max(self.peak_rss, process_tree_rss(self.process)) / 2 ** 20
+        row['peak_gpu_mb'] = torch.cuda.max_memory_allocated() / 2 ** 20 if torch.cuda.is_available() else 0.0
+        with open(self.path, 'a', newline='') as f:
+            csv.DictWriter(f, fieldnames=FIELDS).writerow(
+                {k: round(v, 3) if isinstance(v, float) else v for k, v in row.items()})
+        self.row = None
+
+
+class _Instrumented:
+    """Trainer mixin: registers a ThroughputLogger and times the training dataset."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        ThroughputLogger().register(self)
+
+    def build_dataset(self, img_path, mode="train", batch=None):
+        dataset = super().build_dataset(img_path, mode, batch)
+        timed = TIMED_CLASSES.get(type(dataset))
+        if mode == "train" and timed is not None:
+            # Swapped before the dataloader starts its workers, so they inherit the shared counters
+            dataset.__class__ = timed
+            dataset.start_timing()
+        return dataset
+
+
+class InstrumentedTrainer(_Instrumented, DetectionTrainer):
+    pass
+
+
+class InstrumentedCachedTrainer(_Instrumented, CachedDetectionTrainer):
+    pass
+
+
+def instrumented(trainer_cls=None):
+    """The instrumented version of ``trainer_cls`` (None: the default DetectionTrainer)."""
+    return InstrumentedCachedTrainer if trainer_cls is CachedDetectionTrainer else InstrumentedTrainer
+
+
+# ---------------- Run comparison ----------------
+def read_csv(path):
+    with open(path, newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def summarize_run(run_dir):
+    """One summary dict per run, from throughput.csv if present, else from results.csv."""
+    name = os.path.basename(os.path.normpath(run_dir))
+    sidecar = os.path.join(run_dir, SIDECAR_NAME)
+    if os.path.exists(sidecar):
+        rows = read_csv(sidecar)
+        if not rows:
+            return None
+        col = lambda key: [float(r[key]) for r in rows]
+        train_s = sum(col('train_s'))
+        return {
+            'run': name,
+            'epochs': len(rows),
+            'epoch_s': train_s / len(rows) + sum(col('val_s')) / len(rows),
+            'images_per_s': sum(col('images')) / max(train_s, 1e-9),
+            'wait_pct': 100 * sum(col('dataloader_wait_s')) / max(train_s, 1e-9),
+            'augment_pct': 100 * sum(col('augment_s')) / max(sum(col('load_s')) + sum(col('augment_s')), 1e-9),
+            'val_s': sum(col('val_s')) / len(rows),
+            'peak_rss_mb': max(col('peak_rss_mb')),
+            'peak_gpu_mb': max(col('peak_gpu_mb')),
+        }
+    results = os.path.join(run_dir, 'results.csv')
+    if not os.path.exists(results):
+        return None
+    rows = read_csv(results)
+    times = [float(r['time']) for r in rows if r.get('time', '').strip()]
+    if not times:
+        return None
+    return {'run': name, 'epochs': len(rows), 'epoch_s': times[-1] / len(times)}
+
+
+def print_summary(summaries):
+    def fmt(value, spec):
+        return format(value, spec) if value is not None else format('-', f">{spec.split('.')[0]}")
+
+    print(f"{'Run':<18} {'epochs':>6} {'s/epoch':>8} {'img/s':>8} {'wait%':>6} {'aug%':>6} {'val s':>7} "
+          f"{'RSS MB':>8} {'GPU MB':>8}")
+    for s in summaries:
+        print(f"{s['run']:<18} {s['epochs']:>6} {fmt(s['epoch_s'], '8.1f')} {fmt(s.get('images_per_s'), '8.1f')} "
+              f"{fmt(s.get('wait_pct'), '6.1f')} {fmt(s.get('augment_pct'), '6.1f')} {fmt(s.get('val_s'), '7.1f')} "
+              f"{fmt(s.get('peak_rss_mb'), '8.0f')} {fmt(s.get('peak_gpu_mb'), '8.0f')}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare training throughput across runs.")
+    parser.add_argument('--runs', nargs='+', help=f"run folders or names under {RUNS_DIR} (default: all)")
+    args = parser.parse_args()
+
+    names = args.runs or sorted(os.listdir(RUNS_DIR))
+    run_dirs = [name if os.path.isdir(name) else os.path.join(RUNS_DIR, name) for name in names]
+    summaries = [s for s in (summarize_run(d) for d in run_dirs if os.path.isdir(d)) if s]
+    print_summary(summaries)
+    if any('images_per_s' not in s for s in summaries):
+        print(f"\n'-': trained before {SIDECAR_NAME} existed; only results.csv epoch times are available")
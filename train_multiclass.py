@@ -1,6 +1,10 @@
+import argparse
 import os
 from ultralytics import YOLO
 
+from image_cache import CachedDetectionTrainer, open_cache
+from train_metrics import instrumented
+
 # Path to the dataset YAML file
 DATA_YAML = "yolo_params.yaml"
 
@@ -33,6 +37,19 @@ TRAIN_ARGS = dict(
 )
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train one YOLOv8 model for all classes.")
+    parser.add_argument('--no-image-cache', action='store_true',
+                        help="decode the PNGs every epoch instead of reading data/image_cache")
+    parser.add_argument('--no-metrics', action='store_true', help="do not write throughput.csv")
+    args = parser.parse_args()
+
+    trainer = None
+    if not args.no_image_cache:
+        open_cache(imgsz=TRAIN_ARGS['imgsz'], verbose=True)
+        trainer = CachedDetectionTrainer
+    if not args.no_metrics:
+        trainer = instrumented(trainer)
+
     print("Starting multi-class YOLOv8 training for all classes...\n")
     model = YOLO(TRAIN_ARGS['model'])
     results = model.train(
@@ -60,6 +77,7 @@ if __name__ == "__main__":
         workers=TRAIN_ARGS['workers'],
         device=TRAIN_ARGS['device'],
         single_cls=TRAIN_ARGS['single_cls'],
+        trainer=trainer,
         name="multiclass"
     )
     print("\n✅ Finished multi-class training! Check weights in runs/detect/multiclass/weights/best.pt") 
\ No newline at end of file
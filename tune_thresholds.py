@@ -0,0 +1,180 @@
+"""Pick per-class confidence thresholds and the fusion IoU on a validation set.
+
+Raw predictions come from the prediction store (prediction_store.py), so the
+models run at most once per weights + image set. For every fusion IoU in the
+grid the stored boxes are fused and matched to the ground truth at IoU 0.5.
+Then, per class, predictions are sorted by score once, and cumulative TP/FP
+counts give precision, recall and F1 at every possible threshold. The operating
+point is chosen with one argmax instead of re-thresholding in a loop.
+
+Objectives:
+    f1      maximize F1 per class (default)
+    recall  the highest threshold that still reaches --target-recall, since a
+            missed extinguisher costs more than a false alarm
+
+The result is written to thresholds.json, which the backend, the Streamlit app
+and Testing.py load at startup (see ensemble.load_thresholds). It includes the
+per-model NMS IoU of the stored predictions (``nms_iou``), since the thresholds
+only hold when the models are served at that same IoU.
+
+Usage:
+    python tune_thresholds.py
+    python tune_thresholds.py --objective recall --target-recall 0.95 FireExtinguisher=0.98
+"""
+import argparse
+import glob
+import json
+import os
+
+import numpy as np
+
+from ensemble import CLASS_NAMES, MODEL_PATHS, THRESHOLDS_PATH, box_iou
+from evaluate_map import match_predictions, xywh_to_xyxy
+from fusion import FUSION_METHODS, fuse_detections
+from label_index import open_index
+from prediction_store import open_or_build
+
+VAL_IMG_DIR = 'data/val/images'
+VAL_LABEL_DIR = 'data/val/labels'
+IOU_GRID = [0.4, 0.45, 0.5, 0.55, 0.6, 0.65, 0.7]
+
+
+def match_store(store, label_dir, fusion, fusion_iou, agnostic, n_classes):
+    """Fuse every stored image and match it to its labels at IoU 0.5.
+
+    Returns (scores, is_tp, class_ids) over all fused predictions and the
+    number of ground-truth boxes per class.
+    """
+    scores, tps, class_ids = [], [], []
+    n_gt = np.zeros(n_classes, dtype=np.int64)
+    index = open_index(label_dir)
+    for image_id, (h, w), dets in store:
+        dets = fuse_detections(dets, fusion, iou_thres=fusion_iou, agnostic=agnostic)
+        gt = index.labels(image_id)
+        gt_cls = gt[:, 0].astype(np.int64)
+        n_gt += np.bincount(gt_cls, minlength=n_classes)[:n_classes]
+        if not len(dets):
+            continue
+        order = np.argsort(-dets.scores, kind='stable')
+        pred_boxes, pred_scores, pred_cls = dets.boxes[order], dets.scores[order], dets.class_ids[order]
+        if len(gt):
+            gt_boxes = xywh_to_xyxy(gt[:, 1:5]) * np.array([w, h, w, h], dtype=np.float32)
+            tp = match_predictions(pred_cls, gt_cls, box_iou(gt_boxes, pred_boxes))[:, 0]
+        else:
+            tp = np.zeros(len(pred_scores), dtype=bool)
+        scores.append(pred_scores)
+        tps.append(tp)
+        class_ids.append(pred_cls)
+    if not scores:
+        return np.zeros(0, np.float32), np.zeros(0, bool), np.zeros(0, np.int64), n_gt
+    return np.concatenate(scores), np.concatenate(tps), np.concatenate(class_ids), n_gt
+
+
+def operating_curve(scores, tp, n_gt, floor=0.0):
+    """Precision, recall, F1 and threshold for keeping the top k predictions, for every k.
+
+    A threshold applies as ``score > threshold`` (Detections.filter), so keeping
+    the top k predictions uses the midpoint between the k-th and (k+1)-th
+    scores. Where scores tie, k is only valid at the end of the tie.
+    """
+    order = np.argsort(-scores, kind='stable')
+    scores, tp = scores[order], tp[order]
+    tpc = np.cumsum(tp)
+    fpc = np.cumsum(~tp)
+    precision = tpc / (tpc + fpc)
+    recall = tpc / max(n_gt, 1)
+    f1 = 2 * precision * recall / (precision + recall + 1e-16)
+    threshold = np.append((scores[:-1] + scores[1:]) / 2, floor)
+    valid = np.append(scores[:-1] > scores[1:], True)
+    return precision[valid], recall[valid], f1[valid], threshold[valid]
+
+
+def choose_point(curve, objective, target_recall):
+    """Index into ``curve`` of the operating point for this objective."""
+    precision, recall, f1, threshold = curve
+    if objective == 'recall':
+        reached = np.flatnonzero(recall >= target_recall)
+        # First index = fewest predictions kept = highest threshold with enough recall
+        return int(reached[0]) if reached.size else int(recall.argmax())
+    return int(f1.argmax())
+
+
+def tune(store, label_dir, class_names, fusion, iou_grid, agnostic, objective, target_recall):
+    """Per-class thresholds for the best fusion IoU. Returns (fusion_iou, {class: point}, score)."""
+    best = None
+    for fusion_iou in iou_grid:
+        scores, tp, class_ids, n_gt = match_store(store, label_dir, fusion, fusion_iou, agnostic, len(class_names))
+        points = {}
+        for c, cls in enumerate(class_names):
+            mask = class_ids == c
+            point = {'conf': 0.0, 'precision': 0.0, 'recall': 0.0, 'f1': 0.0}
+            if mask.any():
+                curve = operating_curve(scores[mask], tp[mask], n_gt[c], floor=float(store.meta.get('conf', 0.0)))
+                i = choose_point(curve, objective, target_recall[cls])
+                point = {
+                    'conf': float(curve[3][i]),
+                    'precision': float(curve[0][i]),
+                    'recall': float(curve[1][i]),
+                    'f1': float(curve[2][i]),
+                }
+            points[cls] = point
+        # Rank IoU settings by mean F1 (f1) or by mean precision at the target recall (recall)
+        key = 'precision' if objective == 'recall' else 'f1'
+        score = float(np.mean([p[key] for p in points.values()]))
+        print(f"🔎 {fusion} IoU {fusion_iou:.2f}: mean {key} {score:.4f}")
+        if best is None or score > best[2]:
+            best = (fusion_iou, points, score)
+    return best
+
+
+def parse_target_recall(values, class_names):
+    """``0.95`` applies to every class; ``FireExtinguisher=0.98`` overrides one class."""
+    overrides = dict(value.split('=', 1) for value in values if '=' in value)
+    defaults = [float(value) for value in values if '=' not in value]
+    unknown = set(overrides) - set(class_names)
+    if unknown:
+        raise ValueError(f"Unknown classes {sorted(unknown)}, expected some of {class_names}")
+    default = defaults[-1] if defaults else 0.95
+    return {cls: float(overrides.get(cls, default)) for cls in class_names}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tune per-class confidence thresholds and fusion IoU.")
+    parser.add_argument('--images', default=VAL_IMG_DIR)
+    parser.add_argument('--labels', default=VAL_LABEL_DIR)
+    parser.add_argument('--fusion', default='nms', choices=['none', *FUSION_METHODS])
+    parser.add_argument('--iou-grid', type=float, nargs='+', default=IOU_GRID)
+    parser.add_argument('--class-aware', action='store_true', help="only fuse boxes of the same class")
+    parser.add_argument('--objective', default='f1', choices=['f1', 'recall'])
+    parser.add_argument('--target-recall', nargs='+', default=['0.95'],
+                        help="recall to reach with --objective recall: a value and/or CLASS=value overrides")
+    parser.add_argument('--output', default=THRESHOLDS_PATH)
+    args = parser.parse_args()
+
+    img_paths = sorted(glob.glob(os.path.join(args.images, '*.png')))
+    store = open_or_build(img_paths, MODEL_PATHS)
+    target_recall = parse_target_recall(args.target_recall, CLASS_NAMES)
+    agnostic = not args.class_aware
+    fusion_iou, points, _ = tune(store, args.labels, CLASS_NAMES, args.fusion, args.iou_grid, agnostic,
+                                 args.objective, target_recall)
+
+    objective = 'max F1' if args.objective == 'f1' else f"recall >= {target_recall}"
+    config = {
+        'nms_iou': store.meta['iou'],
+        'fusion': args.fusion,
+        'fusion_iou': fusion_iou,
+        'agnostic': agnostic,
+        'conf': {cls: round(p['conf'], 6) for cls, p in points.items()},
+        'objective': objective,
+        'validation': {cls: {k: round(v, 4) for k, v in p.items() if k != 'conf'} for cls, p in points.items()},
+        'images': len(store),
+        'weights_fingerprint': store.meta['weights_fingerprint'],
+    }
+    with open(args.output, 'w') as f:
+        json.dump(config, f, indent=2)
+
+    print(f"\n{'Class':<18} {'conf':>7} {'P':>7} {'R':>7} {'F1':>7}")
+    for cls, p in points.items():
+        print(f"{cls:<18} {p['conf']:>7.3f} {p['precision']:>7.3f} {p['recall']:>7.3f} {p['f1']:>7.3f}")
+    print(f"\n✅ {objective}, model NMS IoU {store.meta['iou']}, {args.fusion} IoU {fusion_iou} "
+          f"-> thresholds saved to {args.output}")
@@ -0,0 +1,326 @@
+"""Run the ensemble on video files and camera streams.
+
+A VideoPipeline has three stages, each on its own thread and connected by
+bounded queues:
+
+    decode (cv2.VideoCapture) -> inference (detect_fn) -> encode (draw / JPEG)
+
+With ``drop_stale=True`` (the default) a stage that finds its output queue full
+evicts the oldest item instead of waiting. Under load, stale frames are dropped
+and latency stays bounded instead of the queues growing. File sources are then
+read at their native frame rate so that a recorded video behaves like a live
+camera. With ``drop_stale=False`` every frame is processed (offline analysis).
+
+With ``detect_every=N`` the inference stage goes through a TrackedDetector
+(tracker.py): full detection runs at most every N frames (sooner when a track
+weakens or is lost) and every detection carries a stable ``track_id``.
+
+Sources: a path to a video file, a camera index such as ``0`` (V4L2
+/dev/video0) or any URL OpenCV can open (``rtsp://...``).
+
+Usage:
+    python video_stream.py --source test_videos/station.mp4 --save result.mp4 --detect-every 5
+    python video_stream.py --source rtsp://module-cam/4k --tile-size 640       # tiled 4K frames (tiling.py)
+"""
+import argparse
+import base64
+import os
+import queue
+import threading
+import time
+from typing import NamedTuple
+
+import cv2
+
+from ensemble import COLOR_MAP, EnsembleEngine, MODEL_PATHS, draw_detections
+from tracker import TrackedDetector
+from tiling import TILE_BATCH, TILE_MIN_SIDE, TILE_OVERLAP, TiledEngine
+
+_STOP = object()
+
+
+class Frame(NamedTuple):
+    index: int
+    captured_at: float  # time.perf_counter() when the frame was read
+    image: object
+
+
+def parse_source(source):
+    """Camera indices come in as strings from the CLI / query params."""
+    if isinstance(source, str) and source.isdigit():
+        return int(source)
+    return source
+
+
+def is_file_source(source):
+    return isinstance(source, str) and os.path.isfile(source)
+
+
+def put_latest(q, item):
+    """Put without blocking, evicting the oldest queued item when full. Returns how many were dropped."""
+    dropped = 0
+    while True:
+        try:
+            q.put_nowait(item)
+            return dropped
+        except queue.Full:
+            try:
+                q.get_nowait()
+                dropped += 1
+            except queue.Empty:
+                pass
+
+
+class VideoPipeline:
+    """Decode -> inference -> encode pipeline over one video source.
+
+    ``detect_fn(image) -> Detections`` runs the models. ``output`` selects what
+    each result carries besides the detections: ``None`` (detections only),
+    ``'jpeg'`` (base64 JPEG of the annotated frame, for WebSocket clients) or
+    ``'array'`` (the annotated BGR frame, for local consumers).
+    """
+
+    def __init__(self, source, detect_fn, class_names, queue_size=2, drop_stale=True,
+                 realtime=None, output=None, jpeg_quality=70, color_map=COLOR_MAP,
+                 detect_every=None, tracker_kwargs=None):
+        self.source = parse_source(source)
+        self.detect_fn = detect_fn
+        self.tracked = TrackedDetector(detect_fn, detect_every, **(tracker_kwargs or {})) if detect_every else None
+        self.class_names = class_names
+        self.drop_stale = drop_stale
+        self.realtime = drop_stale and is_file_source(self.source) if realtime is None else realtime
+        self.output = output
+        self.jpeg_quality = jpeg_quality
+        self.color_map = color_map
+        self._frames = queue.Queue(maxsize=queue_size)
+        self._inferred = queue.Queue(maxsize=queue_size)
+        self._results = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._threads = []
+        self.error = None
+        self.fps = None
+        self.frames_read = 0
+        self.frames_dropped = 0
+        self.frames_processed = 0
+        self._latency_total = 0.0
+
+    # ---------------- lifecycle ----------------
+    def start(self):
+        self._capture = cv2.VideoCapture(self.source)
+        if not self._capture.isOpened():
+            raise IOError(f"Could not open video source: {self.source}")
+        self.fps = self._capture.get(cv2.CAP_PROP_FPS) or None
+        for name, target in (('decode', self._decode_loop), ('infer', self._infer_loop), ('encode', self._encode_loop)):
+            thread = threading.Thread(target=target, name=f"video-{name}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # ---------------- consumer side ----------------
+    def get(self, timeout=None):
+        """Next result dict, or None once the source is exhausted or the pipeline stopped.
+
+        Raises queue.Empty if ``timeout`` expires first.
+        """
+        item = self._results.get(timeout=timeout)
+        if item is _STOP:
+            # Leave the sentinel for any other consumer
+            self._results.put(_STOP)
+            return None
+        return item
+
+    def __iter__(self):
+        while True:
+            item = self.get()
+            if item is None:
+                return
+            yield item
+
+    def stats(self):
+        processed = self.frames_processed
+        stats = {
+            'frames_read': self.frames_read,
+            'frames_processed': processed,
+            'frames_dropped': self.frames_dropped,
+            'avg_latency_ms': 1000.0 * self._latency_total / processed if processed else None,
+            'source_fps': self.fps,
+        }
+        if self.tracked is not None:
+            stats['detections_run'] = self.tracked.detections_run
+            stats['skip_ratio'] = self.tracked.stats()['skip_ratio']
+        return stats
+
+    # ---------------- stages ----------------
+    def _put(self, q, item):
+        if self.drop_stale:
+            self.frames_dropped += put_latest(q, item)
+            return
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _get(self, q):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _STOP
+
+    def _finish(self, q):
+        # The end-of-stream marker must never be dropped; it only evicts frames
+        # once the pipeline is stopped and nobody is draining the queue anymore
+        while True:
+            try:
+                q.put(_STOP, timeout=0.1)
+                return
+            except queue.Full:
+                if self._stop.is_set():
+                    try:
+                        q.get_nowait()
+                    except queue.Empty:
+                        pass
+
+    def _decode_loop(self):
+        frame_interval = 1.0 / self.fps if self.realtime and self.fps else 0.0
+        next_due = time.perf_counter()
+        try:
+            while not self._stop.is_set():
+                ok, image = self._capture.read()
+                if not ok:
+                    break
+                if frame_interval:
+                    # Pace file sources like a live camera
+                    next_due += frame_interval
+                    delay = next_due - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                self._put(self._frames, Frame(self.frames_read, time.perf_counter(), image))
+                self.frames_read += 1
+        except Exception as exc:
+            self.error = exc
+        finally:
+            self._capture.release()
+            self._finish(self._frames)
+
+    def _infer_loop(self):
+        try:
+            while True:
+                frame = self._get(self._frames)
+                if frame is _STOP:
+                    break
+                if self.tracked is not None:
+                    dets, track_ids, inferred = self.tracked.step(frame.image)
+                else:
+                    dets, track_ids, inferred = self.detect_fn(frame.image), None, True
+                self._put(self._inferred, (frame, dets, track_ids, inferred))
+        except Exception as exc:
+            self.error = exc
+        finally:
+            self._finish(self._inferred)
+
+    def _encode_loop(self):
+        try:
+            while True:
+                item = self._get(self._inferred)
+                if item is _STOP:
+                    break
+                frame, dets, track_ids, inferred = item
+                all_detections = dets.to_dicts(self.class_names)
+                if track_ids is not None:
+                    for det, track_id in zip(all_detections, track_ids.tolist()):
+                        det['track_id'] = track_id
+                result = {
+                    'frame': frame.index,
+                    'inference': inferred,
+                    'detections': all_detections,
+                    'class_counts': dets.class_counts(self.class_names),
+                    'width': frame.image.shape[1],
+                    'height': frame.image.shape[0],
+                }
+                if self.output is not None:
+                    annotated = draw_detections(frame.image, dets, self.class_names, self.color_map)
+                    if self.output == 'jpeg':
+                        _, buffer = cv2.imencode('.jpg', annotated, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+                        result['image'] = base64.b64encode(buffer).decode('utf-8')
+                    else:
+                        result['annotated'] = annotated
+                latency = time.perf_counter() - frame.captured_at
+                self.frames_processed += 1
+                self._latency_total += latency
+                result['latency_ms'] = 1000.0 * latency
+                result['dropped'] = self.frames_dropped
+                self._put(self._results, result)
+        except Exception as exc:
+            self.error = exc
+        finally:
+            self._finish(self._results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the ensemble on a video file or camera stream.")
+    parser.add_argument('--source', required=True, help="video file, camera index (0) or stream URL")
+    parser.add_argument('--conf', type=float, default=0.5)
+    parser.add_argument('--save', help="write the annotated video here")
+    parser.add_argument('--no-drop', action='store_true', help="process every frame instead of dropping stale ones")
+    parser.add_argument('--detect-every', type=int, default=None,
+                        help="track between detections and run the models at most every N frames")
+    parser.add_argument('--tile-size', type=int, default=0,
+                        help="run frames longer than --tile-min-side as overlapping tiles of this size (0: off)")
+    parser.add_argument('--tile-overlap', type=float, default=TILE_OVERLAP)
+    parser.add_argument('--tile-batch', type=int, default=TILE_BATCH)
+    parser.add_argument('--tile-min-side', type=int, default=TILE_MIN_SIDE)
+    args = parser.parse_args()
+
+    engine = EnsembleEngine(MODEL_PATHS)
+    if args.tile_size:
+        engine = TiledEngine(engine, args.tile_size, args.tile_overlap, args.tile_batch, args.tile_min_side)
+    pipeline = VideoPipeline(
+        args.source,
+        lambda image: engine.predict(image, conf=args.conf),
+        engine.class_names,
+        drop_stale=not args.no_drop,
+        output='array' if args.save else None,
+        detect_every=args.detect_every,
+    )
+    writer = None
+    start = time.perf_counter()
+    with pipeline:
+        for result in pipeline:
+            counts = ', '.join(f"{cls}: {n}" for cls, n in result['class_counts'].items())
+            mode = 'detect' if result['inference'] else 'track '
+            print(f"🎞️  frame {result['frame']:>5} | {mode} | {result['latency_ms']:7.1f} ms | {counts}")
+            if args.save:
+                if writer is None:
+                    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+                    writer = cv2.VideoWriter(args.save, fourcc, pipeline.fps or 25.0, (result['width'], result['height']))
+                writer.write(result['annotated'])
+    if writer is not None:
+        writer.release()
+    if pipeline.error is not None:
+        raise pipeline.error
+    stats = pipeline.stats()
+    elapsed = time.perf_counter() - start
+    print(f"\n✅ Processed {stats['frames_processed']}/{stats['frames_read']} frames "
+          f"({stats['frames_dropped']} dropped) in {elapsed:.1f}s, "
+          f"avg latency {stats['avg_latency_ms'] or 0:.1f} ms")
+    if 'detections_run' in stats:
+        print(f"🔁 Full detection ran on {stats['detections_run']} frames "
+              f"({100 * stats['skip_ratio']:.0f}% skipped by the tracker)")
+    if args.save:
+        print(f"🖼️ Annotated video saved to {args.save}")
@@ -1,70 +1,176 @@
+import argparse
 import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 import cv2
+import numpy as np
+
+from label_index import open_index
+
+DISPLAY_SIZE = (640, 480)
+CACHE_SIZE = 128      # rendered frames kept in memory
+PREFETCH_AHEAD = 8    # frames rendered ahead in the direction of travel
+PREFETCH_BEHIND = 2
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.webp')
+# cv2.imread flags that decode at 1/2, 1/4 or 1/8 resolution
+REDUCED_FLAGS = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4,
+                 8: cv2.IMREAD_REDUCED_COLOR_8}
 
 
 class YoloVisualizer:
+    """Step through a split's images with their YOLO labels drawn on top.
+
+    Frames are decoded at the smallest power-of-two reduction that still
+    covers ``DISPLAY_SIZE``, labels come from the label index, and rendered
+    frames are kept in an LRU cache. A background thread renders the next
+    frames in the direction of travel, so holding 'd' or 'a' rarely waits on
+    disk. Splits are listed on first use and the prefetch thread only runs
+    while browsing (``run``), so exporting one split needs no other.
+    """
     MODE_TRAIN = 0
     MODE_VAL = 1
-    def __init__(self, dataset_folder):
+    SPLITS = {MODE_TRAIN: "test", MODE_VAL: "val"}
+
+    def __init__(self, dataset_folder, display_size=DISPLAY_SIZE, cache_size=CACHE_SIZE, prefetch=PREFETCH_AHEAD):
         self.dataset_folder = dataset_folder
         classes_file = os.path.join(os.path.dirname(__file__), "classes.txt")
         with open(classes_file, "r") as f:
             self.classes = f.read().splitlines()
         self.classes = {i: c for i, c in enumerate(self.classes)}
+        self.display_size = display_size
+        self.cache_size = cache_size
+        self.prefetch = prefetch
+        self._splits = {}  # split -> (images folder, image names, label index); listed once
+        self._reduce = {}  # split -> decode reduction factor
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._wanted = threading.Condition()
+        self._targets = []
+        self._closed = False
+        self._prefetcher = None
+        self.direction = 1
         self.set_mode(YoloVisualizer.MODE_TRAIN)
-    
+
+    def load_split(self, split):
+        if split not in self._splits:
+            images_folder = os.path.join(self.dataset_folder, split, "images")
+            labels_folder = os.path.join(self.dataset_folder, split, "labels")
+            image_names = sorted(f for f in os.listdir(images_folder) if f.lower().endswith(IMAGE_EXTENSIONS))
+            assert len(image_names) > 0, f"No images in {images_folder}"
+            self._splits[split] = (images_folder, image_names, open_index(labels_folder))
+        return self._splits[split]
+
     def set_mode(self, mode=MODE_TRAIN):
-        if mode == self.MODE_TRAIN:
-            self.images_folder = os.path.join(self.dataset_folder, "test", "images")
-            self.labels_folder = os.path.join(self.dataset_folder, "test", "labels")
-        else:
-            self.images_folder = os.path.join(self.dataset_folder, "val", "images")
-            self.labels_folder = os.path.join(self.dataset_folder, "val", "labels")
-        self.num_images = len(os.listdir(self.images_folder))
-        num_labels = len(os.listdir(self.labels_folder))
-        self.label_names = sorted(os.listdir(self.labels_folder))
-        self.image_names = sorted(os.listdir(self.images_folder))
-        assert self.num_images == num_labels
-        assert self.num_images > 0
+        self.split = self.SPLITS[mode]
         self.frame_index = 0
 
+    @property
+    def num_images(self):
+        return len(self.load_split(self.split)[1])
 
     def next_frame(self):
-        self.frame_index += 1
-        if self.frame_index >= self.num_images:
-            self.frame_index = 0
-        elif self.frame_index < 0:
-            self.frame_index = self.num_images - 1
+        self.direction = 1
+        self.frame_index = (self.frame_index + 1) % self.num_images
 
     def previous_frame(self):
-        self.frame_index -= 1
-        if self.frame_index >= self.num_images:
-            self.frame_index = 0
-        elif self.frame_index < 0:
-            self.frame_index = self.num_images - 1
-    
-    def seek_frame(self, idx):
-        image_file = os.path.join(self.images_folder, self.image_names[idx])
-        label_file = os.path.join(self.labels_folder, self.label_names[idx])
-        with open(label_file, "r") as f:
-            lines = f.read().splitlines()
-        image = cv2.imread(image_file)
-        for line in lines:
-            class_index, x, y, w, h = map(float, line.split())
-            cx = int(x * image.shape[1])
-            cy = int(y * image.shape[0])
-            w = int(w * image.shape[1])
-            h = int(h * image.shape[0])
+        self.direction = -1
+        self.frame_index = (self.frame_index - 1) % self.num_images
+
+    # ---------------- rendering ----------------
+    def _reduction(self, split, image_file):
+        if split not in self._reduce:
+            # Learn the source resolution from one full decode; splits share a camera resolution
+            image = cv2.imread(image_file)
+            if image is None:
+                return cv2.IMREAD_COLOR
+            h, w = image.shape[:2]
+            factor = 1
+            while factor < 8 and w // (factor * 2) >= self.display_size[0] and h // (factor * 2) >= self.display_size[1]:
+                factor *= 2
+            self._reduce[split] = factor
+        return REDUCED_FLAGS[self._reduce[split]]
+
+    def render(self, idx, split=None):
+        """Labelled frame ``idx`` of ``split``, resized to the display size."""
+        split = split or self.split
+        images_folder, image_names, labels = self.load_split(split)
+        image_file = os.path.join(images_folder, image_names[idx])
+        image = cv2.imread(image_file, self._reduction(split, image_file))
+        if image is None:
+            image = np.zeros((self.display_size[1], self.display_size[0], 3), dtype=np.uint8)
+        image = cv2.resize(image, self.display_size)
+        width, height = self.display_size
+        for class_index, x, y, w, h in labels.labels(os.path.splitext(image_names[idx])[0]).tolist():
+            cx, cy, w, h = int(x * width), int(y * height), int(w * width), int(h * height)
             x = cx - w // 2
             y = cy - h // 2
             cv2.rectangle(image, (x, y), (x + w, y + h), (0, 255, 0), 2)
-            cv2.putText(image, self.classes[int(class_index)], (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
+            cv2.putText(image, self.classes.get(int(class_index), str(int(class_index))), (x, y - 10),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
         return image
 
+    def _cached(self, split, idx):
+        with self._lock:
+            frame = self._cache.get((split, idx))
+            if frame is not None:
+                self._cache.move_to_end((split, idx))
+            return frame
+
+    def _remember(self, split, idx, frame):
+        with self._lock:
+            self._cache[(split, idx)] = frame
+            self._cache.move_to_end((split, idx))
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def seek_frame(self, idx):
+        frame = self._cached(self.split, idx)
+        if frame is None:
+            frame = self.render(idx)
+            self._remember(self.split, idx, frame)
+        if self._prefetcher is not None:
+            self._request_prefetch(idx)
+        return frame
+
+    # ---------------- prefetching ----------------
+    def _start_prefetch(self):
+        if self._prefetcher is None:
+            self._prefetcher = threading.Thread(target=self._prefetch_loop, name="visualizer-prefetch", daemon=True)
+            self._prefetcher.start()
+
+    def _request_prefetch(self, idx):
+        ahead = [(idx + self.direction * k) % self.num_images for k in range(1, self.prefetch + 1)]
+        behind = [(idx - self.direction * k) % self.num_images for k in range(1, PREFETCH_BEHIND + 1)]
+        with self._wanted:
+            # Newer requests replace older ones: only the frames around the current position matter
+            self._targets = [(self.split, i) for i in ahead + behind]
+            self._wanted.notify()
+
+    def _prefetch_loop(self):
+        while True:
+            with self._wanted:
+                while not self._targets and not self._closed:
+                    self._wanted.wait()
+                if self._closed:
+                    return
+                split, idx = self._targets.pop(0)
+            if self._cached(split, idx) is None:
+                try:
+                    self._remember(split, idx, self.render(idx, split))
+                except Exception as exc:
+                    print(f"⚠️  Prefetch of frame {idx} failed: {exc}")
+
+    def close(self):
+        with self._wanted:
+            self._closed = True
+            self._wanted.notify()
+
     def run(self):
+        self._start_prefetch()
         while True:
             frame = self.seek_frame(self.frame_index)
-            frame = cv2.resize(frame, (640, 480))
             cv2.imshow(f"Yolo Visualizer {self.dataset_folder}", frame)
             key = cv2.waitKey(0)
             if key == ord('q') or key == 27 or key == -1:
@@ -77,9 +183,80 @@ class YoloVisualizer:
                 self.set_mode(YoloVisualizer.MODE_TRAIN)
             elif key == ord('v'):
                 self.set_mode(YoloVisualizer.MODE_VAL)
+        self.close()
         cv2.destroyAllWindows()
 
+    # ---------------- headless export ----------------
+    def iter_rendered(self, split, workers=None, window=64):
+        """Render every frame of ``split`` on a thread pool (OpenCV releases the GIL), in order."""
+        _, image_names, _ = self.load_split(split)
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            pending = []
+            for idx in range(len(image_names)):
+                pending.append(pool.submit(self.render, idx, split))
+                # A bounded window keeps memory flat while the writer catches up
+                if len(pending) >= window:
+                    yield pending.pop(0).result()
+            for future in pending:
+                yield future.result()
+
+    def export_video(self, split, output, fps=10, workers=None):
+        width, height = self.display_size
+        writer = cv2.VideoWriter(output, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+        count = 0
+        for frame in self.iter_rendered(split, workers):
+            writer.write(frame)
+            count += 1
+        writer.release()
+        return count
+
+    def export_contact_sheets(self, split, output_dir, columns=6, rows=5, thumb_width=320, workers=None):
+        """Tile the split into JPEG pages of ``columns x rows`` thumbnails. Returns the page paths."""
+        os.makedirs(output_dir, exist_ok=True)
+        thumb_height = thumb_width * self.display_size[1] // self.display_size[0]
+        per_page = columns * rows
+        pages, tiles = [], []
+
+        def flush():
+            sheet = np.zeros((rows * thumb_height, columns * thumb_width, 3), dtype=np.uint8)
+            for i, tile in enumerate(tiles):
+                r, c = divmod(i, columns)
+                sheet[r * thumb_height:(r + 1) * thumb_height, c * thumb_width:(c + 1) * thumb_width] = tile
+            path = os.path.join(output_dir, f"{split}_sheet_{len(pages):04d}.jpg")
+            cv2.imwrite(path, sheet, [cv2.IMWRITE_JPEG_QUALITY, 85])
+            pages.append(path)
+            tiles.clear()
+
+        _, image_names, _ = self.load_split(split)
+        for idx, frame in enumerate(self.iter_rendered(split, workers)):
+            tile = cv2.resize(frame, (thumb_width, thumb_height), interpolation=cv2.INTER_AREA)
+            cv2.putText(tile, image_names[idx], (5, 15), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)
+            tiles.append(tile)
+            if len(tiles) == per_page:
+                flush()
+        if tiles:
+            flush()
+        return pages
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Browse or export a split with its YOLO labels drawn.")
+    parser.add_argument('--export', choices=['sheet', 'video'], help="render the whole split headlessly instead of browsing")
+    parser.add_argument('--split', default='test')
+    parser.add_argument('--out', help="output folder (sheet) or .mp4 file (video)")
+    parser.add_argument('--fps', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
     vis = YoloVisualizer(os.path.join(os.path.dirname(__file__), "data"))
-    vis.run()
+    if args.export == 'video':
+        out = args.out or f"{args.split}_labels.mp4"
+        n = vis.export_video(args.split, out, fps=args.fps, workers=args.workers)
+        print(f"🎞️ Wrote {n} frames to {out}")
+    elif args.export == 'sheet':
+        out = args.out or f"{args.split}_sheets"
+        pages = vis.export_contact_sheets(args.split, out, workers=args.workers)
+        print(f"🖼️ Wrote {len(pages)} contact sheets to {out}")
+    else:
+        vis.run()
+    vis.close()